@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+import config
+import dictdb
+from lookup_cache import LookupCache
+
+
+class Associations(object):
+    '''Phrases likely to follow committed text, from the associations table
+    built with the dictionary (see dictdb.build_associations()).
+
+    Only phrases of charset are offered. The phrases of a character are read
+    with a single keyed query the first time they are needed, and then kept
+    in a LookupCache.
+
+    The queries run on the main loop, on a read-only connection to db_file
+    of their own: on the engine's connection they would wait for the
+    lookups of the worker thread.
+    '''
+
+    def __init__(self, db_file, charset=dictdb.CHARSET_FULL, cache_size=config.ASSOCIATION_CACHE_SIZE):
+        # Opened by the thread loading the dictionary, used by the main loop
+        self.conn = dictdb.connect_existing(db_file, readonly=True, check_same_thread=False)
+        self.charset = charset
+        self.cache = LookupCache(cache_size)
+        # Commits after which no association was shown, as the key had
+        # already used its time budget
+        self.overruns = 0
+
+    def _phrases(self, first):
+        phrases = self.cache.get(first)
+        if phrases is None:
+            row = self.conn.execute(dictdb.ASSOCIATION_QUERY, (self.charset, first)).fetchone()
+            phrases = row[0].split('\t') if row else []
+            self.cache.put(first, phrases)
+        return phrases
+
+    def close(self):
+        self.conn.close()
+
+    def lookup(self, text, limit):
+        '''Return up to limit continuations of text: the rest of the phrases
+        starting with text or, if there are none, with its last character.
+        '''
+        for prefix in ([text] if len(text) == 1 else [text, text[-1]]):
+            found = [phrase[len(prefix):] for phrase in self._phrases(prefix[0])
+                     if len(phrase) > len(prefix) and phrase.startswith(prefix)]
+            if found:
+                return found[:limit]
+        return []
+
+    def __str__(self):
+        return 'Associations(cache {}, overruns {})'.format(self.cache, self.overruns)
@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+'''Keystroke replay benchmark for IbusWubiEngine.
+
+Replays key traces (see traces/*.trace) through do_process_key_event and the
+idle update_candidates callbacks, headless on top of ibus_stub, and reports
+per-key latency percentiles, the time until the candidates are first shown,
+SQLite queries per key and allocations per key as JSON, so that results can
+be compared across commits:
+
+    python3 benchmark.py --output bench.json
+
+A trace is a text file of whitespace separated tokens, "#" starting a
+comment. A token is either a key name of ibus_stub.KEYVALS (space,
+BackSpace, Page_Down, 1, Shift_L, ...), pressed and released, or a word of
+letters, each of which is typed in turn.
+'''
+import argparse
+import gc
+import glob
+import json
+import logging
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import ibus_stub
+
+IBus = ibus_stub.install()
+
+import composer  # noqa: E402
+import config  # noqa: E402
+import dictdb  # noqa: E402
+import iwubi  # noqa: E402  (needs the stub installed first)
+import logconfig  # noqa: E402
+import stats  # noqa: E402
+from associations import Associations  # noqa: E402
+from lookup_worker import LookupWorker  # noqa: E402
+
+__base_dir__ = os.path.dirname(os.path.abspath(__file__))
+logger = logconfig.get_logger()
+
+# Seconds between runs of the idle callbacks while the worker is busy
+WORKER_POLL_INTERVAL = 0.0002
+
+
+def read_trace(path):
+    '''Return the list of (keyval, state) events of a trace file.'''
+    events = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            for token in line.split('#', 1)[0].split():
+                if token in ibus_stub.KEYVALS:
+                    keyvals = [ibus_stub.KEYVALS[token]]
+                elif token.isalpha() and token.isascii():
+                    keyvals = [ibus_stub.KEYVALS[c] for c in token]
+                else:
+                    raise ValueError('{}: unknown token {!r}'.format(path, token))
+                for keyval in keyvals:
+                    events.append((keyval, 0))
+                    events.append((keyval, IBus.ModifierType.RELEASE_MASK))
+    return events
+
+
+def new_engine():
+    engine = iwubi.IbusWubiEngine()
+    # Start in Chinese mode, Shift_L in a trace toggles it
+    engine.set_input_mode(1)
+    return engine
+
+
+def press(engine, keyval, state):
+    '''Send a key event and run the idle callbacks it queued.
+
+    Returns the time in seconds the main loop was busy with the key, or
+    None if the engine raised. engine.table_shown is then when the
+    candidates were first updated, None if they were not. Like PyGObject does for a vfunc, the
+    exception is logged and the replay goes on.
+    '''
+    worker = iwubi.context.worker
+    engine.table_shown = None
+    try:
+        start = time.perf_counter()
+        engine.do_process_key_event(keyval, 0, state)
+        # What the main loop runs right after the key, i.e. update_candidates
+        ibus_stub.run_idle()
+        busy = time.perf_counter() - start
+        if worker is not None:
+            # The worker thread is not the main loop, only showing its
+            # results is. They are shown as they come, e.g. the Wubi tier
+            # while the pinyin one is looked up.
+            done = False
+            while not done:
+                done = worker.wait_idle(WORKER_POLL_INTERVAL)
+                start = time.perf_counter()
+                ibus_stub.run_idle()
+                busy += time.perf_counter() - start
+    except Exception as e:
+        logger.warning('Error processing keyval {:#x}: {!r}'.format(keyval, e))
+        del ibus_stub.pending[:]
+        return None
+    return busy
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    k = (len(values) - 1) * p / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def replay(events, repeat=1, with_stages=False):
+    '''Replay events and return the metrics of the key presses.
+
+    with_stages adds the stats.py stage timings of the timing pass.
+    '''
+    # Timing pass. The first repeat also warms up caches, which is what
+    # a real session looks like after a few seconds of typing.
+    dictionary = iwubi.context.dictionary
+    engine = new_engine()
+    latencies = []
+    # From the key to the first update of the candidates, for the keys
+    # that updated them
+    first_shown = []
+    queries = 0
+    presses = 0
+    errors = 0
+    gc.collect()
+    stats.reset()
+    iwubi.context.pinyin_overruns = 0
+    for _ in range(repeat):
+        for keyval, state in events:
+            query_count = dictionary.query_count
+            start = time.perf_counter()
+            elapsed = press(engine, keyval, state)
+            if elapsed is None:
+                errors += 1
+            elif not state & IBus.ModifierType.RELEASE_MASK:
+                latencies.append(elapsed * 1e6)
+                if engine.table_shown is not None:
+                    first_shown.append((engine.table_shown - start) * 1e6)
+            if not state & IBus.ModifierType.RELEASE_MASK:
+                presses += 1
+            queries += dictionary.query_count - query_count
+    stages = stats.snapshot() if with_stages else None
+    pinyin_overruns = iwubi.context.pinyin_overruns
+
+    # Allocation pass, separate because tracing slows everything down
+    engine = new_engine()
+    alloc_peak = 0
+    alloc_blocks = 0
+    tracemalloc.start()
+    try:
+        for keyval, state in events:
+            tracemalloc.reset_peak()
+            current = tracemalloc.get_traced_memory()[0]
+            blocks = sys.getallocatedblocks()
+            press(engine, keyval, state)
+            alloc_peak += tracemalloc.get_traced_memory()[1] - current
+            alloc_blocks += sys.getallocatedblocks() - blocks
+    finally:
+        tracemalloc.stop()
+    traced_presses = presses // repeat or 1
+
+    results = {
+        'keys': presses // repeat,
+        'p50_us': round(percentile(latencies, 50), 1),
+        'p95_us': round(percentile(latencies, 95), 1),
+        'p99_us': round(percentile(latencies, 99), 1),
+        'max_us': round(max(latencies or [0]), 1),
+        'mean_us': round(sum(latencies) / (presses or 1), 1),
+        'first_shown_p50_us': round(percentile(first_shown, 50), 1),
+        'first_shown_p95_us': round(percentile(first_shown, 95), 1),
+        'queries_per_key': round(queries / (presses or 1), 3),
+        # Peak traced bytes allocated while handling a key, and the net
+        # number of memory blocks it left allocated
+        'alloc_peak_bytes_per_key': round(alloc_peak / traced_presses, 1),
+        'alloc_blocks_per_key': round(alloc_blocks / traced_presses, 2),
+        'messages_per_key': round(engine.messages / traced_presses, 2),
+        'committed': len(engine.committed),
+        # Keys whose pinyin candidates missed config.PINYIN_BUDGET_MS
+        'pinyin_overruns': pinyin_overruns // repeat,
+        'errors': errors // repeat,
+    }
+    if stages is not None:
+        results['stages'] = stages
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=__base_dir__,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Replay key traces through the iWubi engine.')
+    parser.add_argument('traces', nargs='*',
+                        help='trace files (default: traces/*.trace)')
+    parser.add_argument('--db', default=os.path.join(__base_dir__, 'wubi-jidian86.db'),
+                        help='dictionary (default: %(default)s)')
+    parser.add_argument('--charset', choices=dictdb.CHARSETS, default='full',
+                        help='charset of the candidates, as config.CHARSET (default: %(default)s)')
+    parser.add_argument('--sqlite', action='store_true',
+                        help='ignore the compiled dictionary and serve lookups from SQLite')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='times each trace is replayed for timing (default: %(default)s)')
+    parser.add_argument('--log-level', default='WARNING',
+                        help='engine log level while replaying (default: %(default)s)')
+    parser.add_argument('--worker', action='store_true',
+                        help='run lookups on a LookupWorker thread, as the engine does; latencies are '
+                             'then the time the main loop is busy')
+    parser.add_argument('--associations', action='store_true',
+                        help='show associations after each commit, as config.ASSOCIATION_ENABLED does')
+    parser.add_argument('--pinyin-budget', type=float, metavar='MS', default=config.PINYIN_BUDGET_MS,
+                        help='show pinyin candidates in a second update due within MS, as '
+                             'config.PINYIN_BUDGET_MS (default: %(default)s)')
+    parser.add_argument('--untiered', action='store_true',
+                        help='look pinyin up with the Wubi candidates, as PINYIN_BUDGET_MS = None')
+    parser.add_argument('--stats', action='store_true',
+                        help='also report the per-stage timings of stats.py for each trace')
+    parser.add_argument('-o', '--output', help='write the JSON results to this file instead of stdout')
+    args = parser.parse_args(argv)
+
+    logging.getLogger().setLevel(args.log_level)
+    config.PINYIN_BUDGET_MS = None if args.untiered else args.pinyin_budget
+
+    conn = sqlite3.connect(args.db, check_same_thread=False)
+    start = time.perf_counter()
+    charset = dictdb.CHARSETS.index(args.charset)
+    if args.sqlite:
+        dictionary = dictdb.SqliteDictionary(conn, composer.IWubi.table_size, charset)
+    else:
+        dictionary = composer.load_dictionary(conn, args.db, composer.IWubi.table_size, charset)
+    iwubi.context.dictionary = dictionary
+    if args.worker:
+        iwubi.context.worker = LookupWorker()
+    if args.associations:
+        iwubi.context.associations = Associations(args.db, charset)
+    if args.stats:
+        iwubi.enable_stats()
+    load_time = time.perf_counter() - start
+
+    results = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'dictionary': str(dictionary),
+        'worker': args.worker,
+        'associations': args.associations,
+        'pinyin_budget_ms': config.PINYIN_BUDGET_MS,
+        'load_s': round(load_time, 3),
+        'traces': {},
+    }
+    for path in args.traces or sorted(glob.glob(os.path.join(__base_dir__, 'traces', '*.trace'))):
+        name = os.path.splitext(os.path.basename(path))[0]
+        results['traces'][name] = replay(read_trace(path), args.repeat, args.stats)
+
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+import heapq
+import sqlite3
+import threading
+
+import logconfig
+from user_freq import file_id
+
+logger = logconfig.get_logger()
+
+# Written with the current count, so a pair flushed twice is never counted twice
+FLUSH_QUERY = '''INSERT INTO bigrams (prev, phrase, count) VALUES (?, ?, ?)
+    ON CONFLICT (prev, phrase) DO UPDATE SET count = excluded.count'''
+DELETE_QUERY = 'DELETE FROM bigrams WHERE prev = ? AND phrase = ?'
+LOAD_QUERY = '''SELECT prev, phrase, count
+    FROM bigrams
+    ORDER BY count DESC
+    LIMIT ?'''
+
+# Separates the two phrases of a pair in the keys of counts
+_SEP = '\t'
+
+
+class BigramModel(object):
+    '''Counts of which phrase was committed right after which, learned from
+    the committed candidates and used to reorder the first page.
+
+    counts is a single dict keyed by 'prev<TAB>phrase', holding at most
+    capacity pairs plus a quarter of slack. Past capacity the writer thread
+    evicts the rarest pairs, the oldest first among equal counts, down to
+    three quarters of capacity. A pair first seen while the slack is used
+    up is dropped, so memory stays bounded however long a session runs.
+
+    Like UserFreqRecorder, record() only touches memory. The writer thread
+    has its own connection and writes the pairs changed since the last
+    flush, and deletes the evicted ones, in one transaction every
+    flush_interval seconds, once batch_size pairs are pending, on flush()
+    and on close(), reconnecting first if the file was replaced.
+    '''
+
+    def __init__(self, db_file, capacity=20000, flush_interval=30, batch_size=20):
+        self.db_file = db_file
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.counts = {}
+        # prev -> number of its pairs in counts, so that rerank() after a
+        # phrase that was never followed by anything is a single dict miss
+        self._prevs = {}
+        # Keys changed, and keys evicted, since the last flush
+        self._dirty = set()
+        self._evicted = set()
+        self.evicted = 0
+        self.dropped = 0
+        self.flushed = 0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closing = False
+        self._flush_failed = False
+        self._thread = threading.Thread(target=self._run, name='iwubi-bigram', daemon=True)
+        self._thread.start()
+
+    def record(self, prev, phrase):
+        '''Count phrase as committed right after prev.'''
+        key = prev + _SEP + phrase
+        with self._lock:
+            count = self.counts.get(key)
+            if count is None:
+                if len(self.counts) >= self.capacity + self.capacity // 4:
+                    self.dropped += 1
+                    return
+                count = 0
+                self._prevs[prev] = self._prevs.get(prev, 0) + 1
+            self.counts[key] = count + 1
+            self._dirty.add(key)
+            self._evicted.discard(key)
+            wakeup = len(self._dirty) >= self.batch_size or len(self.counts) > self.capacity
+        if wakeup:
+            self._wakeup.set()
+
+    def rerank(self, prev, candidates, boundary, limit):
+        '''Return candidates, a list of (phrase, display), with those of the
+        first limit that followed prev most often moved first.
+
+        Candidates before and after boundary are reordered separately, so
+        Wubi and pinyin candidates stay apart. The others keep their order.
+        '''
+        if prev not in self._prevs:
+            return candidates
+        counts = self.counts
+        prefix = prev + _SEP
+        head = candidates[:limit]
+        scores = [counts.get(prefix + candidate[0], 0) for candidate in head]
+        if not any(scores):
+            return candidates
+        order = sorted(range(len(head)), key=lambda i: (i >= boundary, -scores[i]))
+        return [head[i] for i in order] + candidates[limit:]
+
+    def flush(self):
+        '''Ask the writer thread to flush now. Does not wait.'''
+        self._wakeup.set()
+
+    def close(self):
+        '''Flush what is pending and stop the writer thread.'''
+        self._closing = True
+        self._wakeup.set()
+        self._thread.join()
+
+    def __str__(self):
+        return 'BigramModel({} pairs, {} evicted, {} dropped)'.format(
+            len(self.counts), self.evicted, self.dropped)
+
+    def _run(self):
+        try:
+            conn = sqlite3.connect(self.db_file)
+        except sqlite3.Error as e:
+            logger.warning('Bigrams disabled, cannot open {}: {}'.format(self.db_file, e))
+            return
+        opened = file_id(self.db_file)
+        try:
+            self._load(conn)
+            while not self._closing:
+                self._wakeup.wait(self.flush_interval)
+                self._wakeup.clear()
+                self._evict()
+                if file_id(self.db_file) not in (opened, None):
+                    conn.close()
+                    conn = sqlite3.connect(self.db_file)
+                    opened = file_id(self.db_file)
+                self._flush(conn)
+            self._flush(conn)
+        finally:
+            conn.close()
+
+    def _load(self, conn):
+        try:
+            loaded = conn.execute(LOAD_QUERY, (self.capacity,)).fetchall()
+        except sqlite3.Error as e:
+            logger.warning('Cannot load bigrams: {}'.format(e))
+            return
+        with self._lock:
+            for prev, phrase, count in loaded:
+                key = prev + _SEP + phrase
+                if key not in self.counts:
+                    self._prevs[prev] = self._prevs.get(prev, 0) + 1
+                # Pairs recorded before the load are flushed with the sum
+                self.counts[key] = self.counts.get(key, 0) + count
+        logger.info('Loaded {} bigrams'.format(len(loaded)))
+
+    def _evict(self):
+        with self._lock:
+            if len(self.counts) <= self.capacity:
+                return
+            items = list(self.counts.items())
+        # Chosen outside the lock, the main thread may record meanwhile.
+        # nsmallest() is stable, dicts keep insertion order.
+        excess = len(items) - self.capacity * 3 // 4
+        victims = heapq.nsmallest(excess, items, key=lambda item: item[1])
+        with self._lock:
+            for key, count in victims:
+                if self.counts.get(key) != count:
+                    # Seen again since
+                    continue
+                del self.counts[key]
+                prev = key.split(_SEP, 1)[0]
+                left = self._prevs[prev] - 1
+                if left:
+                    self._prevs[prev] = left
+                else:
+                    del self._prevs[prev]
+                self._dirty.discard(key)
+                self._evicted.add(key)
+                self.evicted += 1
+        logger.debug('Evicted {} bigrams'.format(len(victims)))
+
+    def _flush(self, conn):
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            evicted, self._evicted = self._evicted, set()
+            rows = [tuple(key.split(_SEP, 1)) + (self.counts[key],) for key in dirty]
+        if not rows and not evicted:
+            return
+        try:
+            with conn:
+                conn.executemany(FLUSH_QUERY, rows)
+                conn.executemany(DELETE_QUERY, (key.split(_SEP, 1) for key in evicted))
+        except sqlite3.Error as e:
+            # e.g. the dictionary is read-only. Keep the changes for the next
+            # attempt, reranking goes on from counts meanwhile.
+            if not self._flush_failed:
+                logger.warning('Cannot flush bigrams: {}'.format(e))
+                self._flush_failed = True
+            with self._lock:
+                self._dirty.update(key for key in dirty if key in self.counts)
+                self._evicted.update(key for key in evicted if key not in self.counts)
+            return
+        self._flush_failed = False
+        self.flushed += len(rows)
+        logger.debug('Flushed {} bigrams, deleted {}'.format(len(rows), len(evicted)))
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+'''Build the pinyin part of the iWubi dictionary.
+
+Streams pinyin_simp.dict.csv into the pinyins table of wubi-jidian86.db. The
+rebuild happens in place, in a single journaled transaction, so a failed or
+interrupted build leaves the dictionary untouched and the command can be
+re-run at any time. The engine keeps reading the old tables meanwhile, and
+the user_freq and bigram writers of a running engine wait for the
+transaction, or retry their flush later, rather than write to a file that
+is about to be replaced.
+'''
+import argparse
+import os
+import sqlite3
+import sys
+import time
+
+import dictdb
+from compiled_dict import compile_charsets
+
+# Speed up the build without giving up the rollback journal
+BUILD_PRAGMAS = (
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA cache_size = -65536',
+)
+
+
+def build_dictionary(db_file, csv_file, max_errors=0):
+    '''Rebuild the pinyins table of db_file from csv_file.
+
+    Returns (rows, errors), errors being the (line number, message) of each
+    skipped line. Raises ValueError and leaves db_file unchanged if there
+    are more than max_errors of them.
+    '''
+    conn = sqlite3.connect(db_file, isolation_level=None)
+    try:
+        for pragma in BUILD_PRAGMAS:
+            conn.execute(pragma)
+        dictdb.migrate(conn)
+        errors = []
+        cursor = conn.cursor()
+        # The write lock up front: a flush of the engine waits for the
+        # build, the build never fails half way on a lock
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            rows = dictdb.build_pinyins(cursor, dictdb.read_pinyin_csv(csv_file, errors))
+            if len(errors) > max_errors:
+                raise ValueError('{}: {} malformed lines, first at line {}: {}'.format(
+                    csv_file, len(errors), errors[0][0], errors[0][1]))
+        except BaseException:
+            cursor.execute('ROLLBACK')
+            raise
+        cursor.execute('COMMIT')
+    finally:
+        conn.close()
+    return rows, errors
+
+
+def main(argv=None):
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description='Build the pinyin tables of the iWubi dictionary.')
+    parser.add_argument('--db', default=os.path.join(base_dir, 'wubi-jidian86.db'),
+                        help='Wubi dictionary to update (default: %(default)s)')
+    parser.add_argument('--csv', default=os.path.join(base_dir, 'pinyin_simp.dict.csv'),
+                        help='pinyin dictionary (default: %(default)s)')
+    parser.add_argument('--max-errors', type=int, default=0,
+                        help='number of malformed lines to skip before failing (default: %(default)s)')
+    parser.add_argument('--compile', action='store_true',
+                        help='also compile the memory-mapped dictionary')
+    args = parser.parse_args(argv)
+
+    start = time.time()
+    try:
+        rows, errors = build_dictionary(args.db, args.csv, args.max_errors)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+    elapsed = time.time() - start
+    for line, message in errors:
+        print('{}:{}: skipped: {}'.format(args.csv, line, message), file=sys.stderr)
+    print('{}: {} pinyin rows in {:.3f}s ({:.0f} rows/s)'.format(
+        args.db, rows, elapsed, rows / max(elapsed, 1e-9)))
+
+    if args.compile:
+        for output, size, seconds in compile_charsets(args.db):
+            print('{}: {} bytes in {:.2f}s'.format(output, size, seconds))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,451 @@
+# -*- coding: utf-8 -*-
+'''Compiled, memory-mapped form of the iWubi dictionary.
+
+compile_dictionary() turns the Wubi and pinyin phrases of wubi-jidian86.db
+into a versioned binary file of sorted string id arrays, offset tables and a
+UTF-8 string pool. CompiledDictionary mmaps that file read-only and searches
+it in place, so opening it costs almost nothing and its pages are shared by
+every process that uses it.
+'''
+import argparse
+import array
+import heapq
+import json
+import mmap
+import os
+import sqlite3
+import struct
+import sys
+import time
+
+import config
+import dictdb
+from wubi_index import PositionIndex, WubiIndex
+
+MAGIC = b'IWUBIDIC'
+# Bump whenever the layout or the meaning of a section changes
+FORMAT_VERSION = 6
+
+# magic, format version, number of sections
+_HEADER = struct.Struct('<8sII')
+# name, offset and length in bytes of a section
+_SECTION = struct.Struct('<32sQQ')
+_ALIGN = 8
+
+# Every section but meta (JSON), pool (UTF-8 bytes) and wubi_key_bits is an
+# array of native uint32. Strings are referred to by id, string i being
+# pool[str_offsets[i]:str_offsets[i + 1]].
+#
+# wubi_prefix            string ids of all Wubi code prefixes, sorted
+# wubi_exact_offsets     per prefix, range of wubi_exact
+# wubi_exact             phrases whose tabkeys equal the prefix, by freq
+# wubi_exact_freqs       freq of each of wubi_exact
+# wubi_ext_offsets       per prefix, range of wubi_ext_*
+# wubi_ext_codes         top-k (tabkeys, phrase, freq) extending the prefix,
+# wubi_ext_phrases       by freq
+# wubi_ext_freqs
+# wubi_ext_count         per prefix, number of rows extending it
+# wubi_unique            per prefix, 1 + string id of its phrase if it is the
+#                        only candidate (see unique_candidate()), else 0
+# wubi_row_codes         tabkeys of every freq > 0 Wubi row, sorted
+# wubi_row_phrases       phrase of each Wubi row
+# wubi_row_freqs         freq of each Wubi row
+# wubi_row_ranks         rank of each Wubi row in freq DESC order
+# wubi_rank_rows         Wubi row of each rank
+# wubi_key_bits          the bitsets of PositionIndex, by position then key,
+#                        each of (number of Wubi rows + 7) // 8 bytes
+# code_phrases           phrases with a Wubi code, sorted
+# code_tabkeys           shortest Wubi code of each of code_phrases
+# pinyin_keys            pinyin of every freq > 0 pinyin row, sorted
+# pinyin_phrases         phrase of each pinyin row
+# pinyin_ranks           rank of each pinyin row in freq DESC order
+# pinyin_prefix          pinyin prefixes up to pinyin_prefix_max_len, sorted
+# pinyin_top_offsets     per prefix, range of pinyin_top
+# pinyin_top             top-N pinyin rows (indexes) of each prefix, by freq
+_ARRAYS = ('str_offsets',
+           'wubi_prefix', 'wubi_exact_offsets', 'wubi_exact', 'wubi_exact_freqs', 'wubi_ext_offsets',
+           'wubi_ext_codes', 'wubi_ext_phrases', 'wubi_ext_freqs', 'wubi_ext_count', 'wubi_unique',
+           'wubi_row_codes', 'wubi_row_phrases', 'wubi_row_freqs', 'wubi_row_ranks', 'wubi_rank_rows',
+           'code_phrases', 'code_tabkeys',
+           'pinyin_keys', 'pinyin_phrases', 'pinyin_ranks',
+           'pinyin_prefix', 'pinyin_top_offsets', 'pinyin_top')
+
+
+def compiled_path(db_file, charset=dictdb.CHARSET_FULL):
+    '''Return the path of the compiled form of db_file for charset:
+    wubi-jidian86.bin for every character, wubi-jidian86.gb2312.bin...
+    '''
+    base = os.path.splitext(db_file)[0]
+    if charset == dictdb.CHARSET_FULL:
+        return base + '.bin'
+    return '{}.{}.bin'.format(base, dictdb.CHARSETS[charset])
+
+
+class _Pool(object):
+    # Deduplicating UTF-8 string pool
+
+    def __init__(self):
+        self.ids = {}
+        self.data = bytearray()
+        self.offsets = array.array('I', [0])
+
+    def id(self, s):
+        i = self.ids.get(s)
+        if i is None:
+            i = self.ids[s] = len(self.offsets) - 1
+            self.data += s.encode('utf-8')
+            self.offsets.append(len(self.data))
+        return i
+
+
+def _utf8_sorted(strings):
+    # Ordered by UTF-8 bytes, which is the order the reader's binary search
+    # compares in
+    return sorted(strings, key=lambda s: s.encode('utf-8'))
+
+
+# Pinyin rows of a charset, ranked like ORDER BY freq DESC, id
+PINYIN_ROWS_QUERY = '''SELECT id, phrase, pinyin, freq
+    FROM pinyins
+    WHERE freq > 0 AND charset <= ?
+    ORDER BY freq DESC, id'''
+
+
+def compile_dictionary(db_file, output, charset=dictdb.CHARSET_FULL,
+                       max_len=config.PINYIN_PREFIX_MAX_LEN,
+                       top_n=config.PINYIN_PREFIX_TOP_N):
+    '''Compile the phrases of charset of db_file into output. Returns the
+    output size.
+    '''
+    conn = sqlite3.connect(db_file)
+    try:
+        cursor = conn.cursor()
+        stamp = dictdb.dictionary_stamp(cursor)
+        if stamp is None or dictdb.schema_version(cursor) < dictdb.SCHEMA_VERSION:
+            raise ValueError('{} is not up to date, run "dictdb.py migrate" first'.format(db_file))
+        wubi = WubiIndex.from_db(cursor, charset=None if charset == dictdb.CHARSET_FULL else charset)
+        # The pinyins table, not pinyin_simp.dict.csv, holds the freq that
+        # train_freq.py trains
+        rows = cursor.execute(PINYIN_ROWS_QUERY, (charset,)).fetchall()
+    finally:
+        conn.close()
+
+    pool = _Pool()
+    arrays = dict((name, array.array('I')) for name in _ARRAYS)
+
+    # Pinyin prefixes up to the Wubi code length, a code starting a pinyin
+    # is never a unique candidate
+    pinyin_prefixes = set(row[2][:i] for row in rows for i in range(1, PositionIndex.MAX_CODE_LEN + 1))
+
+    # Wubi prefix index
+    nodes = dict((node[0], node) for node in wubi.nodes())
+    nodes = [nodes[prefix] for prefix in _utf8_sorted(nodes)]
+    arrays['wubi_exact_offsets'].append(0)
+    arrays['wubi_ext_offsets'].append(0)
+    for prefix, exact, extensions, extension_count in nodes:
+        arrays['wubi_prefix'].append(pool.id(prefix))
+        for phrase, freq in exact:
+            arrays['wubi_exact'].append(pool.id(phrase))
+            arrays['wubi_exact_freqs'].append(freq)
+        arrays['wubi_exact_offsets'].append(len(arrays['wubi_exact']))
+        for tabkeys, phrase, freq in extensions:
+            arrays['wubi_ext_codes'].append(pool.id(tabkeys))
+            arrays['wubi_ext_phrases'].append(pool.id(phrase))
+            arrays['wubi_ext_freqs'].append(freq)
+        arrays['wubi_ext_offsets'].append(len(arrays['wubi_ext_codes']))
+        arrays['wubi_ext_count'].append(extension_count)
+        unique = wubi.unique(prefix)
+        if unique is None or prefix in pinyin_prefixes:
+            arrays['wubi_unique'].append(0)
+        else:
+            arrays['wubi_unique'].append(pool.id(unique) + 1)
+
+    # Every Wubi row, for paging past the top-k extensions. Codes are ASCII,
+    # so tabkeys order is UTF-8 order.
+    wubi_rows = list(wubi.rows_by_code())
+    rank_rows = [0] * len(wubi_rows)
+    codes = [None] * len(wubi_rows)
+    for row, (rank, tabkeys, phrase, freq) in enumerate(wubi_rows):
+        arrays['wubi_row_codes'].append(pool.id(tabkeys))
+        arrays['wubi_row_phrases'].append(pool.id(phrase))
+        arrays['wubi_row_freqs'].append(freq)
+        arrays['wubi_row_ranks'].append(rank)
+        rank_rows[rank] = row
+        codes[rank] = tabkeys
+    arrays['wubi_rank_rows'].extend(rank_rows)
+    # Wildcard matching
+    key_bits = bytearray()
+    for position in PositionIndex.bitsets(codes):
+        for bits in position:
+            key_bits += bits
+
+    # phrase -> shortest Wubi code
+    codes = dict(wubi.codes())
+    for phrase in _utf8_sorted(codes):
+        arrays['code_phrases'].append(pool.id(phrase))
+        arrays['code_tabkeys'].append(pool.id(codes[phrase]))
+
+    # index in rank order -> position in pinyin order
+    order = sorted(range(len(rows)), key=lambda rank: (rows[rank][2].encode('utf-8'), rank))
+    position = [0] * len(rows)
+    for pos, rank in enumerate(order):
+        arrays['pinyin_keys'].append(pool.id(rows[rank][2]))
+        arrays['pinyin_phrases'].append(pool.id(rows[rank][1]))
+        arrays['pinyin_ranks'].append(rank)
+        position[rank] = pos
+    prefixes = {}
+    for rank, (row_id, phrase, pinyin, freq) in enumerate(rows):
+        for i in range(1, min(len(pinyin), max_len) + 1):
+            top = prefixes.setdefault(pinyin[:i], [])
+            if len(top) < top_n:
+                top.append(position[rank])
+    arrays['pinyin_top_offsets'].append(0)
+    for prefix in _utf8_sorted(prefixes):
+        arrays['pinyin_prefix'].append(pool.id(prefix))
+        arrays['pinyin_top'].extend(prefixes[prefix])
+        arrays['pinyin_top_offsets'].append(len(arrays['pinyin_top']))
+
+    arrays['str_offsets'] = pool.offsets
+    meta = {
+        'dict_stamp': stamp,
+        'byteorder': sys.byteorder,
+        'pinyin_prefix_max_len': max_len,
+        'pinyin_prefix_top_n': top_n,
+        'charset': charset,
+    }
+    sections = [('meta', json.dumps(meta).encode('utf-8')), ('pool', bytes(pool.data)),
+                ('wubi_key_bits', bytes(key_bits))]
+    sections.extend((name, arrays[name].tobytes()) for name in _ARRAYS)
+
+    # Write to a temporary file and rename it, so that a running engine
+    # never maps a half written file
+    tmp = output + '.tmp'
+    with open(tmp, 'wb') as f:
+        offset = _HEADER.size + _SECTION.size * len(sections)
+        f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, len(sections)))
+        table = []
+        for name, data in sections:
+            offset += -offset % _ALIGN
+            f.write(_SECTION.pack(name.encode('ascii'), offset, len(data)))
+            table.append((offset, data))
+            offset += len(data)
+        for offset, data in table:
+            f.write(b'\0' * (offset - f.tell()))
+            f.write(data)
+        size = f.tell()
+    os.replace(tmp, output)
+    return size
+
+
+def compile_charsets(db_file, charsets=range(len(dictdb.CHARSETS))):
+    '''Compile db_file for each of charsets, next to db_file.
+    Yields (output, size, seconds) as each is done.
+    '''
+    for charset in charsets:
+        output = compiled_path(db_file, charset)
+        start = time.time()
+        size = compile_dictionary(db_file, output, charset)
+        yield output, size, time.time() - start
+
+
+class CompiledDictionary(object):
+    '''Dictionary served from a compiled file, see compile_dictionary().
+
+    Has the same lookup interface as dictdb.SqliteDictionary.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count = _HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError('{}: not a compiled dictionary of format {}'.format(path, FORMAT_VERSION))
+        view = memoryview(self._mmap)
+        sections = {}
+        for i in range(count):
+            name, offset, length = _SECTION.unpack_from(self._mmap, _HEADER.size + i * _SECTION.size)
+            sections[name.rstrip(b'\0').decode('ascii')] = view[offset:offset + length]
+        self.meta = json.loads(str(sections['meta'], 'utf-8'))
+        if self.meta['byteorder'] != sys.byteorder:
+            raise ValueError('{}: compiled for another byte order'.format(path))
+        self._pool = sections['pool']
+        for name in _ARRAYS:
+            setattr(self, '_' + name, sections[name].cast('I'))
+        size = (len(self._wubi_rank_rows) + 7) // 8
+        key_bits = sections['wubi_key_bits']
+        slots = len(PositionIndex.KEYS) + 1
+        self._positions = PositionIndex([[key_bits[(position * slots + slot) * size:(position * slots + slot + 1) * size]
+                                          for slot in range(slots)]
+                                         for position in range(PositionIndex.MAX_CODE_LEN)])
+        self._pinyin_prefix_max_len = self.meta['pinyin_prefix_max_len']
+        self._pinyin_prefix_top_n = self.meta['pinyin_prefix_top_n']
+        # No SQLite queries, kept for the interface of SqliteDictionary
+        self.query_count = 0
+
+    def close(self):
+        '''Unmap the file. The dictionary must not be used afterwards.'''
+        # The views into the map must be released before it can be closed
+        self._pool.release()
+        for name in _ARRAYS:
+            getattr(self, '_' + name).release()
+        self._mmap.close()
+
+    def stale_reason(self, conn):
+        '''Return why the file no longer matches its database, or None.
+
+        Everything it holds derives from the database, whose stamp changes
+        with every rebuild, migration and training, see dictdb.dictionary_stamp().
+        '''
+        if self.meta['dict_stamp'] != dictdb.dictionary_stamp(conn.cursor()):
+            return 'dictionary stamp changed'
+        return None
+
+    def _str(self, i):
+        return str(self._pool[self._str_offsets[i]:self._str_offsets[i + 1]], 'utf-8')
+
+    def _bytes(self, i):
+        return self._pool[self._str_offsets[i]:self._str_offsets[i + 1]].tobytes()
+
+    def _search(self, keys, key):
+        # bisect_left of the UTF-8 bytes key in the sorted string id array keys
+        lo, hi = 0, len(keys)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._bytes(keys[mid]) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _find(self, keys, key):
+        i = self._search(keys, key)
+        if i < len(keys) and self._bytes(keys[i]) == key:
+            return i
+        return -1
+
+    def lookup(self, code):
+        i = self._find(self._wubi_prefix, code.encode('utf-8'))
+        if i < 0:
+            return (), ()
+        start, end = self._wubi_exact_offsets[i], self._wubi_exact_offsets[i + 1]
+        exact = [(self._str(phrase), freq) for phrase, freq in
+                 zip(self._wubi_exact[start:end], self._wubi_exact_freqs[start:end])]
+        start, end = self._wubi_ext_offsets[i], self._wubi_ext_offsets[i + 1]
+        extensions = [(self._str(tabkeys), self._str(phrase), freq) for tabkeys, phrase, freq in
+                      zip(self._wubi_ext_codes[start:end], self._wubi_ext_phrases[start:end],
+                          self._wubi_ext_freqs[start:end])]
+        return exact, extensions
+
+    def extension_count(self, code):
+        i = self._find(self._wubi_prefix, code.encode('utf-8'))
+        return self._wubi_ext_count[i] if i >= 0 else 0
+
+    def unique_candidate(self, code):
+        '''Return the phrase of code if it is its only candidate: the only
+        Wubi row starting with code, with no pinyin starting with it either.
+        Else None.
+        '''
+        i = self._find(self._wubi_prefix, code.encode('utf-8'))
+        if i < 0 or not self._wubi_unique[i]:
+            return None
+        return self._str(self._wubi_unique[i] - 1)
+
+    def code_of(self, phrase):
+        i = self._find(self._code_phrases, phrase.encode('utf-8'))
+        return self._str(self._code_tabkeys[i]) if i >= 0 else None
+
+    def pinyin_rows(self, prefix, limit):
+        '''Return up to limit (pinyin, phrase) rows starting with prefix,
+        ordered by freq DESC.
+        '''
+        key = prefix.encode('utf-8')
+        if len(prefix) <= self._pinyin_prefix_max_len and limit <= self._pinyin_prefix_top_n:
+            i = self._find(self._pinyin_prefix, key)
+            if i < 0:
+                return []
+            rows = self._pinyin_top[self._pinyin_top_offsets[i]:self._pinyin_top_offsets[i + 1]][:limit]
+        else:
+            # Long prefixes match few rows, rank them on the fly
+            low, high = dictdb.prefix_range(prefix)
+            rows = heapq.nsmallest(limit,
+                                   range(self._search(self._pinyin_keys, low.encode('utf-8')),
+                                         self._search(self._pinyin_keys, high.encode('utf-8'))),
+                                   key=self._pinyin_ranks.__getitem__)
+        return [(self._str(self._pinyin_keys[row]), self._str(self._pinyin_phrases[row])) for row in rows]
+
+    def _page(self, ranks, low, high, after, limit):
+        # Indexes in [low, high) of the next limit rows ranked after the
+        # rank after, and the rank of the last one
+        after = -1 if after is None else after
+        rows = heapq.nsmallest(limit, (i for i in range(low, high) if ranks[i] > after),
+                               key=ranks.__getitem__)
+        return rows, ranks[rows[-1]] if rows else after
+
+    def wubi_page(self, code, after, limit):
+        '''Return the next limit (tabkeys, phrase, freq) rows strictly
+        extending code, ranked after the key after (None for the first
+        page), and the key of the last one.
+        '''
+        low, high = dictdb.prefix_range(code)
+        keys = self._wubi_row_codes
+        # Every code extending code sorts at or after code + NUL
+        rows, after = self._page(self._wubi_row_ranks,
+                                 self._search(keys, code.encode('utf-8') + b'\0'),
+                                 self._search(keys, high.encode('utf-8')), after, limit)
+        return [(self._str(keys[row]), self._str(self._wubi_row_phrases[row]), self._wubi_row_freqs[row])
+                for row in rows], after
+
+    def wildcard_page(self, pattern, after, limit):
+        '''Return the next limit (tabkeys, phrase, freq) rows whose tabkeys
+        start with pattern, config.WILDCARD_KEY matching any key, ranked
+        after the key after (None for the first page), and the key of the
+        last one.
+        '''
+        ranks = self._positions.ranks(pattern, after, limit)
+        rows = [self._wubi_rank_rows[rank] for rank in ranks]
+        return [(self._str(self._wubi_row_codes[row]), self._str(self._wubi_row_phrases[row]),
+                 self._wubi_row_freqs[row]) for row in rows], ranks[-1] if ranks else after
+
+    def pinyin_page(self, prefix, after, limit):
+        '''Return the next limit (pinyin, phrase) rows starting with prefix,
+        ranked after the key after (None for the first page), and the key of
+        the last one.
+        '''
+        low, high = dictdb.prefix_range(prefix)
+        keys = self._pinyin_keys
+        rows, after = self._page(self._pinyin_ranks,
+                                 self._search(keys, low.encode('utf-8')),
+                                 self._search(keys, high.encode('utf-8')), after, limit)
+        return [(self._str(keys[row]), self._str(self._pinyin_phrases[row])) for row in rows], after
+
+    def __str__(self):
+        return 'CompiledDictionary({}, {} Wubi prefixes, {})'.format(
+            self.path, len(self._wubi_prefix), dictdb.CHARSETS[self.meta.get('charset', dictdb.CHARSET_FULL)])
+
+
+def main(argv=None):
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description='Compile the iWubi dictionary into its memory-mapped form.')
+    parser.add_argument('--db', default=os.path.join(base_dir, 'wubi-jidian86.db'),
+                        help='Wubi dictionary (default: %(default)s)')
+    parser.add_argument('--charset', choices=dictdb.CHARSETS,
+                        help='compile only this charset (default: every charset)')
+    parser.add_argument('-o', '--output', help='compiled file, with --charset (default: DB with a .bin suffix)')
+    args = parser.parse_args(argv)
+    if args.output and not args.charset:
+        parser.error('--output needs --charset')
+
+    if args.output:
+        start = time.time()
+        size = compile_dictionary(args.db, args.output, dictdb.CHARSETS.index(args.charset))
+        print('{}: {} bytes in {:.2f}s'.format(args.output, size, time.time() - start))
+        return 0
+    charsets = [dictdb.CHARSETS.index(args.charset)] if args.charset else range(len(dictdb.CHARSETS))
+    for output, size, seconds in compile_charsets(args.db, charsets):
+        print('{}: {} bytes in {:.2f}s'.format(output, size, seconds))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
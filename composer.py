@@ -0,0 +1,1031 @@
+# -*- coding: utf-8 -*-
+'''The iWubi input method core, free of gi/IBus.
+
+Composer is the composition state machine. It is driven by plain keyvals and
+modifier states (see keysyms.py), looks candidates up with IWubi and tells a
+frontend what to show and commit. IbusWubiEngine in iwubi.py is the IBus
+frontend; tools and benchmarks can drive a Composer directly with any object
+implementing the Frontend methods.
+'''
+import collections
+import functools
+import itertools
+import logging
+import os
+import time
+
+import config
+import dictdb
+import keysyms
+import logconfig
+import stats
+from compiled_dict import CompiledDictionary, compiled_path
+from keymap import MODIFIER_MASK, Keymap
+from lookup_cache import LookupCache
+
+logger = logconfig.get_logger()
+
+
+def gen_punctuation_map():
+    # import string
+    # punctuation_en = string.punctuation
+    punctuation_en = '''!"#$%&'()*+,-./:;<=>?@[\\]^_`{|}~'''
+    punctuation_cn = ['！', '“', '＃', '￥', '％', '＆', '‘', '（', '）', '＊', '＋', '，', '－', '。', '／', '：', '；', '《', '＝',
+                      '》', '？', '＠', '「', '、', '」', '……', '——', '｀', '『', '｜', '』', '～']
+    return dict(zip(punctuation_en, punctuation_cn))
+
+
+punctuation_map = gen_punctuation_map()
+
+
+def _mask_property(mask):
+    return property(lambda self: self.state & mask != 0)
+
+
+class KeyEvent(object):
+    '''Key event class used to make the checking of details of the key
+    event easy.
+
+    Only the keyval, keycode and state are stored. The modifier flags, name
+    and unicode are computed when read, which for most keys is never.
+    '''
+    __slots__ = ('val', 'code', 'state')
+
+    def __init__(self, keyval, keycode, state):
+        self.val = keyval
+        self.code = keycode
+        self.state = state
+
+    @property
+    def name(self):
+        return keysyms.keyval_name(self.val)
+
+    @property
+    def unicode(self):
+        return keysyms.keyval_to_unicode(self.val)
+
+    shift = _mask_property(keysyms.SHIFT_MASK)
+    lock = _mask_property(keysyms.LOCK_MASK)
+    control = _mask_property(keysyms.CONTROL_MASK)
+    mod1 = _mask_property(keysyms.MOD1_MASK)
+    mod2 = _mask_property(keysyms.MOD2_MASK)
+    mod3 = _mask_property(keysyms.MOD3_MASK)
+    mod4 = _mask_property(keysyms.MOD4_MASK)
+    mod5 = _mask_property(keysyms.MOD5_MASK)
+    button1 = _mask_property(keysyms.BUTTON1_MASK)
+    button2 = _mask_property(keysyms.BUTTON2_MASK)
+    button3 = _mask_property(keysyms.BUTTON3_MASK)
+    button4 = _mask_property(keysyms.BUTTON4_MASK)
+    button5 = _mask_property(keysyms.BUTTON5_MASK)
+    super = _mask_property(keysyms.SUPER_MASK)
+    hyper = _mask_property(keysyms.HYPER_MASK)
+    meta = _mask_property(keysyms.META_MASK)
+    release = _mask_property(keysyms.RELEASE_MASK)
+    # MODIFIER_MASK: Modifier mask for the all the masks above
+    modifier = _mask_property(keysyms.MODIFIER_MASK)
+
+    def __str__(self):
+        return (
+                "val=%s code=%s state=0x%08x name='%s' unicode='%s' "
+                % (self.val,
+                   self.code,
+                   self.state,
+                   self.name,
+                   self.unicode)
+                + "shift=%s control=%s mod1=%s mod5=%s release=%s"
+                % (self.shift,
+                   self.control,
+                   self.mod1,
+                   self.mod5,
+                   self.release))
+
+
+class Context(object):
+    '''What every engine of the process shares: the dictionary lookups are
+    served from, the user frequency recorder (None to not learn), the
+    lookup worker, the Associations and the BigramModel (None for none).
+    pinyin_overruns counts the keys whose pinyin candidates were not ready
+    within config.PINYIN_BUDGET_MS. keymap is the Keymap keys are dispatched
+    with, the default bindings if None.
+
+    Lookups read the attributes afresh, so assigning a new dictionary
+    switches every engine over at once.
+    '''
+
+    def __init__(self, dictionary=None, user_freq=None, worker=None, associations=None, bigrams=None,
+                 keymap=None):
+        self.dictionary = dictionary
+        self.user_freq = user_freq
+        # The LookupWorker running lookups off the main loop, None to run
+        # them when the frontend is idle
+        self.worker = worker
+        self.associations = associations
+        self.bigrams = bigrams
+        self.keymap = keymap if keymap is not None else compile_keymap()
+        self.pinyin_overruns = 0
+
+
+def load_dictionary(conn, db_file, table_size=10, charset=dictdb.CHARSET_FULL):
+    '''Return the CompiledDictionary of db_file for charset if it is up to
+    date, else a SqliteDictionary of charset built from conn, a connection
+    to db_file.
+    '''
+    start = time.time()
+    bin_file = compiled_path(db_file, charset)
+    if os.path.exists(bin_file):
+        try:
+            compiled = CompiledDictionary(bin_file)
+            stale = compiled.stale_reason(conn)
+        except (OSError, ValueError) as e:
+            compiled, stale = None, str(e)
+        if not stale:
+            logger.info('Loaded {} in {:.3f}s'.format(compiled, time.time() - start))
+            return compiled
+        logger.warning('Ignoring {}: {}'.format(bin_file, stale))
+    loaded = dictdb.SqliteDictionary(conn, table_size, charset)
+    logger.info('Loaded {} in {:.3f}s'.format(loaded, time.time() - start))
+    return loaded
+
+
+# A cached lookup result.
+# wubi_rows and pinyin_rows are the (tabkeys, phrase) and (pinyin, phrase) rows
+# the output was assembled from. complete is True if they hold every row that
+# starts with the code, so the result of a longer code can be narrowed from
+# them without another lookup. pending is True if the pinyin candidates are
+# still to be looked up, see IWubi.find_characters(). ranked is the set of
+# phrases whose user_freq the order of the Wubi rows depends on.
+_Lookup = collections.namedtuple('_Lookup', 'output len_wubi_list wubi_rows pinyin_rows complete pending ranked')
+
+
+def _keyset_pages(fetch, size):
+    # Yield the rows of fetch(after, size) -> (rows, after), a page at a
+    # time, each page starting after the last row of the previous one
+    after = None
+    while True:
+        rows, after = fetch(after, size)
+        for row in rows:
+            yield row
+        if len(rows) < size:
+            return
+
+
+class IWubi(object):
+    '''Candidate lookup of a code, from the dictionary of context.'''
+
+    # Number of candidates fetched per lookup
+    table_size = 10
+
+    def __init__(self, context):
+        self.context = context
+        # The dictionary the cached results come from
+        self.dictionary = None
+        # Number of SQLite queries issued by the last lookup
+        self.last_query_count = 0
+        self.cache = LookupCache(config.LOOKUP_CACHE_SIZE)
+        self.narrowed = 0
+        self._cached_user_freq = None
+        # (preedit string, Wubi rows) of the last pending result, which the
+        # pinyin lookup that follows adds to
+        self._wubi_tier = None
+
+    def invalidate_cache(self):
+        # Must be called when frequencies or the dictionary change
+        self.cache.invalidate()
+        self._wubi_tier = None
+
+    def _forget(self, phrases):
+        # Drop the results ranked with the user_freq of phrases, the others
+        # stay valid
+        for phrase in phrases:
+            self.cache.discard([key for key, result in self.cache.items() if phrase in result.ranked])
+        self._wubi_tier = None
+
+    def find_characters(self, preedit_string, tiered=False):
+        '''Return the _Lookup of preedit_string, from the cache if it is there.
+
+        With tiered, a code that needs a pinyin query only gets its Wubi
+        candidates, in a pending _Lookup that is not cached. Looking the
+        code up again without tiered then queries pinyin only.
+        '''
+        logger.debug('preedit_string %s', preedit_string)
+        dictionary = self.context.dictionary
+        user_freq = self.context.user_freq
+        user_freq_generation = user_freq.generation if user_freq else None
+        if self.dictionary is not dictionary:
+            # The dictionary was (re)loaded, cached results are stale
+            self.dictionary = dictionary
+            self._cached_user_freq = user_freq_generation
+            self.invalidate_cache()
+        elif self._cached_user_freq != user_freq_generation:
+            # Candidates were committed, or user frequencies loaded
+            recorded = None
+            if user_freq and self._cached_user_freq is not None:
+                recorded = user_freq.recorded_since(self._cached_user_freq)
+            self._cached_user_freq = user_freq_generation
+            if recorded is None:
+                self.invalidate_cache()
+            else:
+                self._forget(recorded)
+        query_count = dictionary.query_count
+
+        result = self.cache.get(preedit_string)
+        if result is None:
+            parent = self.cache.peek(preedit_string[:-1])
+            if parent is not None and parent.complete and config.WILDCARD_KEY not in preedit_string:
+                result = self._narrow(preedit_string, parent)
+                self.narrowed += 1
+            elif config.WILDCARD_KEY in preedit_string:
+                result = self._lookup_wildcard(preedit_string)
+            else:
+                result = self._lookup(preedit_string, tiered)
+            if not result.pending:
+                self.cache.put(preedit_string, result)
+        # Shows a regression back to per-candidate queries
+        self.last_query_count = dictionary.query_count - query_count
+
+        logger.debug('output %s queries %s cache %s narrowed %s',
+                     result.output, self.last_query_count, self.cache, self.narrowed)
+        return result
+
+    def more_candidates(self, preedit_string, lookup):
+        '''Yield the candidates of preedit_string past those of lookup, its
+        result from find_characters(), fetching them a page at a time.
+
+        The Wubi rows and the pinyin rows follow in the order of the first
+        page. Nothing is fetched until the generator is advanced.
+        '''
+        dictionary = self.context.dictionary
+        wildcard = config.WILDCARD_KEY in preedit_string
+        # The first page showed the first pinyin rows
+        pinyin_rows = itertools.islice(
+            _keyset_pages(functools.partial(dictionary.pinyin_page, preedit_string), self.table_size),
+            len(lookup.pinyin_rows), None)
+        if wildcard:
+            for pinyin, phrase in pinyin_rows:
+                yield self._pinyin_candidate(dictionary, phrase)
+            wubi_rows = _keyset_pages(functools.partial(dictionary.wildcard_page, preedit_string), self.table_size)
+            code_start = 0
+        else:
+            wubi_rows = _keyset_pages(functools.partial(dictionary.wubi_page, preedit_string), self.table_size)
+            code_start = len(preedit_string)
+        seen = set(row[1] for row in lookup.wubi_rows)
+        for tabkeys, phrase, freq in wubi_rows:
+            if phrase not in seen:
+                seen.add(phrase)
+                yield phrase, phrase + tabkeys[code_start:]
+        if not wildcard:
+            for pinyin, phrase in pinyin_rows:
+                yield self._pinyin_candidate(dictionary, phrase)
+
+    def _lookup(self, preedit_string, tiered=False):
+        # CREATE TABLE pinyin
+        #             (pinyin TEXT, zi TEXT, freq INTEGER);
+        # CREATE TABLE phrases
+        # CREATE TABLE phrases
+        #         (id INTEGER PRIMARY KEY, tabkeys TEXT, phrase TEXT,
+        #         freq INTEGER, user_freq INTEGER);
+
+        # freq==0 is large Chinese Table
+        # query Wubi exact and like from the prefix index, unless the
+        # pending result of the code already did
+        dictionary = self.dictionary
+        if self._wubi_tier is not None and self._wubi_tier[0] == preedit_string:
+            wubi_rows, len_wubi_list, wubi_complete, ranked = self._wubi_tier[1]
+        else:
+            exact, extensions = dictionary.lookup(preedit_string)
+            exact_rows = [(preedit_string, phrase, freq) for phrase, freq in exact]
+            wubi_rows, len_wubi_list, wubi_complete, ranked = self._take_wubi(
+                preedit_string, exact_rows, extensions, dictionary.extension_count(preedit_string))
+        self._wubi_tier = None
+
+        # query pinyin
+        pinyin_size = self.table_size - len_wubi_list
+        pinyin_rows = []
+        if pinyin_size > 0:
+            if tiered:
+                self._wubi_tier = (preedit_string, (wubi_rows, len_wubi_list, wubi_complete, ranked))
+                return self._assemble(preedit_string, wubi_rows, len_wubi_list, [], ranked, False, True)
+            pinyin_rows = dictionary.pinyin_rows(preedit_string, pinyin_size)
+        # Fewer rows than asked for means there are no more
+        pinyin_complete = len(pinyin_rows) < pinyin_size
+
+        return self._assemble(preedit_string, wubi_rows, len_wubi_list, pinyin_rows, ranked,
+                              wubi_complete and pinyin_complete)
+
+    def _lookup_wildcard(self, preedit_string):
+        # Pinyin first: z also spells pinyin, and those rows are all the code
+        # showed before it was a wildcard. The Wubi rows matching the code
+        # follow, with their whole code as it was not typed. None of them is
+        # counted as a Wubi candidate, so that a fifth key never auto-commits
+        # an ambiguous code.
+        dictionary = self.dictionary
+        pinyin_rows = dictionary.pinyin_rows(preedit_string, self.table_size)
+        pinyin_complete = len(pinyin_rows) < self.table_size
+        wubi_size = self.table_size - len(pinyin_rows)
+        wubi_rows = []
+        wubi_complete = False
+        if wubi_size > 0:
+            # One row more than shown tells whether there are more
+            wubi_rows = dictionary.wildcard_page(preedit_string, None, wubi_size + 1)[0]
+            wubi_complete = len(wubi_rows) <= wubi_size
+            wubi_rows = self._rank(wubi_rows[:wubi_size])
+        ranked = frozenset(row[1] for row in wubi_rows)
+
+        output = [self._pinyin_candidate(dictionary, phrase) for pinyin, phrase in pinyin_rows]
+        wubi_dict = collections.OrderedDict()
+        for tabkeys, phrase, freq in wubi_rows:
+            wubi_dict.setdefault(phrase, phrase + tabkeys)
+        output.extend(wubi_dict.items())
+        return _Lookup(output, 0, wubi_rows, pinyin_rows, pinyin_complete and wubi_complete, False, ranked)
+
+    def _narrow(self, preedit_string, parent):
+        # Every row of preedit_string is a row of its parent code, and the
+        # parent rows are complete and in rank order, so filtering them gives
+        # exactly what _lookup would return.
+        exact_rows = []
+        extensions = []
+        for row in parent.wubi_rows:
+            if row[0] == preedit_string:
+                exact_rows.append(row)
+            elif row[0].startswith(preedit_string):
+                extensions.append(row)
+        wubi_rows, len_wubi_list, wubi_complete, ranked = self._take_wubi(
+            preedit_string, exact_rows, extensions, len(extensions))
+
+        pinyin_size = self.table_size - len_wubi_list
+        pinyin_rows = [(pinyin, phrase) for pinyin, phrase in parent.pinyin_rows
+                       if pinyin.startswith(preedit_string)]
+        pinyin_complete = len(pinyin_rows) <= pinyin_size
+
+        return self._assemble(preedit_string, wubi_rows, len_wubi_list, pinyin_rows[:pinyin_size], ranked,
+                              wubi_complete and pinyin_complete)
+
+    def _take_wubi(self, preedit_string, exact_rows, extensions, extension_count):
+        # Returns the Wubi rows shown for preedit_string, the number of
+        # distinct Wubi candidates, whether the rows are complete and the
+        # phrases they were ranked among.
+        exact_rows = self._rank(exact_rows)
+        exact_phrases = set(row[1] for row in exact_rows)
+        ext_size = max(self.table_size - len(exact_phrases), 0)
+        wubi_rows = exact_rows + self._rank(extensions)[:ext_size]
+        len_wubi_list = len(set(row[1] for row in wubi_rows))
+        ranked = frozenset(itertools.chain(exact_phrases, (row[1] for row in extensions)))
+        return wubi_rows, len_wubi_list, extension_count <= ext_size, ranked
+
+    def _rank(self, rows):
+        # Order (tabkeys, phrase, freq) rows by freq blended with the user
+        # frequency. sorted() is stable, so ties keep the dictionary order.
+        user_freq = self.context.user_freq
+        if not user_freq or not user_freq.counts:
+            return list(rows)
+        weight = config.USER_FREQ_WEIGHT
+        counts = user_freq.counts
+        return sorted(rows, key=lambda row: -(row[2] + weight * counts.get(row[1], 0)))
+
+    def _assemble(self, preedit_string, wubi_rows, len_wubi_list, pinyin_rows, ranked, complete, pending=False):
+        # use OrderedDict to filter duplicate
+        wubi_dict = collections.OrderedDict()
+        for tabkeys, phrase, freq in wubi_rows:
+            wubi_dict[phrase] = phrase + tabkeys[len(preedit_string):]
+        output = list(wubi_dict.items())
+
+        for pinyin, phrase in pinyin_rows:
+            output.append(self._pinyin_candidate(self.dictionary, phrase))
+
+        return _Lookup(output, len_wubi_list, wubi_rows, pinyin_rows, complete, pending, ranked)
+
+    def _pinyin_candidate(self, dictionary, phrase):
+        # Add the shortest Wubi tabkeys if exists, from the reverse index
+        tabkeys = dictionary.code_of(phrase)
+        if tabkeys:
+            phrase_display = phrase + tabkeys
+        else:
+            phrase_display = phrase
+        return [phrase, phrase_display]
+
+
+class CandidateTable(object):
+    '''The candidates on show, with the paging and cursor moves of an
+    IBusLookupTable.
+
+    candidates is a list of (phrase, display string). It is replaced, never
+    modified, by set_candidates(), which bumps version, and when paging
+    reaches its end, by a list extended with the next page of more.
+    '''
+
+    def __init__(self, page_size=10, round=True):
+        self.page_size = page_size
+        self.round = round
+        self.candidates = []
+        # Called with a count to fetch the candidates past candidates, None
+        # if there are no more
+        self.more = None
+        self.cursor_pos = 0
+        self.version = 0
+
+    def __len__(self):
+        return len(self.candidates)
+
+    def set_candidates(self, candidates, more=None):
+        self.candidates = candidates
+        self.more = more
+        self.cursor_pos = 0
+        self.version += 1
+
+    def _fill(self, count):
+        # Fetch pages until there are count candidates or no more
+        while self.more is not None and len(self.candidates) < count:
+            candidates = self.more(self.page_size)
+            if len(candidates) < self.page_size:
+                self.more = None
+            if candidates:
+                self.candidates = self.candidates + candidates
+                self.version += 1
+
+    def selected(self):
+        '''Return the phrase under the cursor.'''
+        return self.candidates[self.cursor_pos][0]
+
+    def set_cursor_pos(self, pos):
+        # Out of range positions are ignored, like IBus does
+        if pos < len(self.candidates):
+            self.cursor_pos = pos
+
+    def page_up(self):
+        if not self.candidates:
+            return False
+        if self.cursor_pos < self.page_size:
+            if not self.round:
+                return False
+            last_page = (len(self.candidates) - 1) // self.page_size
+            self.cursor_pos = min(last_page * self.page_size + self.cursor_pos % self.page_size,
+                                  len(self.candidates) - 1)
+            return True
+        self.cursor_pos -= self.page_size
+        return True
+
+    def page_down(self):
+        if not self.candidates:
+            return False
+        self._fill((self.cursor_pos // self.page_size + 2) * self.page_size)
+        if self.cursor_pos // self.page_size == (len(self.candidates) - 1) // self.page_size:
+            if not self.round:
+                return False
+            self.cursor_pos %= self.page_size
+            return True
+        self.cursor_pos = min(self.cursor_pos + self.page_size, len(self.candidates) - 1)
+        return True
+
+    def cursor_up(self):
+        if not self.candidates:
+            return False
+        if self.cursor_pos == 0:
+            if not self.round:
+                return False
+            self.cursor_pos = len(self.candidates) - 1
+            return True
+        self.cursor_pos -= 1
+        return True
+
+    def cursor_down(self):
+        if not self.candidates:
+            return False
+        if self.cursor_pos == len(self.candidates) - 1:
+            # Crossing into the next page, fetch it whole
+            self._fill(len(self.candidates) + 1)
+        if self.cursor_pos == len(self.candidates) - 1:
+            if not self.round:
+                return False
+            self.cursor_pos = 0
+            return True
+        self.cursor_pos += 1
+        return True
+
+
+class Frontend(object):
+    '''What a Composer reports to. This one discards everything and runs
+    deferred updates at once; frontends override the methods they need.
+    '''
+
+    def commit(self, text):
+        '''Insert text into the application.'''
+
+    def show_preedit(self, text):
+        '''Show text, the code being typed, underlined.'''
+
+    def show_candidates(self, table):
+        '''Show the CandidateTable table, hidden if empty.'''
+
+    def schedule(self, callback):
+        '''Call callback when the frontend is idle.'''
+        callback()
+
+
+class Composer(object):
+    '''The composition state machine of one input context.
+
+    With a LookupWorker in the context, lookups run on the worker thread
+    and their results are shown when they come back, unless the preedit
+    string changed meanwhile. Keys that act on the candidates (space,
+    digits, paging, the fifth Wubi key, punctuation) first make sure the
+    table is current, looking up synchronously only if it is not.
+
+    With config.PINYIN_BUDGET_MS set, lookups are tiered: the Wubi
+    candidates are shown as soon as they are found, and the pinyin ones
+    are appended by a second update, skipped if the preedit changes first.
+    '''
+
+    def __init__(self, context, frontend=None, page_size=10):
+        self.context = context
+        self.frontend = frontend if frontend is not None else Frontend()
+        self.iwubi = IWubi(context)
+        self.table = CandidateTable(page_size, True)
+        self.is_invalidate = False
+        # Bumped whenever the preedit string changes. table_generation is
+        # the generation the candidates in table were looked up for.
+        self.generation = 0
+        self.table_generation = 0
+        # True while the table lacks the pinyin candidates of its code
+        self.table_pending = False
+        # perf_counter() time by which the pinyin candidates of the lookup
+        # scheduled by invalidate() are due
+        self._deadline = None
+        # True while the table holds the associations of the last commit
+        self.associating = False
+        # The candidate committed last, None after anything else was
+        self._last_phrase = None
+        # perf_counter() when the key being handled arrived, None outside keys
+        self._key_start = None
+        self._preedit_string = ''
+        self._input_mode = 0  # 0: Use direct input. 1: Use the WuBi table.
+        self._prev_key = None
+        self._last_wubi_list_len = 0
+
+    @property
+    def preedit_string(self):
+        return self._preedit_string
+
+    @preedit_string.setter
+    def preedit_string(self, preedit_string):
+        self._preedit_string = preedit_string
+        self.generation += 1
+
+    def set_cursor_pos_in_current_page(self, index):
+        '''Move the cursor to the index-th candidate of the current page.
+
+        Returns True if successful, False if not.
+        '''
+        page_size = self.table.page_size
+        if index > page_size:
+            return False
+        page, pos_in_page = divmod(self.table.cursor_pos, page_size)
+        new_pos = page * page_size + index
+        if new_pos >= len(self.table):
+            return False
+        self.table.set_cursor_pos(new_pos)
+        return True
+
+    def candidate_clicked(self, index):
+        if self.set_cursor_pos_in_current_page(index):
+            self.commit_candidate()
+
+    def set_input_mode(self, mode=1):
+        """
+        :param mode: Whether to use WuBi mode.
+                     0: Use direct input.
+                     1: Use the WuBi table.
+        :return:
+        """
+        self._input_mode = mode
+        logger.debug('input_mode %s', mode)
+
+    def _process_key_event(self, key):
+        keyval, state = key.val, key.state
+        # keymap.key(), inlined
+        bound = keyval | (state & MODIFIER_MASK) << 32
+        keymap = self.context.keymap
+
+        if state & keysyms.RELEASE_MASK:
+            # Release bindings only act on a key tapped alone, which also
+            # works around Chrome sending Shift_L releases of its own
+            action = keymap.release.get(bound)
+            if action is None or not self._prev_key or keyval != self._prev_key.val:
+                return False
+            return action[0](self, action[1])
+
+        if self.preedit_string:
+            action = keymap.preedit.get(bound)
+        elif self.associating:
+            action = keymap.associations.get(bound)
+            if action is None:
+                # Any other key dismisses the associations and is then
+                # handled as usual
+                self._dismiss_associations()
+        else:
+            action = None
+        if action is not None:
+            function, argument, needs_candidates = action
+            if needs_candidates:
+                self.sync_candidates()
+            return function(self, argument)
+
+        # ASCII letter
+        if keysyms.KEY_a <= keyval <= keysyms.KEY_z or \
+                keysyms.KEY_A <= keyval <= keysyms.KEY_Z:
+            if state & (keysyms.CONTROL_MASK | keysyms.MOD1_MASK) == 0:
+                if self._input_mode == 0:
+                    # Do not use `commit_string(keyval)` to commit ASCII letter, `commit_string` may run too long time.
+                    # This can lead to hotkey mistake detection error.
+                    # Instead, return False, to IBus/System input the letter to App directly.
+                    return False
+                else:
+                    # Auto commit the first Wubi
+                    if len(self.preedit_string) == 4:
+                        # Only a Wubi candidate is committed, pinyin can wait
+                        self.sync_candidates(pinyin=False)
+                    if len(self.preedit_string) == 4 and self._last_wubi_list_len > 0:
+                        self.commit_candidate(associate=False)
+                        self.preedit_string = chr(keyval)
+                    else:
+                        self.preedit_string += chr(keyval)
+                    if config.AUTO_COMMIT_UNIQUE and self.commit_unique():
+                        return True
+                    # self.invalidate really mean?
+                    self.invalidate()
+                    return True
+        # ASCII except letter
+        else:
+            if keyval < 128:
+                # If is Chinse Wubi mode and keyval is punctuation, translate punctuation to Chinese punctuation
+                if self._input_mode == 1:
+                    self.sync_candidates()
+                    if len(self.table) > 0:
+                        self.commit_candidate(associate=False)
+                    keyval_chr = chr(keyval)
+                    if chr(keyval) in punctuation_map:
+                        self.commit_string(punctuation_map[keyval_chr])
+                        return True
+                else:
+                    if self.preedit_string:
+                        self.commit_string(self.preedit_string)
+
+        # return False means IBus iWubi will not deal this key,
+        # so System/IBus will input the letter or other special char/keyal (e.g. Shift, Ctrl) to App.
+        return False
+
+    # Actions of the keymap, called with the argument of their ACTIONS entry.
+    # They return True if the key was consumed.
+
+    def _commit_selected(self, index):
+        # The index-th candidate of the page, the one under the cursor if
+        # None, or the preedit string if there are no candidates
+        if index is not None and not self.set_cursor_pos_in_current_page(index):
+            if self.associating:
+                self._dismiss_associations()
+            return False
+        if not len(self.table):
+            self.commit_string(self.preedit_string)
+        elif self.associating:
+            # Learned like any other candidate, following the commit that
+            # showed it
+            phrase = self.table.selected()
+            prev = self._last_phrase
+            self.commit_string(phrase, associate=True)
+            self._learn(prev, phrase)
+        else:
+            self.commit_candidate()
+        return True
+
+    def _commit_preedit(self, argument):
+        self.commit_string(self.preedit_string)
+        return True
+
+    def _clear(self, argument):
+        if self.preedit_string:
+            self.preedit_string = ''
+            self.update_candidates()
+        else:
+            self._dismiss_associations()
+        return True
+
+    def _backspace(self, argument):
+        self.preedit_string = self.preedit_string[:-1]
+        self.invalidate()
+        return True
+
+    def _toggle_input_mode(self, argument):
+        self.set_input_mode(int(not self._input_mode))
+        if self.preedit_string:
+            self.commit_string(self.preedit_string)
+        return True
+
+    def _dismiss_associations(self):
+        self.associating = False
+        self.table.set_candidates([])
+        self.frontend.show_candidates(self.table)
+
+    def process_key_event(self, keyval, keycode, state):
+        '''Handle a key event. Returns True if the key was consumed.'''
+        key = KeyEvent(keyval, keycode, state)
+        logger.debug('%s', key)
+        self._key_start = time.perf_counter()
+        try:
+            result = self._process_key_event(key)
+        finally:
+            self._key_start = None
+        if not result and not key.state & keysyms.RELEASE_MASK:
+            # The key goes to the application, whatever follows is not
+            # typed right after the last commit
+            self._last_phrase = None
+        # Fix me. If the last `self._process_key_event` take too long time.
+        # Maybe the new `do_process_key_event` will called before last `self._prev_key = key` is done.
+        # So `self._prev_key` could be the previous previous key, lead to hotkey mistake detection error.
+        # e.g.
+        # 1. Shift_L press.
+        # 2. u press. So input is U.
+        # 3. Shift_L release. -> Lead to mistake Shift_L hotkey detection.
+        # 4. u release.
+        self._prev_key = key
+        return result
+
+    def invalidate(self):
+        # The preedit string changed, look its candidates up later
+        deadline = self._pinyin_deadline()
+        worker = self.context.worker
+        if worker is not None:
+            worker.submit(self, self.generation, self.preedit_string, deadline)
+            return
+        self._deadline = deadline
+        if self.is_invalidate:
+            return
+        self.is_invalidate = True
+        # Coalesce the keys typed before the frontend is idle into a
+        # single lookup, unless a key needed it earlier
+        self.frontend.schedule(self._update_idle)
+
+    def _pinyin_deadline(self):
+        # When the pinyin candidates of a lookup requested now are due, from
+        # the arrival of the key. None to look them up with the Wubi ones.
+        if config.PINYIN_BUDGET_MS is None:
+            return None
+        start = self._key_start if self._key_start is not None else time.perf_counter()
+        return start + config.PINYIN_BUDGET_MS / 1000.0
+
+    def _update_idle(self):
+        # The lookup scheduled by invalidate(), unless a key needed it earlier
+        if self.table_generation != self.generation:
+            self.update_candidates(self._deadline)
+
+    def sync_candidates(self, pinyin=True):
+        '''Make sure the table holds the candidates of the preedit string,
+        looking them up now if the pending lookup has not been shown yet.
+        Without pinyin, the Wubi candidates are enough.
+        '''
+        if self.table_generation != self.generation or (pinyin and self.table_pending):
+            self.update_candidates()
+
+    def lookup_done(self, generation, result):
+        # Called back on the main loop with the result of a worker lookup
+        if generation != self.generation or (generation == self.table_generation and not self.table_pending):
+            # The preedit changed since, or the result was needed earlier
+            # and looked up synchronously
+            return
+        self._show_candidates(generation, result)
+
+    def page_up(self):
+        # Go to previous page of the candidate table.
+        # It returns False if it is already at the first page, unless round is True, where it will go to the last page.
+        if self.table.page_up():
+            self.frontend.show_candidates(self.table)
+            return True
+        return False
+
+    def page_down(self):
+        if self.table.page_down():
+            self.frontend.show_candidates(self.table)
+            return True
+        return False
+
+    def cursor_up(self):
+        if self.table.cursor_up():
+            self.frontend.show_candidates(self.table)
+            return True
+        return False
+
+    def cursor_down(self):
+        if self.table.cursor_down():
+            self.frontend.show_candidates(self.table)
+            return True
+        return False
+
+    def commit_unique(self):
+        '''Commit the only candidate of the preedit string, if it has a
+        single one. Returns True if it did.
+
+        Decided from the counts of the dictionary, without looking the
+        candidates up, so it adds nothing noticeable to a key.
+        '''
+        code = self.preedit_string
+        if config.WILDCARD_KEY in code:
+            return False
+        phrase = self.context.dictionary.unique_candidate(code)
+        if phrase is None:
+            return False
+        logger.debug('unique %s %s', code, phrase)
+        prev = self._last_phrase
+        self.commit_string(phrase, associate=True)
+        self._learn(prev, phrase)
+        return True
+
+    def commit_string(self, text, associate=False):
+        '''Commit text and clear the preedit. With associate, text is a
+        candidate and the phrases following it are shown, if there are any.
+        '''
+        self.frontend.commit(text)
+        self._last_phrase = None
+        self.preedit_string = ''
+        if associate and self.show_associations(text):
+            return
+        self.update_candidates()
+
+    def show_associations(self, text):
+        '''Show the phrases following text as candidates. Returns True if
+        there were any.
+        '''
+        associations = self.context.associations
+        if associations is None:
+            return False
+        if self._key_start is not None and \
+                time.perf_counter() - self._key_start > config.ASSOCIATION_BUDGET_MS / 1000.0:
+            associations.overruns += 1
+            return False
+        candidates = [(phrase, phrase) for phrase in associations.lookup(text, self.table.page_size)]
+        if not candidates:
+            return False
+        self.table.set_candidates(candidates)
+        self.table_generation = self.generation
+        self.table_pending = False
+        self.associating = True
+        self.is_invalidate = False
+        self.frontend.show_preedit(self.preedit_string)
+        self.frontend.show_candidates(self.table)
+        return True
+
+    def commit_candidate(self, associate=True):
+        phrase = self.table.selected()
+        prev = self._last_phrase
+        self.commit_string(phrase, associate)
+        self._learn(prev, phrase)
+
+    def _learn(self, prev, phrase):
+        # phrase, a candidate, was just committed right after the candidate
+        # prev (None if something else came between)
+        user_freq = self.context.user_freq
+        if user_freq:
+            user_freq.record(phrase)
+        bigrams = self.context.bigrams
+        if bigrams and prev is not None:
+            bigrams.record(prev, phrase)
+        self._last_phrase = phrase
+
+    def update_candidates(self, deadline=None):
+        '''Look the candidates of the preedit string up now and show them.
+
+        With a deadline, a perf_counter() time, only the Wubi candidates are
+        looked up now, and the pinyin ones are appended when the frontend is
+        next idle, after the keys typed meanwhile.
+        '''
+        generation = self.generation
+        result = None
+        if self.preedit_string:
+            tiered = deadline is not None
+            worker = self.context.worker
+            if worker is not None:
+                result = worker.lookup(self.iwubi, self.preedit_string, tiered)
+            else:
+                result = self.iwubi.find_characters(self.preedit_string, tiered)
+        self._show_candidates(generation, result)
+        if self.table_pending:
+            self.frontend.schedule(functools.partial(self._append_pinyin, generation, deadline))
+
+    def _append_pinyin(self, generation, deadline):
+        # The second update of update_candidates(deadline), skipped if the
+        # preedit changed or a key needed the candidates meanwhile
+        if generation != self.generation or not self.table_pending:
+            return
+        self.update_candidates()
+        if time.perf_counter() > deadline:
+            self.context.pinyin_overruns += 1
+
+    def _more_candidates(self, dictionary, candidates, count):
+        # The next count candidates of the table, from the generator
+        # candidates of dictionary, in the lookup thread's lock if there is
+        # a worker. Empty once dictionary was reloaded, and closed.
+        worker = self.context.worker
+        if worker is not None:
+            with worker.lock:
+                if dictionary is not self.context.dictionary:
+                    return []
+                return list(itertools.islice(candidates, count))
+        if dictionary is not self.context.dictionary:
+            return []
+        return list(itertools.islice(candidates, count))
+
+    def _show_candidates(self, generation, result):
+        # result is the _Lookup of the preedit string, None for no preedit
+        if result is None:
+            self.table.set_candidates([])
+        else:
+            self._last_wubi_list_len = result.len_wubi_list
+            more = None
+            if not result.complete and not result.pending:
+                more = functools.partial(self._more_candidates, self.context.dictionary,
+                                         self.iwubi.more_candidates(self.preedit_string, result))
+            self.table.set_candidates(self._rerank(result), more)
+        self.table_generation = generation
+        self.table_pending = result is not None and result.pending
+        self.associating = False
+        self.frontend.show_preedit(self.preedit_string)
+        self.frontend.show_candidates(self.table)
+        self.is_invalidate = False
+
+    def _rerank(self, result):
+        # The candidates of result, those of the first page that followed
+        # the last commit most often first. Done on every show rather than
+        # cached, as it depends on the last commit.
+        bigrams = self.context.bigrams
+        if bigrams is None or self._last_phrase is None:
+            return result.output
+        # Wubi candidates come first, or pinyin ones for a wildcard code
+        boundary = result.len_wubi_list or len(result.pinyin_rows)
+        return bigrams.rerank(self._last_phrase, result.output, boundary, self.table.page_size)
+
+    def focus_out(self):
+        user_freq = self.context.user_freq
+        if user_freq:
+            user_freq.flush()
+        bigrams = self.context.bigrams
+        if bigrams:
+            bigrams.flush()
+        self.reset()
+
+    def reset(self):
+        # When focus change(e.g. App/Window changes), calling order:
+        # 1. focus_out
+        # 2. reset
+        # 3. focus_in
+        logger.debug("reset")
+        self.preedit_string = ''
+        self.associating = False
+        self._last_phrase = None
+
+
+def _moving(method):
+    # The action of a Composer method moving in the table, which consumes
+    # the key even if there is nowhere to move
+    def action(composer, argument):
+        method(composer)
+        return True
+    return action
+
+
+# Action name -> (function(composer, argument), argument, whether the table
+# must be current first), the actions key bindings can name
+ACTIONS = {
+    'commit_candidate': (Composer._commit_selected, None, True),
+    'commit_preedit': (Composer._commit_preedit, None, False),
+    'clear': (Composer._clear, None, False),
+    'backspace': (Composer._backspace, None, False),
+    'page_up': (_moving(Composer.page_up), None, True),
+    'page_down': (_moving(Composer.page_down), None, True),
+    'cursor_up': (_moving(Composer.cursor_up), None, True),
+    'cursor_down': (_moving(Composer.cursor_down), None, True),
+    'toggle_input_mode': (Composer._toggle_input_mode, None, False),
+}
+for _n in range(1, 11):
+    ACTIONS['select_{}'.format(_n)] = (Composer._commit_selected, _n - 1, True)
+del _n
+
+
+def compile_keymap(bindings=None):
+    '''Return the Keymap of the default bindings and bindings, mode ->
+    {key: action} as config.KEY_BINDINGS. Raises ValueError if they are
+    invalid.
+    '''
+    return Keymap(ACTIONS, bindings)
+
+
+def enable_stats():
+    '''Time the stages of key handling, see stats.py.'''
+    stats.instrument(Composer, 'process_key_event', 'key')
+    stats.instrument(Composer, 'update_candidates', 'update_candidates')
+    stats.instrument(IWubi, 'find_characters', 'find_characters')
+    # Cache misses: dictionary lookups and SQLite queries
+    stats.instrument(IWubi, '_lookup', 'dictionary')
+    stats.instrument(IWubi, '_narrow', 'narrow')
+    stats.instrument(Composer, 'show_associations', 'associations')
+    stats.instrument(Composer, '_rerank', 'rerank')
+    # Pages fetched past the first one
+    stats.instrument(Composer, '_more_candidates', 'more_candidates')
+    # Dispatching enabled log records to the queue
+    stats.instrument(logging.Logger, 'handle', 'logging')
@@ -1 +1,87 @@
-# -*- coding: utf-8 -*-
\ No newline at end of file
+# -*- coding: utf-8 -*-
+
+# Pinyin prefixes up to this length get a materialized top-N row in the
+# pinyin_prefixes table when the dictionary is built. Longer prefixes are
+# rare and already selective, so they still query pinyins directly.
+PINYIN_PREFIX_MAX_LEN = 4
+# Number of phrases kept for each pinyin prefix. Must be at least the
+# lookup table page size.
+PINYIN_PREFIX_TOP_N = 10
+
+# Key matching any key in a Wubi code, as in "fzc". Pinyin is still looked
+# up with the key as it is, so z keeps spelling pinyin (zhong).
+WILDCARD_KEY = 'z'
+
+# Characters offered as candidates: 'common' (the 3755 common characters of
+# GB2312 level 1), 'gb2312' or 'full'. Phrases with other characters are left
+# out of the dictionary when it is loaded, so smaller charsets look up faster.
+CHARSET = 'full'
+
+# Key bindings added to those of keymap.DEFAULT_BINDINGS, mode -> {key:
+# action}, a None action removing a binding. For example, page with - and =
+# and switch to direct input with Shift_R instead of Shift_L:
+# {'preedit': {'minus': 'page_up', 'equal': 'page_down'},
+#  'release': {'Shift_L': None, 'Shift_R': 'toggle_input_mode'}}
+# See keymap.py for the modes and key names, and composer.ACTIONS for the
+# actions. Invalid bindings are logged and the default ones used.
+KEY_BINDINGS = {}
+
+# Commit a Wubi code as soon as it has a single candidate, that is when only
+# one Wubi row starts with it and no pinyin does, without waiting for space.
+AUTO_COMMIT_UNIQUE = False
+
+# Association (联想): once a candidate is committed, the phrases that often
+# follow it are shown as candidates, chosen with the digit keys. Any other
+# key dismisses them and works as usual.
+ASSOCIATION_ENABLED = False
+# Phrases kept per first character, when the dictionary is built
+ASSOCIATION_TOP_K = 20
+# Characters whose phrases are kept in memory
+ASSOCIATION_CACHE_SIZE = 512
+# No association is shown after a key that already took this long, so that
+# they never delay typing
+ASSOCIATION_BUDGET_MS = 2
+
+# Seconds between checks for a changed dictionary (rebuilt, trained,
+# replaced or compiled), which is then reloaded in the background without
+# restarting the engine. 0 to never reload.
+DICT_RELOAD_INTERVAL = 5
+
+# Tiered lookup: the Wubi candidates of a key are shown as soon as they are
+# found, and the pinyin ones are appended by a second update if they are
+# ready within this many milliseconds of the key. Past it they are deferred
+# behind the keys typed meanwhile, and skipped if the code changes. Overruns
+# are counted (Context.pinyin_overruns, benchmark.py) to tune it. None to
+# look both up together and show them in one update.
+PINYIN_BUDGET_MS = 5
+
+# Number of lookup results (keyed on the preedit string) kept in memory.
+LOOKUP_CACHE_SIZE = 256
+# Number of IBus.Text objects of recently shown candidates kept for reuse
+CANDIDATE_TEXT_CACHE_SIZE = 512
+
+# User frequency learning. Committed candidates are counted in memory and
+# written to phrases.user_freq in the background every
+# USER_FREQ_FLUSH_INTERVAL seconds, or once USER_FREQ_BATCH_SIZE phrases are
+# pending. At most that much is lost on a crash.
+USER_FREQ_FLUSH_INTERVAL = 30
+USER_FREQ_BATCH_SIZE = 20
+# Candidates are ranked by freq + USER_FREQ_WEIGHT * user_freq. Only the
+# candidates the dictionary holds for a code are reranked: those whose code
+# is the code typed, and the 10 most frequent ones extending it. A phrase
+# with a longer code outside those 10 is not shown before its code is typed
+# further, however often it is committed.
+USER_FREQ_WEIGHT = 1000
+
+# Context-aware ranking. The pairs of consecutively committed candidates are
+# counted, and the candidates of the first page that most often followed the
+# previous commit are moved first. Saved to the bigrams table like user_freq.
+BIGRAM_ENABLED = False
+# Pairs kept in memory, the rarest are evicted past it (about 200 bytes each)
+BIGRAM_CAPACITY = 20000
+
+# Per-stage timing of key handling, see stats.py. Also enabled by setting
+# IWUBI_STATS=1 in the environment of the engine. The statistics are written
+# to STATS_FILE on SIGUSR1 and when the engine exits.
+STATS_ENABLED = False
+STATS_FILE = '/tmp/iwubi-stats.txt'
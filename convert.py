@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+'''Convert text to Wubi codes and back, in bulk, from the iWubi dictionary.
+
+encode segments each line of text by longest match against the phrases of
+wubi-jidian86.db and writes the shortest Wubi code of each phrase, space
+separated. Characters without a code are copied as they are, and the Han
+characters among them are reported as not covered. decode replaces each
+whitespace separated code with its first candidate, by dictionary freq,
+and keeps any other token.
+
+Input is streamed in chunks of lines, converted by a pool of processes and
+written back in input order, so the output is the same for any number of
+jobs. Throughput and coverage are reported on stderr.
+'''
+import argparse
+import collections
+import itertools
+import multiprocessing
+import os
+import sqlite3
+import sys
+import time
+
+# The same order as WubiIndex.from_db(), so that the code kept for a phrase
+# and the phrase kept for a code are those the engine shows first
+ROWS_QUERY = '''SELECT tabkeys, phrase, freq
+    FROM phrases
+    ORDER BY freq DESC, id'''
+
+# Lines per chunk handed to a worker process
+CHUNK_LINES = 2000
+
+# Counts reported for a chunk: input characters, phrases or codes converted,
+# and Han characters (encode) or tokens (decode) left as they were
+Counts = collections.namedtuple('Counts', 'chars converted uncovered')
+
+
+def is_han(ch):
+    # CJK unified ideographs, extension A, compatibility ideographs and the
+    # supplementary planes
+    return '\u3400' <= ch <= '\u9fff' or '\uf900' <= ch <= '\ufaff' or ch >= '\U00020000'
+
+
+def phrase_lengths(phrases):
+    '''Return first character -> lengths of the phrases starting with it,
+    longest first: the lengths a longest match tries at a position.
+    '''
+    lengths = collections.defaultdict(set)
+    for phrase in phrases:
+        lengths[phrase[0]].add(len(phrase))
+    return dict((ch, sorted(found, reverse=True)) for ch, found in lengths.items())
+
+
+class Converter(object):
+    '''The phrase -> code and code -> phrase mappings of a dictionary.'''
+
+    def __init__(self, rows):
+        # rows are (tabkeys, phrase, freq) in ROWS_QUERY order
+        self.codes = {}
+        self.phrases = {}
+        for tabkeys, phrase, freq in rows:
+            known = self.codes.get(phrase)
+            if known is None or len(tabkeys) < len(known):
+                self.codes[phrase] = tabkeys
+            # freq == 0 is the large Chinese table, never a candidate
+            if freq > 0 and tabkeys not in self.phrases:
+                self.phrases[tabkeys] = phrase
+        self.lengths = phrase_lengths(self.codes)
+
+    @classmethod
+    def from_db(cls, db_file):
+        conn = sqlite3.connect(db_file)
+        try:
+            return cls(conn.execute(ROWS_QUERY))
+        finally:
+            conn.close()
+
+    def encode(self, line):
+        '''Return (codes of line, Counts).'''
+        codes = self.codes
+        lengths = self.lengths
+        tokens = []
+        # Characters without a code, copied as one token
+        raw = []
+        converted = uncovered = 0
+        i, end = 0, len(line)
+        while i < end:
+            ch = line[i]
+            if ch.isspace():
+                if raw:
+                    tokens.append(''.join(raw))
+                    raw = []
+                i += 1
+                continue
+            code = None
+            for length in lengths.get(ch, ()):
+                if length <= end - i:
+                    code = codes.get(line[i:i + length])
+                    if code is not None:
+                        break
+            if code is None:
+                raw.append(ch)
+                if is_han(ch):
+                    uncovered += 1
+                i += 1
+                continue
+            if raw:
+                tokens.append(''.join(raw))
+                raw = []
+            tokens.append(code)
+            converted += 1
+            i += length
+        if raw:
+            tokens.append(''.join(raw))
+        return ' '.join(tokens), Counts(len(line), converted, uncovered)
+
+    def decode(self, line):
+        '''Return (text of line, Counts).'''
+        phrases = self.phrases
+        parts = []
+        converted = uncovered = 0
+        # True if the last part is a token kept as it was, the next one is
+        # then separated by a space
+        kept = False
+        for token in line.split():
+            phrase = phrases.get(token)
+            if phrase is None:
+                if kept:
+                    parts.append(' ')
+                parts.append(token)
+                kept = True
+                uncovered += 1
+            else:
+                parts.append(phrase)
+                kept = False
+                converted += 1
+        return ''.join(parts), Counts(len(line), converted, uncovered)
+
+
+# The Converter of a worker process, built once by _init_worker()
+_converter = None
+
+
+def _init_worker(db_file):
+    global _converter
+    _converter = Converter.from_db(db_file)
+
+
+def _convert_chunk(direction, lines, converter=None):
+    # Convert a list of lines, returns (output text, summed Counts)
+    convert = getattr(converter or _converter, direction)
+    output = []
+    chars = converted = uncovered = 0
+    for line in lines:
+        text, counts = convert(line.rstrip('\n'))
+        output.append(text + '\n')
+        chars += counts.chars
+        converted += counts.converted
+        uncovered += counts.uncovered
+    return ''.join(output), Counts(chars, converted, uncovered)
+
+
+def _read_chunks(paths, chunk_lines):
+    # Yield lists of chunk_lines lines of the files, '-' being stdin
+    for path in paths:
+        f = sys.stdin if path == '-' else open(path, encoding='utf-8')
+        try:
+            while True:
+                lines = list(itertools.islice(f, chunk_lines))
+                if not lines:
+                    break
+                yield lines
+        finally:
+            if f is not sys.stdin:
+                f.close()
+
+
+def convert(db_file, direction, paths, output, jobs, chunk_lines=CHUNK_LINES):
+    '''Convert the files paths into the file object output, with jobs
+    processes. Returns the summed Counts.
+    '''
+    chars = converted = uncovered = 0
+    chunks = _read_chunks(paths, chunk_lines)
+    if jobs <= 1:
+        converter = Converter.from_db(db_file)
+        results = (_convert_chunk(direction, lines, converter) for lines in chunks)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(jobs, _init_worker, (db_file,))
+        results = ordered_results(pool, _convert_chunk, ((direction, lines) for lines in chunks), jobs * 4)
+    try:
+        for text, counts in results:
+            output.write(text)
+            chars += counts.chars
+            converted += counts.converted
+            uncovered += counts.uncovered
+    finally:
+        if pool is not None:
+            pool.terminate()
+    return Counts(chars, converted, uncovered)
+
+
+def ordered_results(pool, function, arguments, window):
+    '''Yield function(*args) for each args of arguments, run by pool, in
+    order. At most window calls are submitted ahead, so that memory does
+    not grow with the input (Pool.imap reads its whole input ahead).
+    '''
+    pending = collections.deque()
+    for args in arguments:
+        pending.append(pool.apply_async(function, args))
+        if len(pending) >= window:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def main(argv=None):
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description='Convert text to Wubi codes, or codes to text.')
+    parser.add_argument('direction', choices=['encode', 'decode'],
+                        help='encode: text to Wubi codes. decode: Wubi codes to text.')
+    parser.add_argument('files', nargs='*', default=['-'],
+                        help='UTF-8 input files, - for stdin (default: stdin)')
+    parser.add_argument('--db', default=os.path.join(base_dir, 'wubi-jidian86.db'),
+                        help='Wubi dictionary (default: %(default)s)')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1,
+                        help='worker processes, 1 to convert in this one (default: %(default)s)')
+    parser.add_argument('-o', '--output', help='output file (default: stdout)')
+    args = parser.parse_args(argv)
+
+    output = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    start = time.time()
+    try:
+        counts = convert(args.db, args.direction, args.files, output, args.jobs)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    elapsed = time.time() - start
+    print('{} chars in {:.2f}s ({:.0f} chars/s, {} jobs): {} {}, {} {}'.format(
+        counts.chars, elapsed, counts.chars / max(elapsed, 1e-9), args.jobs,
+        counts.converted, 'phrases encoded' if args.direction == 'encode' else 'codes decoded',
+        counts.uncovered, 'Han characters without a code' if args.direction == 'encode' else 'tokens kept'),
+        file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
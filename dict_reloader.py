@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+import os
+import sqlite3
+import threading
+import time
+
+import composer
+import dictdb
+import logconfig
+from associations import Associations
+from compiled_dict import compiled_path
+
+logger = logconfig.get_logger()
+
+# One Wubi key, any of them must have candidates in a usable dictionary
+_SMOKE_CODES = 'abcdefghijklmnopqrstuvwxy'
+
+
+def rss_bytes():
+    '''Return the resident memory of the process, or None if unknown.'''
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class DictionaryReloader(object):
+    '''Reloads the dictionary of a Context when it changes on disk.
+
+    A background thread checks every interval seconds the dictionary stamp
+    of db_file and the signature of its compiled form, so rebuilding the
+    pinyin tables, training freq, replacing the file or compiling it are
+    all noticed, but user_freq writes are not. The new dictionary is
+    loaded and validated on that thread, with a connection of its own, and
+    the swap is then handed to schedule() (GLib.idle_add), so it happens on
+    the main loop between two keys. Lookups notice the new dictionary and
+    drop their caches, and the old one is closed, along with the connection
+    it was loaded from if it was a reload. A dictionary that fails
+    validation is logged, closed and ignored until the files change again,
+    the old one keeps serving.
+    '''
+
+    def __init__(self, context, db_file, schedule, interval=5, table_size=10, charset=dictdb.CHARSET_FULL):
+        self.context = context
+        self.db_file = db_file
+        self.schedule = schedule
+        self.interval = interval
+        self.table_size = table_size
+        self.charset = charset
+        self.reloads = 0
+        self.failures = 0
+        # The signature of the files the current dictionary was loaded from
+        self._loaded = self._signature()
+        # The connection of the current dictionary if it was reloaded, the
+        # first one belongs to the engine
+        self._conn = None
+        # The last error reading the signature, warned about once
+        self._error = None
+        self._closing = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='iwubi-dict-reload', daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._closing.set()
+        self._thread.join()
+
+    def _signature(self):
+        # Raises sqlite3.Error while there is no file, without creating one
+        conn = dictdb.connect_existing(self.db_file, readonly=True)
+        try:
+            stamp = dictdb.dictionary_stamp(conn.cursor())
+        finally:
+            conn.close()
+        try:
+            st = os.stat(compiled_path(self.db_file, self.charset))
+            compiled = (st.st_ino, st.st_size, st.st_mtime_ns)
+        except OSError:
+            compiled = None
+        return stamp, compiled
+
+    def _run(self):
+        while not self._closing.wait(self.interval):
+            try:
+                signature = self._signature()
+            except sqlite3.Error as e:
+                # e.g. the file is being replaced or is not a dictionary, try
+                # again next time and warn once
+                if str(e) != self._error:
+                    self._error = str(e)
+                    self.failures += 1
+                    logger.warning('Cannot read the dictionary stamp of {}: {}'.format(self.db_file, e))
+                continue
+            self._error = None
+            if signature != self._loaded:
+                self._reload()
+
+    def _reload(self):
+        start = time.time()
+        rss = rss_bytes()
+        conn = dictionary = associations = None
+        try:
+            conn = dictdb.connect_existing(self.db_file, check_same_thread=False)
+            try:
+                dictdb.migrate(conn)
+            except sqlite3.Error as e:
+                logger.warning('Dictionary migration failed: {}'.format(e))
+            # Read before loading, a change made meanwhile is reloaded next time
+            self._loaded = self._signature()
+            dictionary = composer.load_dictionary(conn, self.db_file, self.table_size, self.charset)
+            problem = self._validate(conn, dictionary)
+            if self.context.associations is not None:
+                associations = Associations(self.db_file, self.charset)
+        except (sqlite3.Error, OSError, ValueError) as e:
+            problem = str(e)
+        if problem:
+            self.failures += 1
+            logger.warning('Not reloading {}, keeping the loaded dictionary: {}'.format(self.db_file, problem))
+            if dictionary is not None:
+                dictionary.close()
+            if associations is not None:
+                associations.close()
+            if conn is not None:
+                conn.close()
+            return
+        used = rss_bytes()
+        logger.info('Reloaded {} in {:.3f}s, resident memory {}'.format(
+            dictionary, time.time() - start,
+            '{:+.1f} MB'.format((used - rss) / 1e6) if rss is not None and used is not None else 'unknown'))
+        self.schedule(lambda: self._swap(dictionary, associations, conn))
+
+    def _validate(self, conn, dictionary):
+        # Returns why dictionary cannot be used, or None
+        version = dictdb.schema_version(conn)
+        if version < dictdb.SCHEMA_VERSION:
+            return 'schema version {}, {} needed'.format(version, dictdb.SCHEMA_VERSION)
+        failures = dictdb.check_query_plans(conn)
+        if failures:
+            return 'full scan in {}'.format(', '.join(name for name, detail in failures))
+        if not any(dictionary.lookup(code)[0] or dictionary.lookup(code)[1] for code in _SMOKE_CODES):
+            return 'no Wubi candidates'
+        return None
+
+    def _swap(self, dictionary, associations, conn):
+        # On the main loop. The worker's lock keeps a lookup in progress on
+        # the dictionary it started with.
+        old = self.context.dictionary
+        old_associations = self.context.associations if associations is not None else None
+        worker = self.context.worker
+        if worker is not None:
+            with worker.lock:
+                self._assign(dictionary, associations)
+        else:
+            self._assign(dictionary, associations)
+        # Nothing uses the old dictionary any more: lookups run on the main
+        # loop or under the worker's lock
+        if old is not None:
+            old.close()
+        if old_associations is not None:
+            old_associations.close()
+        if self._conn is not None:
+            self._conn.close()
+        self._conn = conn
+        self.reloads += 1
+        return False
+
+    def _assign(self, dictionary, associations):
+        self.context.dictionary = dictionary
+        if associations is not None:
+            self.context.associations = associations
@@ -0,0 +1,583 @@
+# -*- coding: utf-8 -*-
+import argparse
+import functools
+import itertools
+import os
+import re
+import sqlite3
+import sys
+import urllib.parse
+import uuid
+
+import config
+from wubi_index import WubiIndex
+
+# Queries issued while typing. They use bound parameters so sqlite3 reuses
+# the prepared statements, and check_query_plans() verifies that every one
+# of them is served by an index search rather than a full table scan.
+PINYIN_PREFIX_QUERY = 'SELECT phrases, pinyins, charsets FROM pinyin_prefixes WHERE prefix = ?'
+PINYIN_RANGE_QUERY = '''SELECT phrase, pinyin
+    FROM pinyins
+    WHERE pinyin >= ? AND pinyin < ?
+        AND freq > 0 AND charset <= ?
+    ORDER BY freq DESC, id
+    LIMIT ?'''
+# Keyset pagination of PINYIN_RANGE_QUERY: the rows ranked after the row
+# (freq, id) ending the previous page
+PINYIN_PAGE_QUERY = '''SELECT phrase, pinyin, freq, id
+    FROM pinyins
+    WHERE pinyin >= ? AND pinyin < ?
+        AND freq > 0 AND charset <= ? AND (freq < ? OR freq = ? AND id > ?)
+    ORDER BY freq DESC, id
+    LIMIT ?'''
+# Key of the first page of PINYIN_PAGE_QUERY, ranked before any row
+PINYIN_PAGE_START = (1 << 62, 0)
+
+ASSOCIATION_QUERY = 'SELECT phrases FROM associations WHERE charset = ? AND first = ?'
+
+PINYINS_TABLE = '''CREATE TABLE pinyins
+    (id INTEGER PRIMARY KEY, phrase TEXT, pinyin TEXT,
+    freq INTEGER, charset INTEGER)'''
+PINYINS_INDEX = '''CREATE INDEX IF NOT EXISTS pinyins_pinyin
+    ON pinyins (pinyin, freq, phrase, charset)'''
+
+# Charsets, each holding the characters of the previous ones: the common
+# characters (level 1 of GB2312), GB2312 and every character. The charset of
+# a phrase, the smallest one holding all its characters, is stored in the
+# charset column of phrases and pinyins.
+CHARSET_COMMON = 0
+CHARSET_GB2312 = 1
+CHARSET_FULL = 2
+CHARSETS = ('common', 'gb2312', 'full')
+
+HOT_QUERIES = {
+    'pinyin_prefix': (PINYIN_PREFIX_QUERY, ('a',)),
+    'pinyin_range': (PINYIN_RANGE_QUERY, ('zhong', 'zhonh', CHARSET_FULL, 10)),
+    'pinyin_page': (PINYIN_PAGE_QUERY, ('zhong', 'zhonh', CHARSET_FULL, 100, 100, 0, 10)),
+    'association': (ASSOCIATION_QUERY, (CHARSET_FULL, '中')),
+}
+
+
+def set_meta(cursor, key, value):
+    cursor.execute('''CREATE TABLE IF NOT EXISTS iwubi_meta
+        (key TEXT PRIMARY KEY, value TEXT)''')
+    cursor.execute('INSERT OR REPLACE INTO iwubi_meta VALUES (?, ?)', (key, str(value)))
+
+
+def get_meta(cursor, key, default=None):
+    try:
+        row = cursor.execute('SELECT value FROM iwubi_meta WHERE key = ?', (key,)).fetchone()
+    except Exception:
+        # Dictionary built before iwubi_meta existed
+        return default
+    return row[0] if row else default
+
+
+def dictionary_stamp(cursor):
+    '''Return the stamp identifying the current dictionary content, or None.
+
+    The stamp changes whenever phrases, pinyins or their freq are rebuilt,
+    but not when user_freq is updated. Derived files such as the compiled
+    dictionary record it to detect that they are stale.
+    '''
+    return get_meta(cursor, 'dict_stamp')
+
+
+def touch_dictionary(cursor):
+    '''Give the dictionary content a new stamp.'''
+    set_meta(cursor, 'dict_stamp', uuid.uuid4().hex)
+
+
+@functools.lru_cache(maxsize=None)
+def _charset_chars():
+    # The characters of the common and GB2312 charsets, from the EUC-CN code
+    # table: the common characters are the level 1 rows, lead bytes 0xb0 to
+    # 0xd7, with the symbols before them and ASCII, level 2 comes after.
+    common = set(map(chr, range(0x80)))
+    gb2312 = set()
+    for lead in range(0xa1, 0xf8):
+        for trail in range(0xa1, 0xff):
+            try:
+                char = bytes((lead, trail)).decode('gb2312')
+            except UnicodeDecodeError:
+                continue
+            (common if lead < 0xd8 else gb2312).add(char)
+    return frozenset(common), frozenset(common | gb2312)
+
+
+def charset_of(phrase):
+    '''Return the smallest charset holding every character of phrase.'''
+    common, gb2312 = _charset_chars()
+    if common.issuperset(phrase):
+        return CHARSET_COMMON
+    if gb2312.issuperset(phrase):
+        return CHARSET_GB2312
+    return CHARSET_FULL
+
+
+def connect_existing(db_file, readonly=False, **kwargs):
+    '''Open db_file, kwargs as for sqlite3.connect(). Raises
+    sqlite3.OperationalError if there is no such file, which
+    sqlite3.connect() would create empty.
+    '''
+    uri = 'file:{}?mode={}'.format(urllib.parse.quote(os.path.abspath(db_file)), 'ro' if readonly else 'rw')
+    return sqlite3.connect(uri, uri=True, **kwargs)
+
+
+class RowError(ValueError):
+    pass
+
+
+_PINYIN_RE = re.compile('[a-z]+$')
+
+
+def parse_pinyin_line(line):
+    '''Return (phrase, pinyin, freq) of a pinyin_simp.dict.csv line.
+
+    Raises RowError if the line is malformed.
+    '''
+    fields = line.rstrip('\n').split('\t')
+    if len(fields) != 3:
+        raise RowError('expected 3 tab separated fields, got {}'.format(len(fields)))
+    phrase, pinyin, freq = fields
+    pinyin = pinyin.replace(' ', '')
+    if not phrase or phrase != phrase.strip():
+        raise RowError('bad phrase {!r}'.format(phrase))
+    if not _PINYIN_RE.match(pinyin):
+        raise RowError('bad pinyin {!r}'.format(pinyin))
+    if not freq.isdigit():
+        raise RowError('bad freq {!r}'.format(freq))
+    return phrase, pinyin, int(freq)
+
+
+def read_pinyin_csv(csv_file, errors=None):
+    '''Stream (id, phrase, pinyin, freq) rows of pinyin_simp.dict.csv.
+
+    id is the 0 based line number. Malformed lines are skipped; if errors is
+    a list, (line number, message) is appended to it for each of them.
+    '''
+    with open(csv_file, encoding='utf-8') as f:
+        for i, line in enumerate(f):
+            try:
+                yield (i,) + parse_pinyin_line(line)
+            except RowError as e:
+                if errors is not None:
+                    errors.append((i + 1, str(e)))
+
+
+def build_pinyins(cursor, rows):
+    '''(Re)create the pinyins table from (id, phrase, pinyin, freq) rows,
+    with its index and pinyin_prefixes. Returns the number of rows.
+
+    Run it inside a transaction so that readers never see a partial table.
+    '''
+    cursor.execute('DROP TABLE IF EXISTS pinyins')
+    cursor.execute(PINYINS_TABLE)
+    cursor.executemany('INSERT INTO pinyins VALUES (?, ?, ?, ?, ?)',
+                       (row + (charset_of(row[1]),) for row in rows))
+    count = cursor.execute('SELECT count(*) FROM pinyins').fetchone()[0]
+    cursor.execute(PINYINS_INDEX)
+    build_pinyin_prefixes(cursor)
+    build_associations(cursor)
+    touch_dictionary(cursor)
+    return count
+
+
+def build_pinyin_prefixes(cursor,
+                          max_len=config.PINYIN_PREFIX_MAX_LEN,
+                          top_n=config.PINYIN_PREFIX_TOP_N):
+    '''Materialize the top-N phrases of every pinyin prefix up to max_len,
+    for every charset at once.
+
+    Each row of pinyin_prefixes holds the tab separated phrases, their
+    pinyin and the charset of each, one digit per phrase, in rank order.
+    Those of a charset or a smaller one, first top_n of them, are what
+    PINYIN_RANGE_QUERY would return with LIMIT top_n for that charset, so a
+    short prefix lookup is a single primary key read. The charset column of
+    the row is the smallest of its phrases.
+    '''
+    prefixes = {}
+    rows = cursor.execute('''SELECT phrase, pinyin, {}
+        FROM pinyins
+        WHERE freq > 0
+        ORDER BY freq DESC, id'''.format(_charset_column(cursor, 'pinyins')))
+    for phrase, pinyin, charset in rows:
+        row = (phrase, pinyin, charset)
+        # Longest prefix first: once a prefix has top_n rows of the charset,
+        # the shorter ones have too
+        for i in range(min(len(pinyin), max_len), 0, -1):
+            # top is the rows of the prefix and, for each charset, how many
+            # of them it has. A phrase is in its charset and every larger
+            # one, and is kept while its charset has fewer than top_n.
+            prefix = pinyin[:i]
+            top = prefixes.get(prefix)
+            if top is None:
+                # The counts are 0 below the smallest charset of the rows
+                prefixes[prefix] = ([row], [int(charset <= mode) for mode in range(CHARSET_FULL + 1)])
+            elif top[1][charset] < top_n:
+                top[0].append(row)
+                counts = top[1]
+                for mode in range(charset, CHARSET_FULL + 1):
+                    counts[mode] += 1
+            else:
+                break
+
+    cursor.execute('DROP TABLE IF EXISTS pinyin_prefixes')
+    cursor.execute('''CREATE TABLE pinyin_prefixes
+        (prefix TEXT PRIMARY KEY, charset INTEGER, phrases TEXT, pinyins TEXT, charsets TEXT)
+        WITHOUT ROWID''')
+    cursor.executemany('INSERT INTO pinyin_prefixes VALUES (?, ?, ?, ?, ?)',
+                       ((prefix, counts.count(0), '\t'.join(row[0] for row in top),
+                         '\t'.join(row[1] for row in top), ''.join(str(row[2]) for row in top))
+                        for prefix, (top, counts) in sorted(prefixes.items())))
+    set_meta(cursor, 'pinyin_prefix_max_len', max_len)
+    set_meta(cursor, 'pinyin_prefix_top_n', top_n)
+    return len(prefixes)
+
+
+def build_associations(cursor, top_k=config.ASSOCIATION_TOP_K):
+    '''Materialize the top-k phrases of more than one character starting
+    with each character, from phrases and pinyins, for each charset.
+
+    Each row of associations holds the tab separated phrases of a charset
+    and a first character, so the phrases following a committed character
+    are a single primary key read. The freq of the two tables are not on
+    the same scale, so their rankings are interleaved.
+    '''
+    query = '''SELECT phrase, {}
+        FROM {}
+        WHERE freq > 0 AND length(phrase) > 1
+        ORDER BY freq DESC, id'''
+    tables = [table for table in ('phrases', 'pinyins') if _has_table(cursor, table)]
+    firsts = {}
+    for source, table in enumerate(tables):
+        for phrase, charset in cursor.execute(query.format(_charset_column(cursor, table), table)).fetchall():
+            tops = firsts.get(phrase[0])
+            if tops is None:
+                tops = firsts[phrase[0]] = tuple(([], [], [0] * (CHARSET_FULL + 1)) for t in tables)
+            # The phrases of the table in one pass for every charset, as in
+            # build_pinyin_prefixes()
+            phrases, charsets, counts = tops[source]
+            if counts[charset] < top_k and phrase not in phrases:
+                phrases.append(phrase)
+                charsets.append(charset)
+                for mode in range(charset, CHARSET_FULL + 1):
+                    counts[mode] += 1
+
+    cursor.execute('DROP TABLE IF EXISTS associations')
+    cursor.execute('''CREATE TABLE associations
+        (charset INTEGER, first TEXT, phrases TEXT,
+        PRIMARY KEY (charset, first)) WITHOUT ROWID''')
+    rows = []
+    for first, tops in sorted(firsts.items()):
+        # The charsets below the smallest of the phrases have none of them,
+        # those from the largest of the first top_k on have the same ones
+        smallest = min(counts.count(0) for phrases, charsets, counts in tops)
+        largest = max(max(charsets[:top_k], default=CHARSET_COMMON) for phrases, charsets, counts in tops)
+        for mode in range(smallest, CHARSET_FULL + 1):
+            if mode > largest:
+                rows.append((mode, first, merged))
+                continue
+            if mode < largest:
+                ranked = [itertools.islice(itertools.compress(phrases, map(mode.__ge__, charsets)), top_k)
+                          for phrases, charsets, counts in tops]
+            else:
+                ranked = [phrases[:top_k] for phrases, charsets, counts in tops]
+            # Interleaved and deduplicated, in order
+            merged = dict.fromkeys(itertools.chain.from_iterable(itertools.zip_longest(*ranked)))
+            merged.pop(None, None)
+            merged = '\t'.join(itertools.islice(merged, top_k))
+            rows.append((mode, first, merged))
+    cursor.executemany('INSERT INTO associations VALUES (?, ?, ?)', rows)
+    set_meta(cursor, 'association_top_k', top_k)
+    return len(rows)
+
+
+def pinyin_prefix_max_len(cursor, table_size):
+    '''Return the longest prefix that pinyin_prefixes can answer for a page
+    of table_size candidates, or 0 if the table is missing, too shallow or
+    in the format of an older schema version.
+    '''
+    if schema_version(cursor) < 6:
+        return 0
+    top_n = int(get_meta(cursor, 'pinyin_prefix_top_n', 0))
+    if top_n < table_size:
+        return 0
+    return int(get_meta(cursor, 'pinyin_prefix_max_len', 0))
+
+
+def prefix_range(prefix):
+    '''Return the half-open key range [low, high) of strings starting with prefix.
+
+    ``col >= low AND col < high`` is the index friendly form of
+    ``col LIKE 'prefix%' AND substr(col, 1, len) = 'prefix'``.
+    '''
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def _has_table(cursor, name):
+    return cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                          (name,)).fetchone() is not None
+
+
+def _charset_column(cursor, table):
+    # The charset column of table, or every phrase in the full charset in
+    # the migrations before _migrate_6 added it
+    columns = [row[1] for row in cursor.execute('PRAGMA table_info({})'.format(table))]
+    return 'charset' if 'charset' in columns else str(CHARSET_FULL)
+
+
+def _migrate_1(cursor):
+    # Covering indexes matching the access patterns of the engine and tools:
+    # Wubi code ranges, phrase -> code, and pinyin prefix ranges.
+    cursor.execute('''CREATE INDEX IF NOT EXISTS phrases_tabkeys
+        ON phrases (tabkeys, freq, phrase, user_freq)''')
+    cursor.execute('''CREATE INDEX IF NOT EXISTS phrases_phrase
+        ON phrases (phrase, tabkeys)''')
+    if _has_table(cursor, 'pinyins'):
+        # The index of this version, _migrate_6 replaces it
+        cursor.execute('''CREATE INDEX IF NOT EXISTS pinyins_pinyin
+            ON pinyins (pinyin, freq, phrase)''')
+    cursor.execute('ANALYZE')
+
+
+def _migrate_2(cursor):
+    # pinyin_prefixes also stores the pinyin of each phrase, so that cached
+    # lookups can be narrowed to a longer prefix without querying again.
+    if _has_table(cursor, 'pinyins'):
+        build_pinyin_prefixes(cursor)
+
+
+def _migrate_3(cursor):
+    # Dictionaries get a content stamp, see dictionary_stamp()
+    touch_dictionary(cursor)
+
+
+def _migrate_4(cursor):
+    # Follow-on phrases of each character, see build_associations()
+    build_associations(cursor)
+
+
+def _migrate_5(cursor):
+    # Learned pairs of consecutive commits, see bigram.py
+    cursor.execute('''CREATE TABLE IF NOT EXISTS bigrams
+        (prev TEXT, phrase TEXT, count INTEGER, PRIMARY KEY (prev, phrase)) WITHOUT ROWID''')
+
+
+def _migrate_6(cursor):
+    # The charset of every phrase, the pinyin index covering it, and
+    # pinyin_prefixes and associations serving each charset, see
+    # config.CHARSET
+    for table in ('phrases', 'pinyins'):
+        if not _has_table(cursor, table):
+            continue
+        cursor.execute('ALTER TABLE {} ADD COLUMN charset INTEGER'.format(table))
+        rows = cursor.execute('SELECT id, phrase FROM {}'.format(table)).fetchall()
+        cursor.executemany('UPDATE {} SET charset = ? WHERE id = ?'.format(table),
+                           ((charset_of(phrase), row_id) for row_id, phrase in rows))
+    if _has_table(cursor, 'pinyins'):
+        cursor.execute('DROP INDEX IF EXISTS pinyins_pinyin')
+        cursor.execute(PINYINS_INDEX)
+        build_pinyin_prefixes(cursor)
+    build_associations(cursor)
+
+
+# Schema migrations, applied in order. The version of a dictionary is kept
+# in PRAGMA user_version.
+MIGRATIONS = [
+    (1, _migrate_1),
+    (2, _migrate_2),
+    (3, _migrate_3),
+    (4, _migrate_4),
+    (5, _migrate_5),
+    (6, _migrate_6),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(conn):
+    # Accepts a connection or a cursor
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn):
+    '''Bring the dictionary up to SCHEMA_VERSION.
+
+    Each migration runs in its own transaction together with the version
+    bump and a new dictionary stamp, so an interrupted migration is simply
+    retried next time. Returns the list of applied versions.
+    '''
+    applied = []
+    cursor = conn.cursor()
+    for version, step in MIGRATIONS:
+        if schema_version(conn) >= version:
+            continue
+        # Begun explicitly, as sqlite3 would run the ALTER and CREATE of a
+        # step outside of its implicit transaction
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            # Unless another process migrated it meanwhile
+            if schema_version(cursor) < version:
+                step(cursor)
+                touch_dictionary(cursor)
+                cursor.execute('PRAGMA user_version = {:d}'.format(version))
+                applied.append(version)
+        except BaseException:
+            cursor.execute('ROLLBACK')
+            raise
+        cursor.execute('COMMIT')
+    return applied
+
+
+class SqliteDictionary(object):
+    '''Dictionary served from wubi-jidian86.db.
+
+    Wubi codes are answered from an in-memory WubiIndex built at load time,
+    pinyin prefixes with the hot queries above. Only the phrases of charset
+    are candidates: the index holds only those, and the rows of
+    pinyin_prefixes are filtered by charset.
+    '''
+
+    def __init__(self, conn, table_size=10, charset=CHARSET_FULL):
+        self.cursor = conn.cursor()
+        self.charset = charset
+        # As in the charsets column of pinyin_prefixes
+        self._charset_digit = str(charset)
+        self.wubi = WubiIndex.from_db(self.cursor, charset=None if charset == CHARSET_FULL else charset)
+        self.pinyin_prefix_max_len = pinyin_prefix_max_len(self.cursor, table_size)
+        # Every pinyin prefix up to pinyin_prefix_max_len, for _has_pinyin()
+        self.pinyin_prefixes = set()
+        if self.pinyin_prefix_max_len:
+            self.pinyin_prefixes.update(row[0] for row in self.cursor.execute(
+                'SELECT prefix FROM pinyin_prefixes WHERE charset <= ?', (charset,)))
+        # Number of SQLite queries issued
+        self.query_count = 0
+
+    def close(self):
+        '''Release the cursor. The connection belongs to the caller.'''
+        self.cursor.close()
+
+    def lookup(self, code):
+        return self.wubi.lookup(code)
+
+    def extension_count(self, code):
+        return self.wubi.extension_count(code)
+
+    def code_of(self, phrase):
+        return self.wubi.code_of(phrase)
+
+    def unique_candidate(self, code):
+        '''Return the phrase of code if it is its only candidate: the only
+        Wubi row starting with code, with no pinyin starting with it either.
+        Else None.
+        '''
+        phrase = self.wubi.unique(code)
+        if phrase is None or self._has_pinyin(code):
+            return None
+        return phrase
+
+    def _has_pinyin(self, prefix):
+        if len(prefix) <= self.pinyin_prefix_max_len:
+            return prefix in self.pinyin_prefixes
+        # Called on the main loop, from unique_candidate(). A cursor of its
+        # own, as self.cursor may be in use by a lookup on the worker thread,
+        # but the same connection: the key waits for that lookup's current
+        # query. Only reached for prefixes longer than those in
+        # pinyin_prefixes, see config.PINYIN_PREFIX_MAX_LEN.
+        self.query_count += 1
+        low, high = prefix_range(prefix)
+        return self.cursor.connection.execute(PINYIN_RANGE_QUERY, (low, high, self.charset, 1)).fetchone() is not None
+
+    def pinyin_rows(self, prefix, limit):
+        '''Return up to limit (pinyin, phrase) rows starting with prefix,
+        ordered by freq DESC.
+        '''
+        self.query_count += 1
+        if len(prefix) <= self.pinyin_prefix_max_len:
+            # Short prefix: a single keyed read of the precomputed top-N
+            row = self.cursor.execute(PINYIN_PREFIX_QUERY, (prefix,)).fetchone()
+            if not row:
+                return []
+            phrases, pinyins, charsets = row
+            rows = zip(pinyins.split('\t'), phrases.split('\t'))
+            if self.charset != CHARSET_FULL:
+                rows = itertools.compress(rows, (charset <= self._charset_digit for charset in charsets))
+            return list(itertools.islice(rows, limit))
+        low, high = prefix_range(prefix)
+        return [(pinyin, phrase) for phrase, pinyin in
+                self.cursor.execute(PINYIN_RANGE_QUERY, (low, high, self.charset, limit))]
+
+    def wubi_page(self, code, after, limit):
+        '''Return the next limit (tabkeys, phrase, freq) rows strictly
+        extending code, ranked after the key after (None for the first
+        page), and the key of the last one.
+        '''
+        return self.wubi.extensions_page(code, after, limit)
+
+    def wildcard_page(self, pattern, after, limit):
+        '''Return the next limit (tabkeys, phrase, freq) rows whose tabkeys
+        start with pattern, config.WILDCARD_KEY matching any key, ranked
+        after the key after (None for the first page), and the key of the
+        last one.
+        '''
+        return self.wubi.wildcard_page(pattern, after, limit)
+
+    def pinyin_page(self, prefix, after, limit):
+        '''Return the next limit (pinyin, phrase) rows starting with prefix,
+        ranked after the key after (None for the first page), and the key of
+        the last one.
+        '''
+        self.query_count += 1
+        low, high = prefix_range(prefix)
+        freq, row_id = after or PINYIN_PAGE_START
+        rows = self.cursor.execute(PINYIN_PAGE_QUERY, (low, high, self.charset, freq, freq, row_id, limit)).fetchall()
+        if rows:
+            after = rows[-1][2:]
+        return [(pinyin, phrase) for phrase, pinyin, freq, row_id in rows], after
+
+    def __str__(self):
+        return 'SqliteDictionary({} Wubi prefixes, {})'.format(len(self.wubi), CHARSETS[self.charset])
+
+
+def check_query_plans(conn):
+    '''Return a list of (name, plan detail) of hot queries that fall back to
+    a full scan. An empty list means every hot query is an index search.
+    '''
+    failures = []
+    for name, (query, parameters) in sorted(HOT_QUERIES.items()):
+        for row in conn.execute('EXPLAIN QUERY PLAN ' + query, parameters):
+            detail = row[-1]
+            # "SEARCH ..." is an index lookup or range scan, "SCAN ..." reads
+            # the whole table or index.
+            if re.match(r'SCAN (TABLE )?\w+', detail):
+                failures.append((name, detail))
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='iWubi dictionary schema tool.')
+    parser.add_argument('command', choices=['migrate', 'check'],
+                        help='migrate: apply pending schema migrations. '
+                             'check: fail if a hot query is not served by an index.')
+    parser.add_argument('db', help='path of wubi-jidian86.db')
+    args = parser.parse_args(argv)
+
+    conn = sqlite3.connect(args.db)
+    try:
+        if args.command == 'migrate':
+            applied = migrate(conn)
+            print('{}: schema version {}, applied {}'.format(args.db, schema_version(conn), applied or 'none'))
+            return 0
+        failures = check_query_plans(conn)
+        for name, detail in failures:
+            print('FULL SCAN {}: {}'.format(name, detail), file=sys.stderr)
+        if failures:
+            return 1
+        print('{}: all {} hot queries use an index'.format(args.db, len(HOT_QUERIES)))
+        return 0
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
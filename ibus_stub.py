@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+'''Minimal stand-in for gi.repository.IBus/GLib/GObject.
+
+install() registers fake ``gi`` modules so that iwubi.py can be imported and
+its engine driven headless, without python3-gi or a running ibus-daemon,
+e.g. by benchmark.py. Only what iwubi.py uses is implemented. Key values and
+modifier masks are the real X11/IBus ones.
+'''
+import sys
+import time
+import types
+
+import keysyms
+
+
+class ModifierType(object):
+    SHIFT_MASK = keysyms.SHIFT_MASK
+    LOCK_MASK = keysyms.LOCK_MASK
+    CONTROL_MASK = keysyms.CONTROL_MASK
+    MOD1_MASK = keysyms.MOD1_MASK
+    MOD2_MASK = keysyms.MOD2_MASK
+    MOD3_MASK = keysyms.MOD3_MASK
+    MOD4_MASK = keysyms.MOD4_MASK
+    MOD5_MASK = keysyms.MOD5_MASK
+    BUTTON1_MASK = keysyms.BUTTON1_MASK
+    BUTTON2_MASK = keysyms.BUTTON2_MASK
+    BUTTON3_MASK = keysyms.BUTTON3_MASK
+    BUTTON4_MASK = keysyms.BUTTON4_MASK
+    BUTTON5_MASK = keysyms.BUTTON5_MASK
+    SUPER_MASK = keysyms.SUPER_MASK
+    HYPER_MASK = keysyms.HYPER_MASK
+    META_MASK = keysyms.META_MASK
+    RELEASE_MASK = keysyms.RELEASE_MASK
+    MODIFIER_MASK = keysyms.MODIFIER_MASK
+
+
+# Key name -> keyval. Punctuation keys are also reachable by their character.
+KEYVALS = dict((name, keyval) for keyval, name in keysyms.NAMES.items())
+for _c in '''!"#$%&'()*+,-./:;<=>?@[\\]^_`{|}~''':
+    KEYVALS[_c] = ord(_c)
+
+
+class Text(object):
+    def __init__(self, text):
+        self.text = text
+        self.attributes = None
+
+    @classmethod
+    def new_from_string(cls, text):
+        return cls(text)
+
+    def set_attributes(self, attrs):
+        self.attributes = attrs
+
+    def get_text(self):
+        return self.text
+
+
+class LookupTable(object):
+    def __init__(self, page_size, cursor_pos, cursor_visible, round):
+        self.page_size = page_size
+        self.cursor_pos = cursor_pos
+        self.round = round
+        self.candidates = []
+
+    @classmethod
+    def new(cls, page_size, cursor_pos, cursor_visible, round):
+        return cls(page_size, cursor_pos, cursor_visible, round)
+
+    def set_orientation(self, orientation):
+        pass
+
+    def clear(self):
+        self.candidates = []
+        self.cursor_pos = 0
+
+    def append_candidate(self, text):
+        self.candidates.append(text)
+
+    def get_number_of_candidates(self):
+        return len(self.candidates)
+
+    def get_cursor_pos(self):
+        return self.cursor_pos
+
+    def set_cursor_pos(self, pos):
+        # ibus_lookup_table_set_cursor_pos() ignores out of range positions
+        if pos < len(self.candidates):
+            self.cursor_pos = pos
+
+    def get_page_size(self):
+        return self.page_size
+
+    # Paging and cursor moves follow ibuslookuptable.c, including round
+
+    def page_up(self):
+        if not self.candidates:
+            return False
+        if self.cursor_pos < self.page_size:
+            if not self.round:
+                return False
+            last_page = (len(self.candidates) - 1) // self.page_size
+            self.cursor_pos = min(last_page * self.page_size + self.cursor_pos % self.page_size,
+                                  len(self.candidates) - 1)
+            return True
+        self.cursor_pos -= self.page_size
+        return True
+
+    def page_down(self):
+        if not self.candidates:
+            return False
+        if self.cursor_pos // self.page_size == (len(self.candidates) - 1) // self.page_size:
+            if not self.round:
+                return False
+            self.cursor_pos %= self.page_size
+            return True
+        self.cursor_pos = min(self.cursor_pos + self.page_size, len(self.candidates) - 1)
+        return True
+
+    def cursor_up(self):
+        if not self.candidates:
+            return False
+        if self.cursor_pos == 0:
+            if not self.round:
+                return False
+            self.cursor_pos = len(self.candidates) - 1
+            return True
+        self.cursor_pos -= 1
+        return True
+
+    def cursor_down(self):
+        if not self.candidates:
+            return False
+        if self.cursor_pos == len(self.candidates) - 1:
+            if not self.round:
+                return False
+            self.cursor_pos = 0
+            return True
+        self.cursor_pos += 1
+        return True
+
+
+class Engine(object):
+    '''Records what the engine would send to ibus-daemon over D-Bus.'''
+
+    def __init__(self):
+        self.committed = []
+        # Number of messages sent to the panel/application
+        self.messages = 0
+        # perf_counter() of the first lookup table update since it was last
+        # set to None
+        self.table_shown = None
+
+    def commit_text(self, text):
+        self.committed.append(text.text)
+        self.messages += 1
+
+    def update_preedit_text(self, text, cursor_pos, visible):
+        self.messages += 1
+
+    def update_lookup_table(self, table, visible):
+        self.messages += 1
+        if self.table_shown is None:
+            self.table_shown = time.perf_counter()
+
+    def register_properties(self, props):
+        pass
+
+
+class _MainLoop(object):
+    def run(self):
+        pass
+
+    def quit(self):
+        pass
+
+
+# (function, args) queued by GLib.idle_add()
+pending = []
+
+
+def _idle_add(function, *args):
+    pending.append((function, args))
+    return len(pending)
+
+
+def run_idle():
+    '''Run the pending GLib idle callbacks, as the main loop would.'''
+    while pending:
+        function, args = pending.pop(0)
+        if function(*args):
+            pending.append((function, args))
+
+
+def _module(name, **attrs):
+    module = types.ModuleType(name)
+    module.__dict__.update(attrs)
+    return module
+
+
+def install():
+    '''Register the fake gi modules. Returns the IBus module.'''
+    ibus = _module(
+        'gi.repository.IBus',
+        ModifierType=ModifierType,
+        Orientation=types.SimpleNamespace(HORIZONTAL=0, VERTICAL=1),
+        AttrType=types.SimpleNamespace(UNDERLINE=1),
+        AttrUnderline=types.SimpleNamespace(SINGLE=1),
+        Attribute=types.SimpleNamespace(new=lambda *args: args),
+        AttrList=list,
+        PropList=list,
+        Text=Text,
+        LookupTable=LookupTable,
+        Engine=Engine,
+        keyval_name=keysyms.keyval_name,
+        keyval_to_unicode=keysyms.keyval_to_unicode,
+        init=lambda: None,
+    )
+    for name, keyval in KEYVALS.items():
+        setattr(ibus, name, keyval)
+    ibus.KEY_Shift_L = keysyms.KEY_Shift_L
+    glib = _module('gi.repository.GLib', MainLoop=_MainLoop, idle_add=_idle_add)
+    gobject = _module('gi.repository.GObject', type_from_name=lambda name: name)
+    repository = _module('gi.repository', IBus=ibus, GLib=glib, GObject=gobject)
+    gi = _module('gi', repository=repository, require_version=lambda name, version: None)
+    sys.modules.update({
+        'gi': gi,
+        'gi.repository': repository,
+        'gi.repository.IBus': ibus,
+        'gi.repository.GLib': glib,
+        'gi.repository.GObject': gobject,
+    })
+    return ibus
@@ -1,10 +1,19 @@
 # -*- coding: utf-8 -*-
-import collections
 import sqlite3
 
 import gi
 
+import composer
+import config
+import dictdb
 import logconfig
+import stats
+from associations import Associations
+from bigram import BigramModel
+from dict_reloader import DictionaryReloader
+from lookup_cache import LookupCache
+from lookup_worker import LookupWorker
+from user_freq import UserFreqRecorder
 
 gi.require_version('IBus', '1.0')
 from gi.repository import IBus
@@ -12,497 +21,160 @@ from gi.repository import GLib
 from gi.repository import GObject
 
 import os
+import signal
 import sys
 import getopt
 import locale
+import threading
 
 logger = logconfig.get_logger()
 
 # 获取当前 Python 脚本所在的目录路径
 __base_dir__ = os.path.dirname(__file__)
 
-# 初始化一个空列表 num_keys，用于存储常规数字键（1到9和0）的IBus键值
-num_keys = []
-# 遍历1到9的数字，将IBus中的对应键值（如IBus.1, IBus.2,... IBus.9）追加到 num_keys 列表
-for n in range(1, 10):
-    # 通过 getattr() 动态获取 IBus 对象的属性，并将其添加到 num_keys 列表
-    num_keys.append(getattr(IBus, str(n)))  # 这里会获取 IBus 对象中名为 '1', '2', ..., '9' 的属性值
-# 获取 IBus 对象中与 '0' 键对应的值，并将其添加到 num_keys 列表
-num_keys.append(getattr(IBus, '0'))
-# 删除变量 n，防止污染全局命名空间（这一步通常用来清理临时变量）
-del n
-
-# 初始化一个空列表 numpad_keys，用于存储小键盘的数字键（KP_1到KP_9和KP_0）的IBus键值
-numpad_keys = []
-# 遍历1到9的数字，将IBus中的小键盘对应键值（如 IBus.KP_1, IBus.KP_2,... IBus.KP_9）追加到 numpad_keys 列表
-for n in range(1, 10):
-    # 通过 getattr() 动态获取 IBus 对象的属性，获取名为 'KP_1', 'KP_2', ..., 'KP_9' 的键值
-    numpad_keys.append(getattr(IBus, 'KP_' + str(n)))  # 获取 IBus 对象中名为 'KP_1', 'KP_2' 等的属性值
-# 获取 IBus 对象中与 'KP_0' 键对应的值，并将其添加到 numpad_keys 列表
-numpad_keys.append(getattr(IBus, 'KP_0'))
-# 同样，删除变量 n，防止污染全局命名空间
-del n
+# IBus.Text of the candidates shown recently, by display string. Lookup
+# tables only reference them, so they can be appended again as they are.
+candidate_texts = LookupCache(config.CANDIDATE_TEXT_CACHE_SIZE)
 
 # sqlite3
 conn = None
 c = None
+# The dictionary lookups are served from and the user frequency recorder,
+# shared by all engines and set up in IMApp.run
+context = composer.Context()
 
 
-def gen_punctuation_map():
-    # import string
-    # punctuation_en = string.punctuation
-    punctuation_en = '''!"#$%&'()*+,-./:;<=>?@[\]^_`{|}~'''
-    punctuation_cn = ['！', '“', '＃', '￥', '％', '＆', '‘', '（', '）', '＊', '＋', '，', '－', '。', '／', '：', '；', '《', '＝',
-                      '》', '？', '＠', '「', '、', '」', '……', '——', '｀', '『', '｜', '』', '～']
-    return dict(zip(punctuation_en, punctuation_cn))
-
-
-punctuation_map = gen_punctuation_map()
-
+class IbusWubiEngine(IBus.Engine):
+    '''IBus frontend of a composer.Composer.
 
-class KeyEvent:
-    '''Key event class used to make the checking of details of the key
-    event easy
+    Forwards key and panel events to the composer and shows what it reports
+    through the IBus.Engine methods.
     '''
-
-    def __init__(self, keyval, keycode, state):
-        self.val = keyval
-        self.code = keycode
-        self.state = state
-        self.name = IBus.keyval_name(self.val)
-        self.unicode = IBus.keyval_to_unicode(self.val)
-        self.shift = self.state & IBus.ModifierType.SHIFT_MASK != 0
-        self.lock = self.state & IBus.ModifierType.LOCK_MASK != 0
-        self.control = self.state & IBus.ModifierType.CONTROL_MASK != 0
-        self.mod1 = self.state & IBus.ModifierType.MOD1_MASK != 0
-        self.mod2 = self.state & IBus.ModifierType.MOD2_MASK != 0
-        self.mod3 = self.state & IBus.ModifierType.MOD3_MASK != 0
-        self.mod4 = self.state & IBus.ModifierType.MOD4_MASK != 0
-        self.mod5 = self.state & IBus.ModifierType.MOD5_MASK != 0
-        self.button1 = self.state & IBus.ModifierType.BUTTON1_MASK != 0
-        self.button2 = self.state & IBus.ModifierType.BUTTON2_MASK != 0
-        self.button3 = self.state & IBus.ModifierType.BUTTON3_MASK != 0
-        self.button4 = self.state & IBus.ModifierType.BUTTON4_MASK != 0
-        self.button5 = self.state & IBus.ModifierType.BUTTON5_MASK != 0
-        self.super = self.state & IBus.ModifierType.SUPER_MASK != 0
-        self.hyper = self.state & IBus.ModifierType.HYPER_MASK != 0
-        self.meta = self.state & IBus.ModifierType.META_MASK != 0
-        self.release = self.state & IBus.ModifierType.RELEASE_MASK != 0
-        # MODIFIER_MASK: Modifier mask for the all the masks above
-        self.modifier = self.state & IBus.ModifierType.MODIFIER_MASK != 0
-
-    def __str__(self):
-        return (
-                "val=%s code=%s state=0x%08x name='%s' unicode='%s' "
-                % (self.val,
-                   self.code,
-                   self.state,
-                   self.name,
-                   self.unicode)
-                + "shift=%s control=%s mod1=%s mod5=%s release=%s"
-                % (self.shift,
-                   self.control,
-                   self.mod1,
-                   self.mod5,
-                   self.release))
-
-
-# the engine
-class IWubi(object):
-    def find_characters(self, preedit_string):
-        logger.debug('preedit_string {}'.format(preedit_string))
-        # return [[preedit_string, '五笔']]
-        output = []
-        # CREATE TABLE pinyin
-        #             (pinyin TEXT, zi TEXT, freq INTEGER);
-        # CREATE TABLE phrases
-        # CREATE TABLE phrases
-        #         (id INTEGER PRIMARY KEY, tabkeys TEXT, phrase TEXT,
-        #         freq INTEGER, user_freq INTEGER);
-
-        # freq==0 is large Chinese Table
-        # query Wubi
-        table_size = 10
-
-        # query Wubi exact
-        # use OrderedDict to filter duplicate
-        wubi_dict = collections.OrderedDict()
-        query = """SELECT phrase 
-            FROM phrases 
-            WHERE tabkeys = '{}' 
-                AND freq > 0 
-            ORDER BY freq 
-            DESC""".format(preedit_string)
-        wubi_list = list(c.execute(query))
-        for row in wubi_list:
-            wubi_dict[row[0]] = row[0]
-
-        # query Wubi like
-        query = """SELECT tabkeys, phrase, user_freq
-            FROM phrases
-            WHERE tabkeys LIKE '{}%'
-                AND substr(tabkeys, 1, {}) = '{}'
-                AND tabkeys != '{}'
-                AND freq > 0
-            ORDER BY freq DESC
-            LIMIT {}""".format(preedit_string, len(preedit_string), preedit_string, preedit_string,
-                               table_size - len(wubi_dict))
-        wubi_list = list(c.execute(query))
-        for row in wubi_list:
-            wubi_dict[row[1]] = row[1] + row[0][len(preedit_string):]
-        output.extend(wubi_dict.items())
-        len_wubi_list = len(output)
-
-        # query pinyin
-        pinyin_size = table_size - len_wubi_list
-        if pinyin_size > 0:
-            query = """SELECT phrase
-                FROM pinyins
-                WHERE pinyin LIKE '{}%'
-                    AND freq>0
-                    AND substr(pinyin, 1, {}) = '{}'
-                ORDER BY freq DESC LIMIT {}""".format(preedit_string, len(preedit_string), preedit_string, pinyin_size)
-            pinyin_list = list(c.execute(query))
-            for phrase in pinyin_list:
-                phrase = phrase[0]
-                # Add Wubi tabkeys if exists
-                query = """SELECT tabkeys FROM phrases WHERE phrase = '{}'""".format(phrase)
-                c.execute(query)
-                tabkeys = c.fetchone()
-                if tabkeys:
-                    phrase_display = phrase + tabkeys[0]
-                else:
-                    phrase_display = phrase
-                output.append([phrase, phrase_display])
-
-        logger.debug('output {}'.format(output))
-        return output, len_wubi_list
-
-
-class IbusWubiEngine(IBus.Engine):
     __gtype_name__ = 'IbusWubiEngine'
 
     def __init__(self):
         super(IbusWubiEngine, self).__init__()
-        self.candidates = []
-        self.iwubi = IWubi()
-        self.is_invalidate = False
-        self.preedit_string = ''
         # new(page_size:int, cursor_pos:int, cursor_visible:bool, round:bool)
         # self.lookup_table = IBus.LookupTable.new(5, 0, True, True)
         self.lookup_table = IBus.LookupTable.new(10, 0, True, True)
         self.lookup_table.set_orientation(IBus.Orientation.HORIZONTAL)
         self.prop_list = IBus.PropList()
-        self._input_mode = 0  # 0: Use direct input. 1: Use the WuBi table.
-        self._prev_key = None
-        self._last_wubi_list_len = 0
+        # What the panel and application were last sent, so that unchanged
+        # updates are not sent again
+        self._forget_shown()
+        self.composer = composer.Composer(context, self, self.lookup_table.get_page_size())
         logger.info("Create iwubi engine OK")
 
-    def set_lookup_table_cursor_pos_in_current_page(self, index):
-        '''Sets the cursor in the lookup table to index in the current page
-
-        Returns True if successful, False if not.
-        '''
-        page_size = self.lookup_table.get_page_size()
-        if index > page_size:
-            return False
-        page, pos_in_page = divmod(self.lookup_table.get_cursor_pos(),
-                                   page_size)
-        new_pos = page * page_size + index
-        if new_pos > self.lookup_table.get_number_of_candidates():
-            return False
-        self.lookup_table.set_cursor_pos(new_pos)
-        return True
-
-    def do_candidate_clicked(self, index, dummy_button, dummy_state):
-        if self.set_lookup_table_cursor_pos_in_current_page(index):
-            self.commit_candidate()
-
     def set_input_mode(self, mode=1):
-        """
-        :param mode: Whether to use WuBi mode.
-                     0: Use direct input.
-                     1: Use the WuBi table.
-        :return:
-        """
-        self._input_mode = mode
-        logger.debug('input_mode {}'.format(mode))
-
-    def _is_shift_hotkey(self, key):
-        '''Check whether “key” matches the Shift hotkey.
-        Returns True if there is a match, False if not.
-        :param key: The key typed
-        :type key: KeyEvent object
-        :rtype: Boolean
-        '''
-        # Match only when keys are released
-        if key.val == IBus.KEY_Shift_L and key.release:
-            # If it is a key release event, the previous key
-            # must have been the same key pressed down.
-            if self._prev_key and key.val == self._prev_key.val:
-                return True
-
-        return False
-
-    def _process_key_event(self, key):
-        # Match mode switch hotkey
-        # if self._match_hotkey(
-        #         key, IBus.KEY_Shift_L,
-        #         IBus.ModifierType.SHIFT_MASK):
-
-        # Temp Fix Chrome Shift hotkey bug.
-        if self._is_shift_hotkey(key):
-            self.set_input_mode(int(not self._input_mode))
-            if self.preedit_string:
-                self.commit_string(self.preedit_string)
-            return True
-
-        keyval, keycode, state = key.val, key.code, key.state
-
-        # ignore key release events
-        is_press = ((state & IBus.ModifierType.RELEASE_MASK) == 0)
-        if not is_press:
-            return False
-
-        if self.preedit_string:
-            if keyval == IBus.space:
-                if self.lookup_table.get_number_of_candidates() > 0:
-                    self.commit_candidate()
-                else:
-                    self.commit_string(self.preedit_string)
-                return True
-            if keyval == IBus.Return:
-                self.commit_string(self.preedit_string)
-                return True
-            elif keyval == IBus.Escape:
-                self.preedit_string = ''
-                self.update_candidates()
-                return True
-            elif keyval == IBus.BackSpace:
-                self.preedit_string = self.preedit_string[:-1]
-                self.invalidate()
-                return True
-            elif keyval in num_keys:
-                index = num_keys.index(keyval)
-                if self.set_lookup_table_cursor_pos_in_current_page(index):
-                    self.commit_candidate()
-                    return True
-                return False
-            elif keyval in numpad_keys:
-                index = numpad_keys.index(keyval)
-                if self.set_lookup_table_cursor_pos_in_current_page(index):
-                    self.commit_candidate()
-                    return True
-                return False
-            elif keyval in (IBus.Page_Up, IBus.KP_Page_Up, IBus.Left, IBus.KP_Left):
-                self.page_up()
-                return True
-            elif keyval in (IBus.Page_Down, IBus.KP_Page_Down, IBus.Right, IBus.KP_Right):
-                self.page_down()
-                return True
-            elif keyval in (IBus.Up, IBus.KP_Up):
-                self.cursor_up()
-                return True
-            elif keyval in (IBus.Down, IBus.KP_Down):
-                self.cursor_down()
-                return True
-
-        # ASCII letter
-        if IBus.a <= keyval <= IBus.z or \
-                IBus.A <= keyval <= IBus.Z:
-            if state & (IBus.ModifierType.CONTROL_MASK | IBus.ModifierType.MOD1_MASK) == 0:
-                if self._input_mode == 0:
-                    # Do not use `commit_string(keyval)` to commit ASCII letter, `commit_string` may run too long time.
-                    # This can lead to hotkey mistake detection error.
-                    # Instead, return False, to IBus/System input the letter to App directly.
-                    return False
-                else:
-                    # Auto commit the first Wubi
-                    if len(self.preedit_string) == 4 and self._last_wubi_list_len > 0:
-                        self.commit_candidate()
-                        self.preedit_string = chr(keyval)
-                    else:
-                        self.preedit_string += chr(keyval)
-                    # self.invalidate really mean?
-                    self.invalidate()
-                    return True
-        # ASCII except letter
-        else:
-            if keyval < 128:
-                # If is Chinse Wubi mode and keyval is punctuation, translate punctuation to Chinese punctuation
-                if self._input_mode == 1:
-                    if self.lookup_table.get_number_of_candidates() > 0:
-                        self.commit_candidate()
-                    keyval_chr = chr(keyval)
-                    if chr(keyval) in punctuation_map:
-                        self.commit_string(punctuation_map[keyval_chr])
-                        return True
-                else:
-                    if self.preedit_string:
-                        self.commit_string(self.preedit_string)
+        self.composer.set_input_mode(mode)
 
-        # return False means IBus iWubi will not deal this key,
-        # so System/IBus will input the letter or other special char/keyal (e.g. Shift, Ctrl) to App.
-        return False
+    def _forget_shown(self):
+        # Next updates are sent whatever they are, e.g. after a focus change
+        self._table_version = None
+        self._shown_candidates = None
+        self._shown_preedit = None
+        self._shown_visible = None
 
-    def do_process_key_event(self, keyval, keycode, state):
-        """ do_process_key_event = gi.VFuncInfo(process_key_event)
-        :param keyval:
-        :param keycode:
-        :param state: Key modifier flags.
-        :return:
-        """
-        key = KeyEvent(keyval, keycode, state)
-        logger.debug('{}'.format(key))
-        result = self._process_key_event(key)
-        # Fix me. If the last `self._process_key_event` take too long time.
-        # Maybe the new `do_process_key_event` will called before last `self._prev_key = key` is done.
-        # So `self._prev_key` could be the previous previous key, lead to hotkey mistake detection error.
-        # e.g.
-        # 1. Shift_L press.
-        # 2. u press. So input is U.
-        # 3. Shift_L release. -> Lead to mistake Shift_L hotkey detection.
-        # 4. u release.
-        self._prev_key = key
-        return result
-
-    def _match_hotkey(self, key, keyval, state):
-        '''Check whether “key” matches a “hotkey” specified by “keyval” and
-        “state”.
-
-        Returns True if there is a match, False if not.
-
-        :param key: The key typed
-        :type key: KeyEvent object
-        :param keyval: The key value to match against
-        :type keyval: Integer
-        :param state: The state of the modifier keys to match against.
-        :type state: Integer
-        :rtype: Boolean
-        '''
-        # Match only when keys are released
-        # IBus.ModifierType.RELEASE_MASK = 1073741824 (hex: 0x40000000)
-        state = state | IBus.ModifierType.RELEASE_MASK  # state is Shift+Release
-        if key.val == keyval and (key.state & state) == state:
-            # If it is a key release event, the previous key
-            # must have been the same key pressed down.
-            if (self._prev_key
-                    and key.val == self._prev_key.val):
-                return True
-
-        return False
-
-    def invalidate(self):
-        if self.is_invalidate:
-            return
-        self.is_invalidate = True
-        # The glib.idle_add() function adds a function (specified by callback) to be called
-        # whenever there are no higher priority events pending to the default main loop.
-        GLib.idle_add(self.update_candidates)
-
-    def page_up(self):
-        # Go to previous page of an IBusLookupTable.
-        # It returns FALSE if it is already at the first page, unless table>-round==TRUE, where it will go to the last page.
-        if self.lookup_table.page_up():
-            self._update_lookup_table()
-            return True
-        return False
-
-    def page_down(self):
-        if self.lookup_table.page_down():
-            self._update_lookup_table()
-            return True
-        return False
-
-    def cursor_up(self):
-        if self.lookup_table.cursor_up():
-            self._update_lookup_table()
-            return True
-        return False
-
-    def cursor_down(self):
-        if self.lookup_table.cursor_down():
-            self._update_lookup_table()
-            return True
-        return False
-
-    def commit_string(self, text):
-        self.commit_text(IBus.Text.new_from_string(text))
-        self.preedit_string = ''
-        self.update_candidates()
+    # Frontend of the composer
 
-    def commit_candidate(self):
-        self.commit_string(self.candidates[self.lookup_table.get_cursor_pos()])
+    def commit(self, text):
+        self.commit_text(IBus.Text.new_from_string(text))
 
-    def update_candidates(self):
-        preedit_len = len(self.preedit_string)
+    def show_preedit(self, preedit_string):
+        if preedit_string == self._shown_preedit:
+            return
+        self._shown_preedit = preedit_string
+        preedit_len = len(preedit_string)
         # IBusAttrList — AttrList of IBusText.
         # An IBusText is the main text object in IBus.
         # The text is decorated according to associated IBusAttribute,
         # e.g. the foreground/background color, underline, and applied scope.
         attrs = IBus.AttrList()
-        self.lookup_table.clear()
-        # reset candidate
-        self.candidates = []
-
-        if preedit_len > 0:
-            iwubi_results, len_wubi_list = self.iwubi.find_characters(self.preedit_string)
-            self._last_wubi_list_len = len_wubi_list
-            for char_sequence, display_str in iwubi_results:
-                candidate = IBus.Text.new_from_string(display_str)
-                self.candidates.append(char_sequence)
-                self.lookup_table.append_candidate(candidate)
-
-        # Do not show auxiliary bar. Keep UI clean.
-
         attrs.append(IBus.Attribute.new(IBus.AttrType.UNDERLINE,
                                         IBus.AttrUnderline.SINGLE, 0, preedit_len))
-        text = IBus.Text.new_from_string(self.preedit_string)
+        text = IBus.Text.new_from_string(preedit_string)
         text.set_attributes(attrs)
         # update_preedit_text: Update the pre-edit buffer.
         # text : Update content.
         # cursor_pos : Current position of cursor
         # visible : Whether the pre-edit buffer is visible.
         self.update_preedit_text(text, preedit_len, preedit_len > 0)
-        self._update_lookup_table()
-        self.is_invalidate = False
 
-    def _update_lookup_table(self):
-        # get_number_of_candidates: Return the number of candidate in the table.
-        visible = self.lookup_table.get_number_of_candidates() > 0
-        # visible: Whether the lookup_table is visible.?
-        self.update_lookup_table(self.lookup_table, visible)
+    def show_candidates(self, table):
+        changed = False
+        if table.version != self._table_version:
+            self._table_version = table.version
+            # e.g. typing past a code without further matches, or a result
+            # coming back from the cache, gives the same candidates again
+            shown = self._shown_candidates
+            if table.candidates != shown:
+                if shown and table.candidates[:len(shown)] == shown:
+                    # Paging fetched more candidates, add them only
+                    candidates = table.candidates[len(shown):]
+                else:
+                    candidates = table.candidates
+                    self.lookup_table.clear()
+                self._shown_candidates = table.candidates
+                for phrase, display_str in candidates:
+                    self.lookup_table.append_candidate(candidate_text(display_str))
+                changed = True
+        # visible: Whether the lookup_table is visible.
+        visible = len(table) > 0
+        if visible and self.lookup_table.get_cursor_pos() != table.cursor_pos:
+            self.lookup_table.set_cursor_pos(table.cursor_pos)
+            changed = True
+        # A hidden table is not sent again, whatever its content
+        if visible != self._shown_visible or (visible and changed):
+            self._shown_visible = visible
+            self.update_lookup_table(self.lookup_table, visible)
+
+    def schedule(self, callback):
+        # The glib.idle_add() function adds a function (specified by callback) to be called
+        # whenever there are no higher priority events pending to the default main loop.
+        GLib.idle_add(callback)
+
+    # IBus.Engine virtual methods
+
+    def do_process_key_event(self, keyval, keycode, state):
+        """ do_process_key_event = gi.VFuncInfo(process_key_event)
+        :param keyval:
+        :param keycode:
+        :param state: Key modifier flags.
+        :return:
+        """
+        return self.composer.process_key_event(keyval, keycode, state)
+
+    def do_candidate_clicked(self, index, dummy_button, dummy_state):
+        self.composer.candidate_clicked(index)
 
     def do_focus_in(self):
         logger.debug("focus_in")
+        self._forget_shown()
         self.register_properties(self.prop_list)
 
     def do_focus_out(self):
         logger.debug("focus_out")
-        self.do_reset()
+        self._forget_shown()
+        self.composer.focus_out()
 
     def do_reset(self):
-        # When focus change(e.g. App/Window changes), calling order:
-        # 1. do_focus_out
-        # 2. do_reset
-        # 3. do_focus_in
-        logger.debug("reset")
-        self.preedit_string = ''
+        self._forget_shown()
+        self.composer.reset()
 
     def do_property_activate(self, prop_name):
         logger.info("PropertyActivate(%s)" % prop_name)
 
     def do_page_up(self):
-        return self.page_up()
+        return self.composer.page_up()
 
     def do_page_down(self):
-        return self.page_down()
+        return self.composer.page_down()
 
     def do_cursor_up(self):
-        return self.cursor_up()
+        return self.composer.cursor_up()
 
     def do_cursor_down(self):
-        return self.cursor_down()
+        return self.composer.cursor_down()
 
 class IMApp:
     def __init__(self, exec_by_ibus):
@@ -554,15 +226,80 @@ class IMApp:
         
         # 连接到 SQLite3 数据库
         global conn
-        conn = sqlite3.connect(db_file)
+        # 查询在后台线程（LookupWorker）中执行，由其锁保证串行访问
+        conn = sqlite3.connect(db_file, check_same_thread=False)
+
+        # 首次启动时升级数据库结构（索引等），通常已在安装时完成
+        try:
+            applied = dictdb.migrate(conn)
+            if applied:
+                logger.info('Dictionary migrated to schema version {}'.format(applied[-1]))
+        except sqlite3.Error as e:
+            # e.g. the installed dictionary is read-only for the user
+            logger.warning('Dictionary migration failed: {}'.format(e))
         
         # 创建数据库游标，用于执行 SQL 查询
         global c
         c = conn.cursor()
 
+        # 加载词库：优先使用编译好的内存映射词库，缺失或过期时回退到 SQLite
+        charset = dictdb.CHARSETS.index(config.CHARSET)
+        context.dictionary = composer.load_dictionary(conn, db_file, composer.IWubi.table_size, charset)
+
+        # 按键绑定：config.KEY_BINDINGS 补充默认绑定，启动时编译为字典查找
+        try:
+            context.keymap = composer.compile_keymap(config.KEY_BINDINGS)
+        except ValueError as e:
+            logger.warning('Ignoring config.KEY_BINDINGS: {}'.format(e))
+
+        # 在后台线程中学习用户词频，按键时不写磁盘
+        context.user_freq = UserFreqRecorder(db_file, config.USER_FREQ_FLUSH_INTERVAL,
+                                             config.USER_FREQ_BATCH_SIZE)
+
+        # 在后台线程中查询候选词，主循环只负责按键和显示
+        context.worker = LookupWorker()
+
+        # 按上一个上屏的词调整候选词顺序（config.BIGRAM_ENABLED）
+        if config.BIGRAM_ENABLED:
+            context.bigrams = BigramModel(db_file, config.BIGRAM_CAPACITY, config.USER_FREQ_FLUSH_INTERVAL,
+                                          config.USER_FREQ_BATCH_SIZE)
+
+        # 上屏后显示联想词（config.ASSOCIATION_ENABLED）
+        if config.ASSOCIATION_ENABLED:
+            context.associations = Associations(db_file, charset)
+
+        # 词库文件变化时在后台线程中重新加载，在两次按键之间切换
+        self.reloader = None
+        if config.DICT_RELOAD_INTERVAL:
+            self.reloader = DictionaryReloader(context, db_file, GLib.idle_add, config.DICT_RELOAD_INTERVAL,
+                                               composer.IWubi.table_size, charset)
+
+        # 按需启用按键各阶段的计时（config.STATS_ENABLED 或 IWUBI_STATS=1），
+        # 收到 SIGUSR1 时把统计写入 config.STATS_FILE
+        if stats.enabled():
+            enable_stats()
+        GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, signal.SIGUSR1, self.dump_stats)
+
+        # 收到 SIGHUP 时重新读取 logconfig.yaml 中的日志级别，无需重启 ibus
+        GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, signal.SIGHUP, self.reload_log_config)
+
         # 启动主循环，使应用程序开始运行，等待事件和回调
         self.mainloop.run()
 
+    def dump_stats(self):
+        if not stats.stages:
+            logger.info('Stats are disabled, set IWUBI_STATS=1 or config.STATS_ENABLED to enable them')
+        else:
+            # 在后台线程中写文件，避免阻塞按键处理
+            threading.Thread(target=write_stats, name='iwubi-stats', daemon=True).start()
+        return True
+
+    def reload_log_config(self):
+        # 在后台线程中读取配置文件，避免阻塞按键处理
+        threading.Thread(target=logconfig.reload, name='iwubi-log-reload', daemon=True).start()
+        # 保留信号处理函数
+        return True
+
     def bus_disconnected_cb(self, bus):
         # 处理 IBus 总线断开时的回调函数
         logger.debug('bus {}'.format(bus))  # 打印调试信息
@@ -570,12 +307,62 @@ class IMApp:
         # 退出主循环
         self.mainloop.quit()
 
+        # 停止词库重新加载线程和查询线程
+        if self.reloader:
+            self.reloader.close()
+        if context.worker:
+            context.worker.close()
+
+        # 写入尚未保存的用户词频
+        if context.user_freq:
+            context.user_freq.close()
+        if context.bigrams:
+            context.bigrams.close()
+
+        # 拼音候选词未能在 config.PINYIN_BUDGET_MS 内显示的按键数，用于调整预算
+        if config.PINYIN_BUDGET_MS is not None:
+            logger.info('Pinyin candidates missed the {} ms budget on {} keys'.format(
+                config.PINYIN_BUDGET_MS, context.pinyin_overruns))
+
+        # 写入最终的计时统计
+        if stats.stages:
+            write_stats()
+
         # 如果 SQLite 连接存在，则关闭数据库连接
         if conn:
             conn.close()
 
 
 
+def candidate_text(display_str):
+    text = candidate_texts.get(display_str)
+    if text is None:
+        text = IBus.Text.new_from_string(display_str)
+        candidate_texts.put(display_str, text)
+    return text
+
+
+def enable_stats():
+    '''Time the stages of key handling, from the composer to D-Bus.'''
+    composer.enable_stats()
+    # Rendering for IBus, including building the IBus.Text objects
+    stats.instrument(IbusWubiEngine, 'show_candidates', 'show_candidates')
+    stats.instrument(IbusWubiEngine, 'show_preedit', 'show_preedit')
+    # Messages sent over D-Bus to the panel and the application
+    stats.instrument(IbusWubiEngine, 'update_lookup_table', 'dbus_lookup_table')
+    stats.instrument(IbusWubiEngine, 'update_preedit_text', 'dbus_preedit_text')
+    stats.instrument(IbusWubiEngine, 'commit_text', 'dbus_commit_text')
+
+
+def write_stats():
+    try:
+        stats.dump(config.STATS_FILE)
+    except OSError as e:
+        logger.warning('Cannot write stats to {}: {}'.format(config.STATS_FILE, e))
+        return
+    logger.info('Stats written to {}'.format(config.STATS_FILE))
+
+
 def launch_engine(exec_by_ibus):
     IBus.init()
     IMApp(exec_by_ibus).run()
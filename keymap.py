@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+'''Key bindings of the composer, compiled into dict lookups.
+
+A binding maps a key to an action, in one of the modes:
+
+- preedit: a key pressed while a code is typed
+- associations: a key pressed while the associations of the last commit
+  are shown. Any key without a binding dismisses them and is then handled
+  as usual.
+- release: a key released right after it was pressed alone, in any mode,
+  e.g. Shift_L to switch between Wubi and direct input
+
+A key is a name of keysyms.NAMES, after the modifiers that must be held, if
+any, joined by '+': 'Page_Down', 'Control+j', 'Alt+comma'. A key without
+modifiers matches it whatever modifiers are held, unless the key with those
+modifiers has a binding of its own. Shift changes the keyval of printable
+keys, '!' is Shift+1, so Shift is only useful with the other keys. Caps Lock
+and Num Lock are ignored.
+
+Actions are those of composer.ACTIONS. config.KEY_BINDINGS adds bindings
+to DEFAULT_BINDINGS and replaces them, a None action removing one. Keymap
+compiles them once, each key then costs a dict lookup.
+'''
+import keysyms
+
+# Modifier names of a binding
+MODIFIERS = {
+    'Shift': keysyms.SHIFT_MASK,
+    'Control': keysyms.CONTROL_MASK,
+    'Alt': keysyms.MOD1_MASK,
+    'Super': keysyms.SUPER_MASK,
+}
+# The modifiers bindings tell apart
+MODIFIER_MASK = keysyms.SHIFT_MASK | keysyms.CONTROL_MASK | keysyms.MOD1_MASK | keysyms.SUPER_MASK
+
+MODES = ('preedit', 'associations', 'release')
+
+# Bindings of both the preedit and the associations
+_CANDIDATES = {
+    'Escape': 'clear',
+    'Page_Up': 'page_up',
+    'KP_Page_Up': 'page_up',
+    'Page_Down': 'page_down',
+    'KP_Page_Down': 'page_down',
+}
+# Digits in candidate order: 1 selects the first candidate, 0 the tenth
+for _n in range(1, 11):
+    _CANDIDATES[str(_n % 10)] = _CANDIDATES['KP_' + str(_n % 10)] = 'select_{}'.format(_n)
+del _n
+
+DEFAULT_BINDINGS = {
+    'preedit': dict(_CANDIDATES, **{
+        'space': 'commit_candidate',
+        'Return': 'commit_preedit',
+        'BackSpace': 'backspace',
+        'Left': 'page_up',
+        'KP_Left': 'page_up',
+        'Right': 'page_down',
+        'KP_Right': 'page_down',
+        'Up': 'cursor_up',
+        'KP_Up': 'cursor_up',
+        'Down': 'cursor_down',
+        'KP_Down': 'cursor_down',
+    }),
+    'associations': dict(_CANDIDATES),
+    'release': {
+        'Shift_L': 'toggle_input_mode',
+    },
+}
+
+_KEYVALS = dict((name, keyval) for keyval, name in keysyms.NAMES.items())
+
+
+def key(keyval, state):
+    '''Return the key of the compiled tables for keyval with the modifier
+    state, a single int: keyvals fit in 32 bits.
+    '''
+    return keyval | (state & MODIFIER_MASK) << 32
+
+
+def parse_key(name):
+    '''Return (keyval, modifier mask) of a key of a binding, the mask
+    being None if it has no modifiers. Raises ValueError if it is unknown.
+    '''
+    parts = name.split('+')
+    keyval = _KEYVALS.get(parts[-1])
+    if keyval is None:
+        raise ValueError('Unknown key {!r} in {!r}'.format(parts[-1], name))
+    if len(parts) == 1:
+        return keyval, None
+    mask = 0
+    for modifier in parts[:-1]:
+        if modifier not in MODIFIERS:
+            raise ValueError('Unknown modifier {!r} in {!r}, one of {}'.format(
+                modifier, name, ', '.join(sorted(MODIFIERS))))
+        mask |= MODIFIERS[modifier]
+    return keyval, mask
+
+
+class Keymap(object):
+    '''The bindings of each mode compiled into a dict, attributes preedit,
+    associations and release, from key() to the actions value.
+
+    actions maps the action names to what the composer runs for them.
+    bindings, mode -> {key: action}, is added to DEFAULT_BINDINGS. Raises
+    ValueError for an unknown mode, key or action.
+    '''
+
+    def __init__(self, actions, bindings=None):
+        for mode in bindings or {}:
+            if mode not in MODES:
+                raise ValueError('Unknown key binding mode {!r}, one of {}'.format(mode, ', '.join(MODES)))
+        for mode in MODES:
+            parsed = {}
+            for layer in (DEFAULT_BINDINGS, bindings or {}):
+                for name, action in layer.get(mode, {}).items():
+                    if action is not None and action not in actions:
+                        raise ValueError('Unknown action {!r} for {!r}, one of {}'.format(
+                            action, name, ', '.join(sorted(actions))))
+                    parsed[parse_key(name)] = action
+            setattr(self, mode, self._compile(actions, parsed))
+
+    @staticmethod
+    def _compile(actions, parsed):
+        # The bindings without modifiers for every modifier state first, so
+        # that those with modifiers override them
+        table = {}
+        states = [0]
+        for mask in MODIFIERS.values():
+            states += [state | mask for state in states]
+        for (keyval, mask), action in sorted(parsed.items(), key=lambda item: item[0][1] is not None):
+            for state in (states if mask is None else [mask]):
+                if action is None:
+                    table.pop(key(keyval, state), None)
+                else:
+                    table[key(keyval, state)] = actions[action]
+        return table
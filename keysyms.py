@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+'''Key values and modifier masks used by iWubi, without gi.
+
+The values are the X11 keysyms and IBusModifierType masks that IBus passes
+to IBusEngine::process-key-event, so keyvals from IBus can be compared to
+them directly.
+'''
+
+# IBusModifierType
+SHIFT_MASK = 1 << 0
+LOCK_MASK = 1 << 1
+CONTROL_MASK = 1 << 2
+MOD1_MASK = 1 << 3
+MOD2_MASK = 1 << 4
+MOD3_MASK = 1 << 5
+MOD4_MASK = 1 << 6
+MOD5_MASK = 1 << 7
+BUTTON1_MASK = 1 << 8
+BUTTON2_MASK = 1 << 9
+BUTTON3_MASK = 1 << 10
+BUTTON4_MASK = 1 << 11
+BUTTON5_MASK = 1 << 12
+SUPER_MASK = 1 << 26
+HYPER_MASK = 1 << 27
+META_MASK = 1 << 28
+RELEASE_MASK = 1 << 30
+MODIFIER_MASK = 0x5c001fff
+
+KEY_space = 0x020
+KEY_0 = 0x030
+KEY_1 = 0x031
+KEY_9 = 0x039
+KEY_A = 0x041
+KEY_Z = 0x05a
+KEY_a = 0x061
+KEY_z = 0x07a
+KEY_BackSpace = 0xff08
+KEY_Tab = 0xff09
+KEY_Return = 0xff0d
+KEY_Escape = 0xff1b
+KEY_Left = 0xff51
+KEY_Up = 0xff52
+KEY_Right = 0xff53
+KEY_Down = 0xff54
+KEY_Page_Up = 0xff55
+KEY_Page_Down = 0xff56
+KEY_KP_Left = 0xff96
+KEY_KP_Up = 0xff97
+KEY_KP_Right = 0xff98
+KEY_KP_Down = 0xff99
+KEY_KP_Page_Up = 0xff9a
+KEY_KP_Page_Down = 0xff9b
+KEY_KP_0 = 0xffb0
+KEY_KP_9 = 0xffb9
+KEY_Shift_L = 0xffe1
+KEY_Shift_R = 0xffe2
+KEY_Control_L = 0xffe3
+KEY_Control_R = 0xffe4
+
+# keyval -> name, as returned by IBus.keyval_name()
+NAMES = {
+    KEY_space: 'space',
+    KEY_BackSpace: 'BackSpace',
+    KEY_Tab: 'Tab',
+    KEY_Return: 'Return',
+    KEY_Escape: 'Escape',
+    KEY_Left: 'Left',
+    KEY_Up: 'Up',
+    KEY_Right: 'Right',
+    KEY_Down: 'Down',
+    KEY_Page_Up: 'Page_Up',
+    KEY_Page_Down: 'Page_Down',
+    KEY_KP_Left: 'KP_Left',
+    KEY_KP_Up: 'KP_Up',
+    KEY_KP_Right: 'KP_Right',
+    KEY_KP_Down: 'KP_Down',
+    KEY_KP_Page_Up: 'KP_Page_Up',
+    KEY_KP_Page_Down: 'KP_Page_Down',
+    KEY_Shift_L: 'Shift_L',
+    KEY_Shift_R: 'Shift_R',
+    KEY_Control_L: 'Control_L',
+    KEY_Control_R: 'Control_R',
+}
+for _n in range(10):
+    NAMES[KEY_0 + _n] = str(_n)
+    NAMES[KEY_KP_0 + _n] = 'KP_' + str(_n)
+for _n in range(26):
+    NAMES[KEY_A + _n] = chr(KEY_A + _n)
+    NAMES[KEY_a + _n] = chr(KEY_a + _n)
+for _c, _name in zip('''!"#$%&'()*+,-./:;<=>?@[\\]^_`{|}~''',
+                     ['exclam', 'quotedbl', 'numbersign', 'dollar', 'percent', 'ampersand',
+                      'apostrophe', 'parenleft', 'parenright', 'asterisk', 'plus', 'comma',
+                      'minus', 'period', 'slash', 'colon', 'semicolon', 'less', 'equal',
+                      'greater', 'question', 'at', 'bracketleft', 'backslash', 'bracketright',
+                      'asciicircum', 'underscore', 'grave', 'braceleft', 'bar', 'braceright',
+                      'asciitilde']):
+    NAMES[ord(_c)] = _name
+del _n, _c, _name
+
+
+def keyval_name(keyval):
+    '''Return the name of keyval, or its hex value if it has none here.'''
+    name = NAMES.get(keyval)
+    if name is None:
+        return '0x{:x}'.format(keyval)
+    return name
+
+
+def keyval_to_unicode(keyval):
+    '''Return the character typed by keyval, or '' if there is none.'''
+    if 0x20 <= keyval <= 0x7e or 0xa0 <= keyval <= 0xff:
+        # Latin-1 keysyms are their code point
+        return chr(keyval)
+    if KEY_KP_0 <= keyval <= KEY_KP_9:
+        return chr(keyval - KEY_KP_0 + KEY_0)
+    if 0x01000100 <= keyval <= 0x0110ffff:
+        # Unicode keysyms
+        return chr(keyval - 0x01000000)
+    return ''
@@ -1,9 +1,26 @@
+import atexit
 import logging
 import logging.config
+import logging.handlers
+import os
+import queue
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
 
 _init = False
+# The QueueListener writing the log records, and its handlers by name
+_listener = None
+_handlers = {}
+
+# Records waiting for the writer thread. When the disk stalls and the queue
+# fills up, new records are dropped rather than blocking the caller.
+QUEUE_SIZE = 10000
 
 # 定义日志系统的配置字典，用于 logging.config.dictConfig() 高级配置
+# 仅在找不到 logconfig.yaml 或未安装 PyYAML 时使用
 dict_config = {
     'version': 1,  # 指定日志配置的版本，必须为 1
     'formatters': {  # 格式化器（决定日志输出的格式）
@@ -35,19 +52,107 @@ dict_config = {
         }
     },
     'root': {  # 根 Logger 配置（默认 logger）
-        'level': 'DEBUG',  # 日志最低级别为 DEBUG
+        'level': 'INFO',  # 日志最低级别为 INFO，调试时改为 DEBUG
         'handlers': ['console', 'file']  # 同时使用 console 和 file 两个 handler 输出日志
     }
 }
 
 
+def config_paths():
+    '''Return the logconfig.yaml files to read, the first existing one wins:
+    the user's, then the one installed with iwubi.
+    '''
+    config_home = os.environ.get('XDG_CONFIG_HOME') or os.path.expanduser('~/.config')
+    return [os.path.join(config_home, 'iwubi', 'logconfig.yaml'),
+            os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logconfig.yaml')]
+
+
+def load_config():
+    '''Return (config dict, path it was read from or None for dict_config).'''
+    if yaml is not None:
+        for path in config_paths():
+            if os.path.exists(path):
+                with open(path, 'r') as f:
+                    return yaml.safe_load(f.read()), path
+    return dict_config, None
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    '''Hands records to the writer thread without formatting them.
+
+    The message is formatted by the writer, so the arguments of a log call
+    must not be modified after the call.
+    '''
+
+    def __init__(self, record_queue):
+        super(_QueueHandler, self).__init__(record_queue)
+        # Records lost because the queue was full
+        self.dropped = 0
+
+    def prepare(self, record):
+        if record.exc_info and not record.exc_text:
+            # The traceback may not outlive the except block, render it now
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def _configure():
+    global _listener
+    config, path = load_config()
+    logging.config.dictConfig(config)
+
+    # Move the configured handlers behind a queue, so that the calling thread
+    # (the GLib main loop for the engine) never waits for the disk or stdout.
+    record_queue = queue.Queue(QUEUE_SIZE)
+    queue_handler = _QueueHandler(record_queue)
+    handlers = {}
+    for logger in [logging.getLogger()] + [logging.getLogger(name) for name in config.get('loggers', {})]:
+        for handler in logger.handlers[:]:
+            handlers[handler.name] = handler
+            logger.removeHandler(handler)
+        logger.addHandler(queue_handler)
+    _handlers.clear()
+    _handlers.update(handlers)
+    _listener = logging.handlers.QueueListener(record_queue, *handlers.values(), respect_handler_level=True)
+    _listener.start()
+    # Write what is still queued at exit
+    atexit.register(_listener.stop)
+    if path is None:
+        logging.getLogger().info('Logging configured from defaults, no logconfig.yaml{}'.format(
+            '' if yaml is not None else ' support (PyYAML missing)'))
+
+
+def reload():
+    '''Apply the levels of logconfig.yaml again, without restarting.
+
+    Only the levels of the root logger, the loggers and the handlers are
+    updated, handlers themselves are kept.
+    '''
+    config, path = load_config()
+    levels = {'': config.get('root', {}).get('level')}
+    for name, logger_config in config.get('loggers', {}).items():
+        levels[name] = logger_config.get('level')
+    for name, level in levels.items():
+        if level is not None:
+            logging.getLogger(name).setLevel(level)
+    for name, handler_config in config.get('handlers', {}).items():
+        handler = _handlers.get(name)
+        if handler is not None and handler_config.get('level') is not None:
+            handler.setLevel(handler_config['level'])
+    logging.getLogger().info('Log levels reloaded from {}: root {}'.format(
+        path or 'defaults', logging.getLevelName(logging.getLogger().level)))
+
 
 def get_logger():
     global _init
     if not _init:
-        # with open(os.path.join(os.path.dirname(__file__), 'logconfig.yaml'), 'r') as f:
-        #     config = yaml.safe_load(f.read())
-        #     logging.config.dictConfig(config)
-        logging.config.dictConfig(dict_config)
+        _configure()
         _init = True
     return logging.getLogger()
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+import collections
+
+
+class LookupCache(object):
+    '''Bounded LRU cache of lookup results keyed on the preedit string.
+
+    Typing a code looks up each of its prefixes in turn, and BackSpace goes
+    back to a prefix that was just shown, so most lookups either hit the
+    cache or can be narrowed from the cached result of the parent prefix.
+    '''
+
+    def __init__(self, max_size=256):
+        self.max_size = max_size
+        self._entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Number of times the dictionary or frequencies changed
+        self.generation = 0
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def peek(self, key):
+        '''Return the entry for key without counting or reordering it.'''
+        return self._entries.get(key)
+
+    def put(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self):
+        '''Drop every entry, e.g. after frequencies or the dictionary changed.'''
+        self._entries.clear()
+        self.generation += 1
+
+    def items(self):
+        '''Return the (key, entry) pairs, least recently used first, without
+        counting or reordering them.
+        '''
+        return self._entries.items()
+
+    def discard(self, keys):
+        '''Drop the entries of keys, e.g. those ranked with a frequency
+        that changed. Keys without an entry are ignored.
+        '''
+        for key in keys:
+            self._entries.pop(key, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __str__(self):
+        return 'size={} hits={} misses={} evictions={} generation={}'.format(
+            len(self._entries), self.hits, self.misses, self.evictions, self.generation)
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+import collections
+import functools
+import threading
+import time
+
+import logconfig
+
+logger = logconfig.get_logger()
+
+
+class LookupWorker(object):
+    '''Looks candidates up on a background thread, off the main loop.
+
+    Composers submit the preedit string with its generation, a number bumped
+    whenever the preedit changes. Only the newest request of each composer is
+    kept: one that is replaced before it starts, or whose generation is
+    already outdated when it would start, is dropped. Results are handed back
+    through the frontend's schedule(), which must be callable from any thread
+    (GLib.idle_add is). A result not shown yet is replaced by a newer one of
+    the same composer, so each is shown at most once, and only the newest.
+
+    A request with a deadline is looked up in two tiers: the Wubi
+    candidates are handed back first, then the pinyin ones. If the Wubi
+    tier alone used up the deadline, the pinyin tier is queued again behind
+    the other requests, and dropped if the composer submits a new one.
+
+    lock serializes every access to the lookup state (IWubi caches and the
+    SQLite cursor), for the worker and for composers that need a result
+    right away.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # composer -> (generation, preedit string, deadline), oldest first
+        self._pending = collections.OrderedDict()
+        # composer -> (generation, result) handed back but not shown yet
+        self._results = {}
+        self._busy = False
+        self._closing = False
+        self._cond = threading.Condition()
+        # Requests dropped because a newer one superseded them
+        self.dropped = 0
+        self.completed = 0
+        self._thread = threading.Thread(target=self._run, name='iwubi-lookup', daemon=True)
+        self._thread.start()
+
+    def lookup(self, iwubi, preedit_string, tiered=False):
+        '''Look preedit_string up now, in the calling thread.'''
+        with self.lock:
+            return iwubi.find_characters(preedit_string, tiered)
+
+    def submit(self, composer, generation, preedit_string, deadline=None):
+        '''Look preedit_string up for composer. deadline is the perf_counter()
+        time its pinyin candidates are due by, None to look them up with the
+        Wubi ones.
+        '''
+        with self._cond:
+            if composer in self._pending:
+                self.dropped += 1
+                del self._pending[composer]
+            self._pending[composer] = (generation, preedit_string, deadline)
+            self._cond.notify()
+
+    def wait_idle(self, timeout=None):
+        '''Wait until every submitted request is done or dropped, at most
+        timeout seconds if given. Returns True if they are.
+        '''
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._pending and not self._busy, timeout)
+
+    def close(self):
+        with self._cond:
+            self._closing = True
+            self._cond.notify()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closing:
+                    self._cond.wait()
+                if self._closing:
+                    return
+                composer, (generation, preedit_string, deadline) = self._pending.popitem(last=False)
+                self._busy = True
+            try:
+                self._serve(composer, generation, preedit_string, deadline)
+            finally:
+                with self._cond:
+                    self._busy = False
+                    self._cond.notify_all()
+
+    def _serve(self, composer, generation, preedit_string, deadline):
+        # The lookup of a request, then the pinyin tier if it was tiered
+        tiered = deadline is not None
+        while True:
+            if composer.generation != generation:
+                self.dropped += 1
+                return
+            try:
+                # None is the result of an empty preedit, nothing to show
+                result = self.lookup(composer.iwubi, preedit_string, tiered) if preedit_string else None
+            except Exception:
+                logger.exception('Lookup of {!r} failed'.format(preedit_string))
+                return
+            self._hand_back(composer, generation, result)
+            if result is None or not result.pending:
+                self.completed += 1
+                if deadline is not None and not tiered and time.perf_counter() > deadline:
+                    # The pinyin tier came late
+                    composer.context.pinyin_overruns += 1
+                return
+            if time.perf_counter() > deadline:
+                # Deferred, so that newer requests go first
+                composer.context.pinyin_overruns += 1
+                with self._cond:
+                    if composer not in self._pending:
+                        self._pending[composer] = (generation, preedit_string, None)
+                return
+            tiered = False
+
+    def _hand_back(self, composer, generation, result):
+        with self._cond:
+            scheduled = composer in self._results
+            self._results[composer] = (generation, result)
+        if not scheduled:
+            composer.frontend.schedule(functools.partial(self._show, composer))
+
+    def _show(self, composer):
+        # On the main loop
+        with self._cond:
+            generation, result = self._results.pop(composer)
+        composer.lookup_done(generation, result)
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+'''Per-stage timers of the key handling path.
+
+Stages are timed by wrapping methods with instrument(), which is only done
+when statistics are enabled (config.STATS_ENABLED or IWUBI_STATS=1 in the
+environment). When they are not, nothing is wrapped and the engine runs
+exactly the code it would without this module.
+
+Each stage records its durations in a fixed-size Histogram, so memory does
+not grow with the session length. Updates are not locked: a concurrent
+update may rarely be lost, which does not matter for statistics.
+'''
+import collections
+import functools
+import os
+import time
+
+import config
+
+# stage name -> Histogram, in the order stages were instrumented
+stages = collections.OrderedDict()
+
+
+class Histogram(object):
+    '''Durations in log-linear nanosecond buckets.
+
+    Each power of two is split in four buckets, so percentiles are known
+    within 25%, while count, mean and max are exact.
+    '''
+    # Up to 2**39 ns, about 9 min, the last bucket holds anything longer
+    BUCKETS = 152
+
+    __slots__ = ('counts', 'count', 'total', 'max')
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.counts = [0] * self.BUCKETS
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    @staticmethod
+    def bucket(ns):
+        if ns < 4:
+            return ns
+        shift = ns.bit_length() - 3
+        # The three leading bits of ns, 4 to 7, pick the bucket in the octave
+        return shift * 4 + (ns >> shift)
+
+    @staticmethod
+    def upper_bound(i):
+        '''Return the first duration past bucket i.'''
+        if i < 4:
+            return i + 1
+        shift, leading = divmod(i - 4, 4)
+        return (leading + 5) << shift
+
+    def add(self, ns):
+        self.counts[min(self.bucket(ns), self.BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += ns
+        if ns > self.max:
+            self.max = ns
+
+    def percentile(self, p):
+        '''Return the upper bound in ns of the bucket holding the p-th percentile.'''
+        if not self.count:
+            return 0
+        rank = self.count * p / 100.0
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(self.upper_bound(i), self.max)
+        return self.max
+
+
+def enabled():
+    return config.STATS_ENABLED or os.environ.get('IWUBI_STATS', '') not in ('', '0')
+
+
+def instrument(owner, name, stage):
+    '''Time every call of the method owner.name into the histogram of stage.
+
+    owner is usually a class, so that every instance is timed. Instrumenting
+    the same method twice has no effect.
+    '''
+    function = getattr(owner, name)
+    if getattr(function, 'stats_stage', None) is not None:
+        return
+    histogram = stages.setdefault(stage, Histogram())
+    perf_counter_ns = time.perf_counter_ns
+
+    @functools.wraps(function)
+    def timed(*args, **kwargs):
+        start = perf_counter_ns()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            histogram.add(perf_counter_ns() - start)
+    timed.stats_stage = stage
+    setattr(owner, name, timed)
+
+
+def reset():
+    # In place, the instrumented methods hold their histogram
+    for histogram in stages.values():
+        histogram.clear()
+
+
+def snapshot():
+    '''Return {stage: {count, mean_us, p50_us, p95_us, p99_us, max_us}}.'''
+    result = collections.OrderedDict()
+    for stage, histogram in stages.items():
+        count = histogram.count
+        result[stage] = {
+            'count': count,
+            'mean_us': round(histogram.total / count / 1000.0, 1) if count else 0.0,
+            'p50_us': round(histogram.percentile(50) / 1000.0, 1),
+            'p95_us': round(histogram.percentile(95) / 1000.0, 1),
+            'p99_us': round(histogram.percentile(99) / 1000.0, 1),
+            'max_us': round(histogram.max / 1000.0, 1),
+        }
+    return result
+
+
+def report():
+    '''Return the statistics of every stage as a text table.'''
+    lines = ['{:<20} {:>9} {:>10} {:>10} {:>10} {:>10} {:>10}'.format(
+        'stage', 'count', 'mean_us', 'p50_us', 'p95_us', 'p99_us', 'max_us')]
+    for stage, values in snapshot().items():
+        lines.append('{:<20} {count:>9} {mean_us:>10} {p50_us:>10} {p95_us:>10} {p99_us:>10} {max_us:>10}'.format(
+            stage, **values))
+    return '\n'.join(lines) + '\n'
+
+
+def dump(path):
+    '''Write report() to path, replacing it atomically.'''
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write(time.strftime('# %Y-%m-%d %H:%M:%S\n'))
+        f.write(report())
+    os.replace(tmp, path)
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+'''Fixtures of the tests: small dictionaries built from random rows, in the
+schema of the first release (version 0) or migrated to SCHEMA_VERSION.
+
+The tests need neither gi nor wubi-jidian86.db.
+'''
+import os
+import random
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dictdb  # noqa: E402
+
+# Few keys and characters, so that codes share prefixes and phrases share
+# their first character. y, like z, starts no code.
+CODE_KEYS = 'abcde'
+CHARS = [chr(0x4e00 + i * 7) for i in range(150)]
+PINYINS = ('a', 'ba', 'bai', 'ban', 'zhong', 'zhu', 'zi', 'ce', 'da', 'de', 'e')
+
+
+def build_v0_dictionary(db_file, rows=3000, seed=5):
+    '''Write a dictionary of rows random phrases in the schema of version 0
+    to db_file, a tenth of them with freq 0 as the large Chinese table.
+    '''
+    rng = random.Random(seed)
+    conn = sqlite3.connect(db_file)
+    with conn:
+        conn.execute('CREATE TABLE ime (attr TEXT, val TEXT)')
+        conn.execute('''CREATE TABLE phrases
+            (id INTEGER PRIMARY KEY, tabkeys TEXT, phrase TEXT, freq INTEGER, user_freq INTEGER)''')
+        conn.execute('''CREATE TABLE pinyins
+            (id INTEGER PRIMARY KEY, phrase TEXT, pinyin TEXT, freq INTEGER)''')
+        for i in range(rows):
+            # Mostly full codes, as in Wubi, so that short codes have few rows
+            length = rng.choices((1, 2, 3, 4), (1, 6, 50, 143))[0]
+            tabkeys = ''.join(rng.choice(CODE_KEYS) for n in range(length))
+            phrase = ''.join(rng.choice(CHARS) for n in range(rng.choice((1, 1, 2, 3))))
+            # Few distinct freq, so ties are ordered by id
+            freq = 0 if rng.random() < 0.1 else rng.randint(1, 50) * 100
+            conn.execute('INSERT INTO phrases VALUES (?, ?, ?, ?, 0)', (i + 1, tabkeys, phrase, freq))
+        for i in range(rows // 2):
+            pinyin = ''.join(rng.choice(PINYINS) for n in range(rng.randint(1, 3)))
+            phrase = ''.join(rng.choice(CHARS) for n in range(rng.randint(1, 3)))
+            conn.execute('INSERT INTO pinyins VALUES (?, ?, ?, ?)', (i, phrase, pinyin, rng.randint(1, 1000)))
+    conn.close()
+
+
+@pytest.fixture
+def v0_db(tmp_path):
+    db_file = str(tmp_path / 'v0.db')
+    build_v0_dictionary(db_file)
+    return db_file
+
+
+@pytest.fixture(scope='session')
+def db_file(tmp_path_factory):
+    '''A dictionary at SCHEMA_VERSION, shared by the tests: do not change it.'''
+    db_file = str(tmp_path_factory.mktemp('dict') / 'wubi.db')
+    build_v0_dictionary(db_file)
+    conn = sqlite3.connect(db_file)
+    dictdb.migrate(conn)
+    conn.close()
+    return db_file
+
+
+@pytest.fixture
+def conn(db_file):
+    conn = sqlite3.connect(db_file)
+    yield conn
+    conn.close()
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import config
+import dictdb
+import keysyms
+from associations import Associations
+from composer import Composer, Context, Frontend, IWubi
+
+_KEYVALS = dict((name, keyval) for keyval, name in keysyms.NAMES.items())
+
+
+class RecordingFrontend(Frontend):
+    '''Records the commits, runs deferred updates at once.'''
+
+    def __init__(self):
+        self.commits = []
+
+    def commit(self, text):
+        self.commits.append(text)
+
+
+def press(composer, *keys):
+    '''Press and release keys, a letter or a name of keysyms.NAMES each.
+    Returns whether each press was consumed.
+    '''
+    consumed = []
+    for key in keys:
+        keyval = ord(key) if len(key) == 1 and key.isalpha() else _KEYVALS[key]
+        consumed.append(composer.process_key_event(keyval, 0, 0))
+        composer.process_key_event(keyval, 0, keysyms.RELEASE_MASK)
+    return consumed
+
+
+@pytest.fixture(autouse=True)
+def synchronous(monkeypatch):
+    # Wubi and pinyin candidates in one update, no time budgets
+    monkeypatch.setattr(config, 'PINYIN_BUDGET_MS', None)
+    monkeypatch.setattr(config, 'ASSOCIATION_BUDGET_MS', 1e6)
+    monkeypatch.setattr(config, 'AUTO_COMMIT_UNIQUE', False)
+
+
+@pytest.fixture
+def context(conn):
+    dictionary = dictdb.SqliteDictionary(conn)
+    yield Context(dictionary)
+    dictionary.close()
+
+
+@pytest.fixture
+def composer(context):
+    composer = Composer(context, RecordingFrontend())
+    composer.set_input_mode(1)
+    return composer
+
+
+def _phrases(composer):
+    return [phrase for phrase, text in composer.table.candidates]
+
+
+def test_direct_input_passes_letters_through(context):
+    composer = Composer(context, RecordingFrontend())
+    assert press(composer, 'a') == [False]
+    assert composer.preedit_string == ''
+
+
+def test_typing_shows_the_candidates(composer, context):
+    code = next(code for code, exact, extensions, count in sorted(context.dictionary.wubi.nodes())
+                if len(code) == 3 and exact)
+    press(composer, *code)
+    assert composer.preedit_string == code
+    exact = list(dict.fromkeys(phrase for phrase, freq in context.dictionary.lookup(code)[0]))
+    assert _phrases(composer)[:len(exact)] == exact
+    press(composer, 'BackSpace')
+    assert composer.preedit_string == code[:-1]
+    assert composer.table.candidates == IWubi(context).find_characters(code[:-1]).output
+
+
+def test_space_and_digits_select(composer):
+    press(composer, 'a')
+    phrases = _phrases(composer)
+    press(composer, 'space')
+    press(composer, 'a', '3')
+    press(composer, 'a', '0')
+    assert composer.frontend.commits == [phrases[0], phrases[2], phrases[9]]
+    assert composer.preedit_string == ''
+
+
+def test_digit_past_the_candidates_is_ignored(composer, context):
+    code = next(code for code, exact, extensions, count in sorted(context.dictionary.wubi.nodes())
+                if len(code) == 4 and 0 < len(exact) < 5 and not context.dictionary.pinyin_rows(code, 1))
+    press(composer, *code)
+    assert press(composer, '9') == [False]
+    assert composer.frontend.commits == []
+    assert composer.preedit_string == code
+
+
+def test_fifth_key_commits_the_first_candidate(composer, context):
+    code = next(code for code, exact, extensions, count in sorted(context.dictionary.wubi.nodes())
+                if len(code) == 4 and exact)
+    press(composer, *code)
+    first = _phrases(composer)[0]
+    assert press(composer, 'b') == [True]
+    assert composer.frontend.commits == [first]
+    assert composer.preedit_string == 'b'
+
+
+def test_fifth_key_without_wubi_candidates_extends_the_code(composer):
+    # y starts no code of the dictionary
+    press(composer, 'y', 'y', 'y', 'y', 'a')
+    assert composer.frontend.commits == []
+    assert composer.preedit_string == 'yyyya'
+
+
+def test_paging(composer):
+    press(composer, 'a')
+    first_page = _phrases(composer)
+    assert len(first_page) == composer.table.page_size
+    press(composer, 'Page_Down')
+    # The next page is fetched as it is shown
+    assert composer.table.cursor_pos == composer.table.page_size
+    phrases = _phrases(composer)
+    assert phrases[:len(first_page)] == first_page
+    assert len(phrases) > len(first_page)
+    assert len(set(phrases)) == len(phrases)
+    press(composer, 'Page_Up')
+    assert composer.table.cursor_pos == 0
+    press(composer, 'Page_Down', '2')
+    assert composer.frontend.commits == [phrases[composer.table.page_size + 1]]
+
+
+def test_escape_clears(composer):
+    press(composer, 'a', 'b', 'Escape')
+    assert composer.preedit_string == ''
+    assert len(composer.table) == 0
+    assert composer.frontend.commits == []
+
+
+def test_punctuation_commits_and_translates(composer):
+    press(composer, 'a')
+    first = _phrases(composer)[0]
+    assert press(composer, 'comma') == [True]
+    assert composer.frontend.commits == [first, '，']
+
+
+@pytest.fixture
+def associations(db_file, context):
+    context.associations = Associations(db_file)
+    yield context.associations
+    context.associations.close()
+
+
+def _associated(composer, associations):
+    # Commit candidates until one is followed by associations, returns it
+    for code in 'abcde':
+        for key in '1234567890':
+            press(composer, code, key)
+            if composer.associating:
+                return composer.frontend.commits[-1]
+    raise AssertionError('No association shown')
+
+
+def test_associations_after_a_commit(composer, associations):
+    committed = _associated(composer, associations)
+    expected = associations.lookup(committed, composer.table.page_size)
+    assert expected
+    assert _phrases(composer) == expected
+    assert composer.preedit_string == ''
+
+    # A digit picks one, which may show associations in turn
+    press(composer, '1')
+    assert composer.frontend.commits[-1] == expected[0]
+    assert composer.associating == bool(associations.lookup(expected[0], 1))
+
+
+def test_associations_are_dismissed(composer, associations):
+    _associated(composer, associations)
+    commits = len(composer.frontend.commits)
+    press(composer, 'Escape')
+    assert not composer.associating
+    assert len(composer.table) == 0
+
+    # Any other key dismisses them and is handled as usual
+    _associated(composer, associations)
+    commits = len(composer.frontend.commits)
+    press(composer, 'b')
+    assert not composer.associating
+    assert composer.preedit_string == 'b'
+    assert len(composer.frontend.commits) == commits
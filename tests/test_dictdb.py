@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+import sqlite3
+
+import pytest
+
+import dictdb
+
+
+def _columns(conn, table):
+    return [row[1] for row in conn.execute('PRAGMA table_info({})'.format(table))]
+
+
+def _tables(conn):
+    return set(row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'"))
+
+
+def test_migrate_from_version_0(v0_db):
+    conn = sqlite3.connect(v0_db)
+    assert dictdb.schema_version(conn) == 0
+    assert dictdb.dictionary_stamp(conn.cursor()) is None
+
+    assert dictdb.migrate(conn) == [version for version, step in dictdb.MIGRATIONS]
+    assert dictdb.schema_version(conn) == dictdb.SCHEMA_VERSION
+    assert {'phrases', 'pinyins', 'pinyin_prefixes', 'associations', 'bigrams', 'iwubi_meta'} <= _tables(conn)
+    assert 'charset' in _columns(conn, 'phrases')
+    assert 'charset' in _columns(conn, 'pinyins')
+    assert conn.execute('SELECT count(*) FROM phrases WHERE charset IS NULL').fetchone()[0] == 0
+    assert dictdb.pinyin_prefix_max_len(conn.cursor(), 10) == dictdb.config.PINYIN_PREFIX_MAX_LEN
+    assert dictdb.check_query_plans(conn) == []
+    stamp = dictdb.dictionary_stamp(conn.cursor())
+    assert stamp is not None
+
+    # Nothing left to do
+    assert dictdb.migrate(conn) == []
+    assert dictdb.dictionary_stamp(conn.cursor()) == stamp
+    conn.close()
+
+
+def test_migrated_pinyin_prefixes_match_the_pinyins(db_file):
+    conn = sqlite3.connect(db_file)
+    dictionary = dictdb.SqliteDictionary(conn)
+    for prefix in ('b', 'ba', 'zh', 'zhon', 'e'):
+        low, high = dictdb.prefix_range(prefix)
+        expected = [(pinyin, phrase) for phrase, pinyin in conn.execute(
+            dictdb.PINYIN_RANGE_QUERY, (low, high, dictdb.CHARSET_FULL, 10))]
+        assert dictionary.pinyin_rows(prefix, 10) == expected
+    dictionary.close()
+    conn.close()
+
+
+def test_failed_migration_is_rolled_back(v0_db, monkeypatch):
+    conn = sqlite3.connect(v0_db)
+    monkeypatch.setattr(dictdb, 'MIGRATIONS', dictdb.MIGRATIONS[:-1])
+    dictdb.migrate(conn)
+    monkeypatch.undo()
+
+    def fail(cursor, *args):
+        raise RuntimeError('interrupted')
+    # The last step of _migrate_6, after its ALTER TABLE
+    monkeypatch.setattr(dictdb, 'build_associations', fail)
+    with pytest.raises(RuntimeError):
+        dictdb.migrate(conn)
+    assert dictdb.schema_version(conn) == dictdb.SCHEMA_VERSION - 1
+    assert 'charset' not in _columns(conn, 'phrases')
+
+    monkeypatch.undo()
+    assert dictdb.migrate(conn) == [dictdb.SCHEMA_VERSION]
+    assert 'charset' in _columns(conn, 'phrases')
+    conn.close()
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+import sqlite3
+
+import pytest
+
+import dictdb
+from composer import Context, IWubi
+from lookup_cache import LookupCache
+
+
+def test_evicts_the_least_recently_used():
+    cache = LookupCache(3)
+    for key in 'abc':
+        cache.put(key, key.upper())
+    # A hit makes a the most recent, peek() leaves b the least recent
+    assert cache.get('a') == 'A'
+    assert cache.peek('b') == 'B'
+    cache.put('d', 'D')
+    assert cache.peek('b') is None
+    assert [key for key, entry in cache.items()] == ['c', 'a', 'd']
+    assert (cache.hits, cache.misses, cache.evictions) == (1, 0, 1)
+    assert cache.get('b') is None
+    assert cache.misses == 1
+
+
+def test_put_replaces_and_refreshes():
+    cache = LookupCache(2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    cache.put('a', 3)
+    cache.put('c', 4)
+    assert dict(cache.items()) == {'a': 3, 'c': 4}
+
+
+def test_discard_and_invalidate():
+    cache = LookupCache(4)
+    for key in 'abc':
+        cache.put(key, key)
+    cache.discard(['a', 'x'])
+    assert [key for key, entry in cache.items()] == ['b', 'c']
+    generation = cache.generation
+    cache.invalidate()
+    assert len(cache) == 0
+    assert cache.generation == generation + 1
+
+
+@pytest.fixture
+def dictionary(conn):
+    dictionary = dictdb.SqliteDictionary(conn)
+    yield dictionary
+    dictionary.close()
+
+
+def _complete_parents(dictionary):
+    # (code, child) pairs whose code has a complete result, so that the
+    # lookup of child is narrowed from it
+    iwubi = IWubi(Context(dictionary))
+    for code, exact, extensions, extension_count in sorted(dictionary.wubi.nodes()):
+        if extension_count and iwubi.find_characters(code).complete:
+            for row in extensions:
+                yield code, row[0][:len(code) + 1]
+
+
+def test_narrowed_lookups_match_fresh_ones(dictionary):
+    pairs = list(_complete_parents(dictionary))
+    assert pairs
+    for code, child in pairs:
+        iwubi = IWubi(Context(dictionary))
+        iwubi.find_characters(code)
+        narrowed = iwubi.find_characters(child)
+        assert iwubi.narrowed == 1
+        assert iwubi.last_query_count == 0
+        fresh = IWubi(Context(dictionary)).find_characters(child)
+        assert narrowed.output == fresh.output
+        assert narrowed.len_wubi_list == fresh.len_wubi_list
+        assert narrowed.complete == fresh.complete
+
+
+def test_incomplete_results_are_not_narrowed(dictionary):
+    iwubi = IWubi(Context(dictionary))
+    # The top rows of a one key code are far from all its rows
+    assert not iwubi.find_characters('a').complete
+    iwubi.find_characters('ab')
+    assert iwubi.narrowed == 0
+    # Cached, narrowed or not
+    assert iwubi.find_characters('ab') is iwubi.find_characters('ab')
+    assert iwubi.cache.hits == 2
+
+
+def test_cache_is_dropped_with_the_dictionary(db_file, dictionary):
+    context = Context(dictionary)
+    iwubi = IWubi(context)
+    first = iwubi.find_characters('a')
+    assert iwubi.find_characters('a') is first
+    conn = sqlite3.connect(db_file)
+    context.dictionary = dictdb.SqliteDictionary(conn)
+    reloaded = iwubi.find_characters('a')
+    assert reloaded is not first
+    assert reloaded.output == first.output
+    context.dictionary.close()
+    conn.close()
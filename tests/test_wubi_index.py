@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+import itertools
+import random
+import sqlite3
+
+import pytest
+
+import config
+from conftest import CODE_KEYS
+from dictdb import prefix_range
+from wubi_index import PositionIndex, WubiIndex
+
+ROWS_QUERY = '''SELECT tabkeys, phrase, freq
+    FROM phrases
+    WHERE freq > 0 AND {}
+    ORDER BY freq DESC, id'''
+
+# Every code of up to three keys, and some longer ones and misses
+CODES = [''.join(keys) for n in range(1, 4) for keys in itertools.product(CODE_KEYS, repeat=n)] + \
+    ['abcd', 'eeee', 'dcba', 'y', 'ay', 'abcde']
+WILDCARD = config.WILDCARD_KEY
+PATTERNS = [WILDCARD, 'a' + WILDCARD, WILDCARD + 'b', WILDCARD * 2, 'a' + WILDCARD + 'c', WILDCARD + 'b' + WILDCARD,
+            WILDCARD * 3 + 'd', 'ab' + WILDCARD + 'e', WILDCARD * 4, 'y' + WILDCARD, WILDCARD * 5]
+
+
+@pytest.fixture(scope='module')
+def index(db_file):
+    conn = sqlite3.connect(db_file)
+    index = WubiIndex.from_db(conn.cursor())
+    yield index
+    conn.close()
+
+
+def _like(pattern):
+    # The LIKE pattern of the rows whose tabkeys start with pattern
+    return "tabkeys LIKE '{}%'".format(pattern.replace(WILDCARD, '_'))
+
+
+def _pages(fetch, size):
+    rows, after = fetch(None, size)
+    pages = [rows]
+    while len(rows) == size:
+        rows, after = fetch(after, size)
+        pages.append(rows)
+    return list(itertools.chain.from_iterable(pages))
+
+
+@pytest.mark.parametrize('code', CODES)
+def test_lookup_matches_sql(index, conn, code):
+    exact, extensions = index.lookup(code)
+    assert list(exact) == [(phrase, freq) for tabkeys, phrase, freq in
+                           conn.execute(ROWS_QUERY.format('tabkeys = ?'), (code,))]
+    low, high = prefix_range(code)
+    extending = conn.execute(ROWS_QUERY.format('tabkeys > ? AND tabkeys < ?'), (low, high)).fetchall()
+    assert list(extensions) == extending[:index.top_k]
+    assert index.extension_count(code) == len(extending)
+    # Paged past the top-k in the same order, whatever the page size
+    for size in (1, 7, 100):
+        assert _pages(lambda after, limit: index.extensions_page(code, after, limit), size) == extending
+
+
+def test_code_of_is_the_shortest_code(index, conn):
+    codes = {}
+    for tabkeys, phrase in conn.execute('SELECT tabkeys, phrase FROM phrases ORDER BY freq DESC, id'):
+        if phrase not in codes or len(tabkeys) < len(codes[phrase]):
+            codes[phrase] = tabkeys
+    assert dict(index.codes()) == codes
+
+
+@pytest.mark.parametrize('pattern', PATTERNS)
+def test_wildcard_page_matches_sql(index, conn, pattern):
+    expected = conn.execute(ROWS_QUERY.format(_like(pattern))).fetchall()
+    for size in (1, 10, 1000):
+        assert _pages(lambda after, limit: index.wildcard_page(pattern, after, limit), size) == expected
+
+
+class SmallBlocks(PositionIndex):
+    # Many blocks for few rows, so that pages cross blocks
+    BLOCK_BITS = 64
+
+
+@pytest.mark.parametrize('pattern', PATTERNS)
+def test_position_index_pages_across_blocks(pattern):
+    rng = random.Random(pattern)
+    keys = CODE_KEYS + 'xy'
+    codes = [''.join(rng.choice(keys) for n in range(rng.randint(1, 4))) for i in range(1000)]
+    positions = SmallBlocks(SmallBlocks.bitsets(codes))
+    expected = [rank for rank, code in enumerate(codes) if len(code) >= len(pattern) and
+                all(key == WILDCARD or key == code_key for key, code_key in zip(pattern, code))]
+    for size in (1, 3, 64, 5000):
+        ranks, after = [], None
+        while True:
+            page = positions.ranks(pattern, after, size)
+            ranks.extend(page)
+            if len(page) < size:
+                break
+            after = page[-1]
+        assert ranks == expected
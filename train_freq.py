@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+'''Train the freq of the iWubi dictionary on text corpora.
+
+The corpora are streamed in chunks of about CHUNK_BYTES, cut at line ends
+or punctuation, and a pool of processes counts the phrases of each chunk by longest match
+against the phrases of wubi-jidian86.db that are candidates (freq > 0),
+Wubi and pinyin. The partial counts are summed as they come back, so
+memory depends on the dictionary, not on the corpora.
+
+Each table then gets its counts scaled to the total of its freq, blended
+with the freq it had, and written back in one transaction together with
+pinyin_prefixes and associations, which derive from freq. Rows with
+freq 0, the large Chinese table, stay hidden. The freq of the pinyin rows
+are those of the database: rebuilding it from pinyin_simp.dict.csv (make
+dict) brings back the untrained freq.
+'''
+import argparse
+import collections
+import multiprocessing
+import os
+import sqlite3
+import sys
+import time
+
+import dictdb
+from compiled_dict import compile_charsets
+from convert import ordered_results, phrase_lengths
+
+# Tables trained, their candidate rows are (id, phrase, freq)
+TABLES = ('phrases', 'pinyins')
+ROWS_QUERY = 'SELECT id, phrase, freq FROM {} WHERE freq > 0'
+UPDATE_QUERY = 'UPDATE {} SET freq = ? WHERE id = ?'
+
+CHUNK_BYTES = 1 << 22
+# Where a chunk may end without cutting a phrase: line ends and the
+# punctuation of Chinese text, looked for in the last CHUNK_TAIL_BYTES of
+# the chunk. Without any, as in a corpus with no line ends, the chunk ends
+# at a character and may cut one phrase.
+CHUNK_ENDS = tuple(end.encode('utf-8') for end in ('\n', '。', '！', '？', '；', '，'))
+CHUNK_TAIL_BYTES = 1 << 16
+# Seconds between progress lines
+PROGRESS_INTERVAL = 1.0
+
+
+class Vocabulary(object):
+    '''The candidate phrases of a dictionary, for longest match counting.'''
+
+    def __init__(self, phrases):
+        self.phrases = set(phrases)
+        self.lengths = phrase_lengths(self.phrases)
+
+    @classmethod
+    def from_db(cls, db_file):
+        conn = sqlite3.connect(db_file)
+        try:
+            return cls(phrase for table in TABLES
+                       for row_id, phrase, freq in conn.execute(ROWS_QUERY.format(table)))
+        finally:
+            conn.close()
+
+    def count(self, text):
+        '''Return the collections.Counter of the phrases of text.'''
+        phrases = self.phrases
+        lengths = self.lengths
+        counts = collections.Counter()
+        i, end = 0, len(text)
+        while i < end:
+            for length in lengths.get(text[i], ()):
+                if length <= end - i and text[i:i + length] in phrases:
+                    counts[text[i:i + length]] += 1
+                    i += length
+                    break
+            else:
+                i += 1
+        return counts
+
+
+# The Vocabulary of a worker process, built once by _init_worker()
+_vocabulary = None
+
+
+def _init_worker(db_file):
+    global _vocabulary
+    _vocabulary = Vocabulary.from_db(db_file)
+
+
+def _count_chunk(data, vocabulary=None):
+    # Returns (Counter of the phrases, characters) of the UTF-8 bytes data
+    text = data.decode('utf-8', errors='replace')
+    return (vocabulary or _vocabulary).count(text), len(text)
+
+
+def _chunk_end(data, start):
+    # The end of the last of CHUNK_ENDS in data[start:], else the start of
+    # its last character
+    cut = -1
+    for end in CHUNK_ENDS:
+        found = data.rfind(end, start)
+        if found >= 0:
+            cut = max(cut, found + len(end))
+    if cut >= 0:
+        return cut
+    cut = len(data) - 1
+    while cut > start and data[cut] & 0xc0 == 0x80:
+        cut -= 1
+    return cut
+
+
+def read_chunks(paths, chunk_bytes):
+    '''Yield the files, '-' being stdin, as bytes of about chunk_bytes, each
+    ending at one of CHUNK_ENDS so that no phrase is cut. What follows it
+    starts the next chunk.
+    '''
+    for path in paths:
+        f = sys.stdin.buffer if path == '-' else open(path, 'rb')
+        try:
+            rest = b''
+            while True:
+                data = f.read(chunk_bytes)
+                if not data:
+                    break
+                data = rest + data
+                cut = _chunk_end(data, max(len(data) - CHUNK_TAIL_BYTES, 0))
+                rest = data[cut:]
+                if cut:
+                    yield data[:cut]
+            if rest:
+                yield rest
+        finally:
+            if path != '-':
+                f.close()
+
+
+def count_corpora(db_file, paths, jobs, chunk_bytes=CHUNK_BYTES, progress=None):
+    '''Count the phrases of the files paths with jobs processes. Returns
+    (Counter, characters). progress, if given, is called with the bytes
+    and characters read so far after each chunk.
+    '''
+    counts = collections.Counter()
+    chars = read = 0
+    chunks = read_chunks(paths, chunk_bytes)
+    if jobs <= 1:
+        vocabulary = Vocabulary.from_db(db_file)
+        results = ((_count_chunk(data, vocabulary), len(data)) for data in chunks)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(jobs, _init_worker, (db_file,))
+        sizes = collections.deque()
+
+        def arguments():
+            for data in chunks:
+                sizes.append(len(data))
+                yield (data,)
+        results = ((result, sizes.popleft())
+                   for result in ordered_results(pool, _count_chunk, arguments(), jobs * 2))
+    try:
+        for (chunk_counts, chunk_chars), size in results:
+            counts.update(chunk_counts)
+            chars += chunk_chars
+            read += size
+            if progress is not None:
+                progress(read, chars)
+    finally:
+        if pool is not None:
+            pool.terminate()
+    return counts, chars
+
+
+def train(cursor, counts, weight):
+    '''Blend counts into the freq of the tables, weight being the share of
+    the corpus. Returns {table: rows changed}. Raises ValueError if the
+    dictionary is not at dictdb.SCHEMA_VERSION.
+
+    Counts are scaled so that they sum to the freq of the table, then
+    freq = (1 - weight) * freq + weight * scaled count, at least 1.
+    '''
+    if dictdb.schema_version(cursor) < dictdb.SCHEMA_VERSION:
+        raise ValueError('The dictionary is not up to date, run "dictdb.py migrate" first')
+    changed = {}
+    for table in TABLES:
+        rows = cursor.execute(ROWS_QUERY.format(table)).fetchall()
+        total_freq = sum(row[2] for row in rows)
+        total_count = sum(counts.get(row[1], 0) for row in rows)
+        if not total_count:
+            changed[table] = 0
+            continue
+        scale = float(total_freq) / total_count
+        updates = []
+        for row_id, phrase, freq in rows:
+            trained = max(int(round((1 - weight) * freq + weight * scale * counts.get(phrase, 0))), 1)
+            if trained != freq:
+                updates.append((trained, row_id))
+        cursor.executemany(UPDATE_QUERY.format(table), updates)
+        changed[table] = len(updates)
+    # Derived from freq
+    dictdb.build_pinyin_prefixes(cursor)
+    dictdb.build_associations(cursor)
+    dictdb.touch_dictionary(cursor)
+    return changed
+
+
+def main(argv=None):
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description='Train the phrase frequencies of the iWubi dictionary on text.')
+    parser.add_argument('files', nargs='*', default=['-'],
+                        help='UTF-8 corpora, - for stdin (default: stdin)')
+    parser.add_argument('--db', default=os.path.join(base_dir, 'wubi-jidian86.db'),
+                        help='Wubi dictionary to update (default: %(default)s)')
+    parser.add_argument('--weight', type=float, default=0.5,
+                        help='share of the corpus in the trained freq, 1 to replace it (default: %(default)s)')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1,
+                        help='worker processes, 1 to count in this one (default: %(default)s)')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='count and report, but leave the dictionary unchanged')
+    parser.add_argument('--compile', action='store_true',
+                        help='also compile the memory-mapped dictionary')
+    args = parser.parse_args(argv)
+    if not 0 <= args.weight <= 1:
+        parser.error('--weight must be between 0 and 1')
+
+    total = None
+    if '-' not in args.files:
+        total = sum(os.path.getsize(path) for path in args.files)
+    start = time.time()
+    last = [start]
+
+    def progress(read, chars):
+        now = time.time()
+        if now - last[0] < PROGRESS_INTERVAL:
+            return
+        last[0] = now
+        done = ' ({:.0%})'.format(float(read) / total) if total else ''
+        print('{:.1f} MB{}, {:.0f} chars/s'.format(read / 1e6, done, chars / (now - start)), file=sys.stderr)
+
+    counts, chars = count_corpora(args.db, args.files, args.jobs, progress=progress)
+    elapsed = time.time() - start
+    print('{} chars in {:.2f}s ({:.0f} chars/s, {} jobs): {} phrases, {} distinct'.format(
+        chars, elapsed, chars / max(elapsed, 1e-9), args.jobs, sum(counts.values()), len(counts)),
+        file=sys.stderr)
+    if args.dry_run:
+        return 0
+
+    conn = sqlite3.connect(args.db, isolation_level=None)
+    try:
+        # pinyin_prefixes and associations are rebuilt in their current form
+        dictdb.migrate(conn)
+        cursor = conn.cursor()
+        cursor.execute('BEGIN')
+        try:
+            changed = train(cursor, counts, args.weight)
+        except BaseException:
+            cursor.execute('ROLLBACK')
+            raise
+        cursor.execute('COMMIT')
+    finally:
+        conn.close()
+    print('{}: trained freq of {}'.format(
+        args.db, ', '.join('{} {} rows'.format(changed[table], table) for table in TABLES)))
+
+    if args.compile:
+        for output, size, seconds in compile_charsets(args.db):
+            print('{}: {} bytes in {:.2f}s'.format(output, size, seconds))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+import collections
+import os
+import sqlite3
+import threading
+
+import logconfig
+
+logger = logconfig.get_logger()
+
+# Applied to every phrases row of the phrase, however many codes it has
+FLUSH_QUERY = '''UPDATE phrases
+    SET user_freq = COALESCE(user_freq, 0) + ?
+    WHERE phrase = ?'''
+LOAD_QUERY = '''SELECT phrase, max(user_freq)
+    FROM phrases
+    WHERE user_freq > 0
+    GROUP BY phrase'''
+
+# Number of recorded phrases kept for recorded_since()
+RECENT_SIZE = 100
+
+
+def file_id(path):
+    '''Return what identifies the file at path, None if there is none.
+    It changes when the file is replaced, e.g. by installing a new dictionary.
+    '''
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_dev, st.st_ino
+
+
+class UserFreqRecorder(object):
+    '''Write-behind learning of phrases.user_freq.
+
+    record() only bumps in-memory counters, so committing a candidate never
+    touches the disk. A background thread with its own connection writes
+    the pending increments in one transaction every flush_interval seconds,
+    as soon as batch_size phrases are pending, when flush() is called (on
+    focus out) and on close(). A crash loses at most the increments of one
+    flush interval or batch. If the dictionary file is replaced, the thread
+    reconnects to the new one before its next flush.
+    '''
+
+    def __init__(self, db_file, flush_interval=30, batch_size=20):
+        self.db_file = db_file
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        # phrase -> user_freq, including pending increments
+        self.counts = {}
+        # Bumped whenever counts change, so that cached rankings are dropped
+        self.generation = 0
+        # The phrases recorded at the last generations, and the generation
+        # of the load, which changed every count
+        self._recent = collections.deque(maxlen=RECENT_SIZE)
+        self._loaded_generation = 0
+        self.flushed = 0
+        self._pending = collections.Counter()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closing = False
+        self._flush_failed = False
+        self._thread = threading.Thread(target=self._run, name='iwubi-user-freq', daemon=True)
+        self._thread.start()
+
+    def get(self, phrase):
+        return self.counts.get(phrase, 0)
+
+    def record(self, phrase):
+        with self._lock:
+            self.counts[phrase] = self.counts.get(phrase, 0) + 1
+            self._pending[phrase] += 1
+            pending = len(self._pending)
+            self._recent.append(phrase)
+            self.generation += 1
+        if pending >= self.batch_size:
+            self._wakeup.set()
+
+    def recorded_since(self, generation):
+        '''Return the phrases recorded since generation, an earlier value of
+        self.generation, or None if counts changed otherwise meanwhile or
+        too many were recorded to tell.
+        '''
+        with self._lock:
+            count = self.generation - generation
+            if generation < self._loaded_generation or count > len(self._recent):
+                return None
+            return list(self._recent)[len(self._recent) - count:]
+
+    def flush(self):
+        '''Ask the writer thread to flush now. Does not wait.'''
+        self._wakeup.set()
+
+    def close(self):
+        '''Flush what is pending and stop the writer thread.'''
+        self._closing = True
+        self._wakeup.set()
+        self._thread.join()
+
+    def _run(self):
+        try:
+            conn = sqlite3.connect(self.db_file)
+        except sqlite3.Error as e:
+            logger.warning('user_freq disabled, cannot open {}: {}'.format(self.db_file, e))
+            return
+        opened = file_id(self.db_file)
+        try:
+            self._load(conn)
+            while not self._closing:
+                self._wakeup.wait(self.flush_interval)
+                self._wakeup.clear()
+                if file_id(self.db_file) not in (opened, None):
+                    conn.close()
+                    conn = sqlite3.connect(self.db_file)
+                    opened = file_id(self.db_file)
+                self._flush(conn)
+            self._flush(conn)
+        finally:
+            conn.close()
+
+    def _load(self, conn):
+        try:
+            loaded = conn.execute(LOAD_QUERY).fetchall()
+        except sqlite3.Error as e:
+            logger.warning('Cannot load user_freq: {}'.format(e))
+            return
+        with self._lock:
+            for phrase, user_freq in loaded:
+                self.counts[phrase] = self.counts.get(phrase, 0) + user_freq
+            self.generation += 1
+            self._loaded_generation = self.generation
+        logger.info('Loaded user_freq of {} phrases'.format(len(loaded)))
+
+    def _flush(self, conn):
+        with self._lock:
+            pending, self._pending = self._pending, collections.Counter()
+        if not pending:
+            return
+        try:
+            with conn:
+                conn.executemany(FLUSH_QUERY, ((count, phrase) for phrase, count in pending.items()))
+        except sqlite3.Error as e:
+            # e.g. the dictionary is read-only. Keep the increments for the
+            # next attempt, ranking goes on from counts meanwhile.
+            if not self._flush_failed:
+                logger.warning('Cannot flush user_freq: {}'.format(e))
+                self._flush_failed = True
+            with self._lock:
+                self._pending.update(pending)
+            return
+        self._flush_failed = False
+        self.flushed += len(pending)
+        logger.debug('Flushed user_freq of {} phrases'.format(len(pending)))
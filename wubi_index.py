@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+import bisect
+import collections
+import heapq
+
+import config
+
+
+class PositionIndex(object):
+    '''Which rows have which key at each position of their Wubi code.
+
+    For every position and key, the rows are a bitset of row ranks, split in
+    blocks of BLOCK_BITS bits. A code with wildcards is matched by and-ing
+    the bitsets of its other keys block by block, in rank order, so the first
+    matches are the most frequent rows and a page usually needs only the
+    first blocks.
+    '''
+    # Keys of Wubi codes, each position has a bitset per key plus one of
+    # the rows with any key there
+    KEYS = 'abcdefghijklmnopqrstuvwxy'
+    MAX_CODE_LEN = 4
+    BLOCK_BITS = 4096
+
+    def __init__(self, bitsets):
+        # bitsets[position][slot] is the bytes of a bitset, slot being the
+        # index of the key in KEYS or len(KEYS) for any key
+        self._blocks = [[self._split(bits) for bits in slots] for slots in bitsets]
+        self._slots = dict((key, i) for i, key in enumerate(self.KEYS))
+
+    @classmethod
+    def _split(cls, bits):
+        size = cls.BLOCK_BITS // 8
+        return [int.from_bytes(bits[i:i + size], 'little') for i in range(0, len(bits), size)]
+
+    @classmethod
+    def bitsets(cls, codes):
+        '''Return the bitsets of codes, the tabkeys of the rows in rank
+        order, as PositionIndex() takes them.
+        '''
+        codes = list(codes)
+        size = (len(codes) + 7) // 8
+        any_key = len(cls.KEYS)
+        bitsets = [[bytearray(size) for slot in range(any_key + 1)] for position in range(cls.MAX_CODE_LEN)]
+        slots = dict((key, i) for i, key in enumerate(cls.KEYS))
+        for rank, tabkeys in enumerate(codes):
+            byte, bit = rank >> 3, 1 << (rank & 7)
+            for slot_bits, key in zip(bitsets, tabkeys):
+                slot = slots.get(key)
+                if slot is not None:
+                    slot_bits[slot][byte] |= bit
+                slot_bits[any_key][byte] |= bit
+        return bitsets
+
+    def ranks(self, pattern, after, limit):
+        '''Return the ranks, in order, of the next limit rows whose tabkeys
+        start with pattern, config.WILDCARD_KEY in pattern matching any key.
+        Only ranks greater than after are returned, after is None for the
+        first page.
+        '''
+        if len(pattern) > self.MAX_CODE_LEN:
+            return []
+        # A key at the last position, and the other keys of pattern
+        blocks = [self._blocks[len(pattern) - 1][len(self.KEYS)]]
+        for position, key in enumerate(pattern):
+            if key != config.WILDCARD_KEY:
+                slot = self._slots.get(key)
+                if slot is None:
+                    return []
+                blocks.append(self._blocks[position][slot])
+        start = 0 if after is None else after + 1
+        first_block = start // self.BLOCK_BITS
+        ranks = []
+        for block in range(first_block, len(blocks[0])):
+            bits = blocks[0][block]
+            for other in blocks[1:]:
+                if not bits:
+                    break
+                bits &= other[block]
+            base = block * self.BLOCK_BITS
+            if block == first_block:
+                bits &= -1 << (start - base)
+            while bits:
+                low = bits & -bits
+                ranks.append(base + low.bit_length() - 1)
+                if len(ranks) == limit:
+                    return ranks
+                bits ^= low
+        return ranks
+
+
+class _Node(object):
+    __slots__ = ('exact', 'extensions', 'extension_count')
+
+    def __init__(self):
+        # All (phrase, freq) whose tabkeys equal this prefix, ordered by
+        # freq DESC.
+        self.exact = []
+        # The top-k (tabkeys, phrase, freq) whose tabkeys strictly extend
+        # this prefix, ordered by freq DESC.
+        self.extensions = []
+        # Total number of rows strictly extending this prefix
+        self.extension_count = 0
+
+
+class WubiIndex(object):
+    '''In-memory prefix index over the ``phrases`` table.
+
+    Every prefix of every Wubi code is a node of a flattened trie, so a lookup
+    is a single dict access (O(code length) to hash the code) and never
+    touches SQLite. Each node already holds its frequency ordered candidates.
+
+    The index also keeps the reverse mapping phrase -> shortest Wubi code,
+    used to show the Wubi code of pinyin candidates, every row sorted by
+    code for extensions_page(), which pages past the top-k, and the
+    PositionIndex of the rows for wildcard_page().
+    '''
+
+    def __init__(self, top_k=10):
+        self.top_k = top_k
+        self._nodes = collections.defaultdict(_Node)
+        self._codes = {}
+        # Every (tabkeys, phrase, freq) row, the index in the list is its rank
+        self._rows = []
+        # Ranks ordered by tabkeys, and their tabkeys, built by sort()
+        self._by_code = []
+        self._sorted_codes = []
+        self.positions = None
+
+    def add(self, tabkeys, phrase, freq):
+        '''Add a row. Rows must be added in descending freq order, and
+        sort() called once they all are.
+        '''
+        nodes = self._nodes
+        row = (tabkeys, phrase, freq)
+        self._rows.append(row)
+        nodes[tabkeys].exact.append((phrase, freq))
+        for i in range(1, len(tabkeys)):
+            node = nodes[tabkeys[:i]]
+            node.extension_count += 1
+            if len(node.extensions) < self.top_k:
+                node.extensions.append(row)
+
+    def sort(self):
+        # sorted() is stable, rows of the same code stay in rank order
+        rows = self._rows
+        self._by_code = sorted(range(len(rows)), key=lambda rank: rows[rank][0])
+        self._sorted_codes = [rows[rank][0] for rank in self._by_code]
+        self.positions = PositionIndex(PositionIndex.bitsets(row[0] for row in rows))
+
+    def add_code(self, tabkeys, phrase):
+        '''Record tabkeys as a code of phrase, keeping the shortest one.'''
+        known = self._codes.get(phrase)
+        if known is None or len(tabkeys) < len(known):
+            self._codes[phrase] = tabkeys
+
+    def code_of(self, phrase):
+        '''Return the shortest Wubi code of phrase, or None.'''
+        return self._codes.get(phrase)
+
+    def lookup(self, code):
+        '''Return ``(exact, extensions)`` for the Wubi code ``code``.
+
+        ``exact`` is the list of ``(phrase, freq)`` whose tabkeys equal
+        ``code``, ``extensions`` is the list of the top-k
+        ``(tabkeys, phrase, freq)`` whose tabkeys start with, but are not
+        equal to, ``code``. Both are ordered by freq DESC.
+        '''
+        node = self._nodes.get(code)
+        if node is None:
+            return (), ()
+        return node.exact, node.extensions
+
+    def extensions_page(self, code, after, limit):
+        '''Return the next limit rows strictly extending code, and the key
+        to pass as after to get the rows past them.
+
+        Rows are (tabkeys, phrase, freq) in the order of lookup(). after is
+        None for the first page. Each page costs the same, however deep.
+        '''
+        codes = self._sorted_codes
+        # Rows of the code itself sort first, skip them
+        low = bisect.bisect_right(codes, code)
+        high = bisect.bisect_left(codes, code[:-1] + chr(ord(code[-1]) + 1), low)
+        after = -1 if after is None else after
+        ranks = heapq.nsmallest(limit, (rank for rank in self._by_code[low:high] if rank > after))
+        return [self._rows[rank] for rank in ranks], ranks[-1] if ranks else after
+
+    def wildcard_page(self, pattern, after, limit):
+        '''Return the next limit (tabkeys, phrase, freq) rows whose tabkeys
+        start with pattern, config.WILDCARD_KEY matching any key, ranked
+        after the key after (None for the first page), and the key of the
+        last one.
+        '''
+        ranks = self.positions.ranks(pattern, after, limit)
+        return [self._rows[rank] for rank in ranks], ranks[-1] if ranks else after
+
+    def rows_by_code(self):
+        '''Yield (rank, tabkeys, phrase, freq) for every row, ordered by tabkeys.'''
+        rows = self._rows
+        for rank in self._by_code:
+            yield (rank,) + rows[rank]
+
+    def extension_count(self, code):
+        '''Return the number of rows whose tabkeys strictly extend code.'''
+        node = self._nodes.get(code)
+        return node.extension_count if node is not None else 0
+
+    def unique(self, code):
+        '''Return the phrase of the only row whose tabkeys start with code,
+        or None if there are none or several.
+        '''
+        node = self._nodes.get(code)
+        if node is None or len(node.exact) + node.extension_count != 1:
+            return None
+        return node.exact[0][0] if node.exact else node.extensions[0][1]
+
+    def nodes(self):
+        '''Yield (prefix, exact, extensions, extension_count) for every node.'''
+        for prefix, node in self._nodes.items():
+            yield prefix, node.exact, node.extensions, node.extension_count
+
+    def codes(self):
+        '''Yield (phrase, shortest tabkeys) for every phrase.'''
+        return iter(self._codes.items())
+
+    def __len__(self):
+        return len(self._nodes)
+
+    @classmethod
+    def from_db(cls, cursor, top_k=10, charset=None):
+        '''Build the index from the ``phrases`` table.
+
+        freq==0 is the large Chinese table, which is never offered as a Wubi
+        candidate, so those rows only contribute to the reverse code mapping.
+        With charset, a dictdb.CHARSET_* value, only the rows of that charset
+        are indexed.
+        '''
+        index = cls(top_k)
+        if charset is None:
+            rows = cursor.execute("""SELECT tabkeys, phrase, freq
+                FROM phrases
+                ORDER BY freq DESC, id""")
+        else:
+            rows = cursor.execute("""SELECT tabkeys, phrase, freq
+                FROM phrases
+                WHERE charset <= ?
+                ORDER BY freq DESC, id""", (charset,))
+        for tabkeys, phrase, freq in rows:
+            if freq > 0:
+                index.add(tabkeys, phrase, freq)
+            index.add_code(tabkeys, phrase)
+        index.sort()
+        return index